@@ -1,85 +1,267 @@
 from abc import *
 from solution import *
-from random import shuffle
+from random import randrange
 from itertools import permutations
-from collections import deque
+from math import inf
+from collections import deque, defaultdict
+import numpy as np
 
 
 class Allocator(metaclass=ABCMeta):
     # initially allocates workflows & their tasks to the given topology
     # returns 'a' solution
 
-    def __init__(self, topology, evaluator):
+    def __init__(self, topology, evaluator, solution_type=Solution):
         self.topology = topology
         self.evaluator = evaluator
-        self.temp_solution = Solution(self.topology, self.evaluator)
+        self.solution_type = solution_type  # Solution or ArraySolution
+        self.temp_solution = solution_type(self.topology, self.evaluator)
 
     @abstractmethod
     def allocate_workflows(self):
         return self.temp_solution
 
-
-class GreedyAllocator(Allocator):
-    # Greedy+DFS
+    @abstractmethod
+    def extend(self, solution, workflows):
+        # allocates 'workflows' into what is left in 'solution' (e.g. workflows that just arrived)
+        return solution
+
+
+class DepthFirstAllocator(Allocator):
+    # places the workflows one by one. the workflows that need the least go first, and a workflow is
+    # skipped when it needs at least as much as one that failed (see extend()). each workflow is
+    #   - first walked: every task on the first node in _walk_order() that takes it, next to the node of
+    #     the task before, without backtracking and without any setup (see _walk()). most workflows
+    #     are placed this way
+    #   - on a dead end, placed by depth-first search over chains of neighboring nodes (see _search()):
+    #       - forward checking: a node is a candidate only if the next task can follow it somewhere
+    #       - the candidates are narrowed to the nodes from which a chain of nodes with enough capacity
+    #         for the rest of the tasks exists (see _supported())
+    #       - candidates are tried in _order()
+    #     the search is iterative: one candidate iterator per mapped task, tasks are addressed by index
+
+    def __init__(self, topology, evaluator, solution_type=Solution):
+        super().__init__(topology, evaluator, solution_type)
+        self._allowed = None    # _supported() of the workflow being placed
+        self._next = 0          # see _walk_order()
 
     def allocate_workflows(self):
-        self.temp_solution = Solution(self.topology, self.evaluator)
-
-        for wf in self.topology.workflows:
-            for start_node in self.topology.all_nodes:
-                if self._alloc_wf_tasks(wf.tasks[:], None, start_node):
-                    break
+        return self.extend(self.solution_type(self.topology, self.evaluator), self.topology.workflows)
+
+    def extend(self, solution, workflows):
+        self.temp_solution = solution
+        self._next = 0
+        self._start(solution)
+
+        # capacity only shrinks during the loop: a workflow that needs at least as much as
+        # one that failed, task by task, fails too.
+        # failed[n_task]: demand_matrix rows of the failed workflows of that size, one row each
+        demand_matrix = self.topology.demand_matrix
+        failed = defaultdict(list)
+        for wf in sorted(workflows, key=self._demand):
+            if failed[wf.n_task]:
+                demands = demand_matrix[[task.index for task in wf.tasks]].ravel()
+                if (np.array(failed[wf.n_task]) <= demands).all(axis=1).any():
+                    continue
+            if not self._alloc_wf_tasks(wf):
+                failed[wf.n_task].append(demand_matrix[[task.index for task in wf.tasks]].ravel())
 
         return self.temp_solution
 
-    # recursive. constraints are managed in 'self.solution'
-    def _alloc_wf_tasks(self, tasks, prev_node, cur_node):
-        if not self.temp_solution.map(prev_node, tasks[0], cur_node):
-            return False
+    @staticmethod
+    def _demand(wf):
+        return wf.n_task, sum(sum(task.required_resources.values()) for task in wf.tasks)
+
+    def _walk_order(self, prev_node, mask):
+        # the nodes _walk() tries after prev_node (None: for the first task), in order. mask: the ones
+        # that may come, the neighbors of prev_node not in the workflow yet.
+        # by node.index, taken one at a time, from the one after the node taken last (next fit), around
+        all_nodes = self.topology.all_nodes
+        later = mask >> self._next << self._next
+        for bits in (later, mask ^ later):
+            while bits:
+                low = bits & -bits
+                yield all_nodes[low.bit_length() - 1]
+                bits ^= low
 
-        if len(tasks) == 1:
-            return True
+    @abstractmethod
+    def _order(self, mask):
+        # the nodes of a bitset, in the order _search() tries them
+        return self.topology.nodes_of(mask)
+
+    def _start(self, solution):
+        # before extend() places anything into 'solution'
+        pass
+
+    def _map(self, prev_node, task, node):
+        return self.temp_solution.map(prev_node, task, node)
+
+    def _unmap(self, task):
+        self.temp_solution.unmap(task)
+
+    def _alloc_wf_tasks(self, wf):
+        return self._walk(wf) or self._search(wf)
+
+    def _walk(self, wf):
+        # True if the walk placed 'wf'. on a dead end it is undone. it needs neither the host masks of the
+        # solution nor anything the search sets up
+        solution = self.temp_solution
+        adjacency_bits = self.topology.adjacency_bits
+        tasks = wf.tasks
+        prev_node, mask = None, (1 << self.topology.n_all_node) - 1
+        for i, task in enumerate(tasks):
+            for node in self._walk_order(prev_node, mask):
+                if self._map(prev_node, task, node):
+                    break
+            else:
+                for mapped in reversed(tasks[:i]):
+                    self._unmap(mapped)
+                return False
 
-        for next_node in cur_node.neighbors:
-            if self.temp_solution.mappable(cur_node, tasks[1], next_node) and \
-                    self._alloc_wf_tasks(tasks[1:], cur_node, next_node):
+            self._next = node.index + 1
+            prev_node, mask = node, adjacency_bits[node.index] & ~solution.visited_mask(wf)
+
+        return True
+
+    def _search(self, wf):
+        tasks = wf.tasks
+        last = len(tasks) - 1
+        self._allowed = self._supported(tasks)
+        for start_node, next_mask in self._candidates(tasks, 0, self._allowed[0]):
+            self._map(None, tasks[0], start_node)
+            if last == 0:
                 return True
 
-        self.temp_solution.unmap(tasks[0])
+            # path[i]: node of tasks[i], candidates[i]: what is left to try for tasks[i + 1]
+            path = [start_node]
+            candidates = [self._candidates(tasks, 1, next_mask)]
+            while candidates:
+                next_node, next_mask = next(candidates[-1], (None, 0))
+                if next_node is None:
+                    candidates.pop()
+                    self._unmap(tasks[len(path) - 1])
+                    path.pop()
+                    continue
+
+                i = len(path)
+                self._map(path[-1], tasks[i], next_node)
+                if i == last:
+                    return True
+
+                path.append(next_node)
+                candidates.append(self._candidates(tasks, i + 1, next_mask))
+
         return False
 
+    def _candidates(self, tasks, i, mask):
+        # mask: bitset of the nodes that can take tasks[i] (see Solution.candidate_mask()).
+        # yields the candidates in _order() that leave a neighbor for tasks[i + 1], each with the bitset
+        # of those neighbors: the mask of the next level. the candidates are taken when the search
+        # first asks for one, and the state does not change until it asks again
+        if i == len(tasks) - 1:
+            for node in self._order(mask):
+                yield node, 0
+            return
 
-class RandomAllocator(Allocator):
-    def allocate_workflows(self):
-        self.temp_solution = Solution(self.topology, self.evaluator)
+        # the nodes that can take tasks[i + 1], but the ones of the workflow (and the candidate, below)
+        solution = self.temp_solution
+        hosts = solution.host_mask(tasks[i + 1]) & ~solution.visited_mask(tasks[i].workflow) & self._allowed[i + 1]
+        adjacency_bits = self.topology.adjacency_bits
+        for node in self._order(mask):
+            next_mask = adjacency_bits[node.index] & hosts & ~(1 << node.index)
+            if next_mask:
+                yield node, next_mask
+
+    def _supported(self, tasks):
+        # supported[i]: bitset of the nodes that can take tasks[i], and from which tasks[i + 1:] can follow
+        # on a walk of linked nodes that can take them. a necessary condition only (the walk may
+        # revisit a node, and the capacity of each node is checked task by task), computed before
+        # the workflow is placed: what its own tasks take later only removes candidates
+        supported = [0] * len(tasks)
+        reachable = -1
+        for i in reversed(range(len(tasks))):
+            supported[i] = self.temp_solution.host_mask(tasks[i]) & reachable
+            reachable = self.topology.neighbors_of(supported[i])
+        return supported
+
+
+class GreedyAllocator(DepthFirstAllocator):
+    # Greedy+DFS. the walk goes by node.index (next fit). the search takes the nodes with the most capacity
+    # left (relatively) first: nodes are kept in N_TIER tiers of that fraction, as bitsets, so the
+    # candidates of the best tier come out first without ranking all of them. within a tier, in
+    # node.index order. the tiers are built when the first search starts
+    N_TIER = 8
+
+    def __init__(self, topology, evaluator, solution_type=Solution):
+        super().__init__(topology, evaluator, solution_type)
+        self._tier = None   # tier of every node by node.index, kept up to date by _map() / _unmap() once built
+        self._tier_bits = None
+
+    def _start(self, solution):
+        self._tier = self._tier_bits = None
+
+    def _search(self, wf):
+        if self._tier is None:
+            self._tier = [0] * self.topology.n_all_node
+            self._tier_bits = [0] * self.N_TIER
+            for node in self.topology.all_nodes:
+                self._tier_bits[0] |= 1 << node.index
+                self._update_tier(node)
+        return super()._search(wf)
+
+    def _update_tier(self, node):
+        # tier 0: the scarcest resource left on the node is (nearly) all of its capacity
+        available = self.temp_solution.available_resources[node]
+        left = min(available[name] / capacity for name, capacity in node.resources.items())
+        tier = min(self.N_TIER - 1, int((1 - left) * self.N_TIER))
+        if tier != self._tier[node.index]:
+            bit = 1 << node.index
+            self._tier_bits[self._tier[node.index]] &= ~bit
+            self._tier_bits[tier] |= bit
+            self._tier[node.index] = tier
+
+    def _map(self, prev_node, task, node):
+        if not super()._map(prev_node, task, node):
+            return False
+        if self._tier is not None:
+            self._update_tier(node)
+        return True
 
-        for wf in self.topology.workflows:
-            start_nodes = self.topology.all_nodes[:]
-            shuffle(start_nodes)
+    def _unmap(self, task):
+        node = self.temp_solution.task_to_node[task]
+        super()._unmap(task)
+        if self._tier is not None:
+            self._update_tier(node)
 
-            for start_node in start_nodes:
-                if self._alloc_wf_tasks(wf.tasks[:], None, start_node):
-                    break
+    def _order(self, mask):
+        for bits in self._tier_bits:
+            if mask & bits:
+                yield from self.topology.nodes_of(mask & bits)
 
-        return self.temp_solution
 
-    # recursive. constraints are managed in 'self.solution'
-    def _alloc_wf_tasks(self, tasks, prev_node, cur_node):
-        if not self.temp_solution.map(prev_node, tasks[0], cur_node):
-            return False
+class RandomAllocator(DepthFirstAllocator):
+    # candidates in random order, so that allocations are samples of the feasible space
 
-        if len(tasks) == 1:
-            return True
+    def _walk_order(self, prev_node, mask):
+        # the neighbors of prev_node shuffled, but the ones not in mask. the list is cached by the topology,
+        # cheaper than the one of the bitset
+        nodes = self.topology.neighbor_lists[prev_node.index] if prev_node else self.topology.all_nodes
+        for node in self._shuffled(nodes[:]):
+            if mask >> node.index & 1:
+                yield node
 
-        neighbors = list(cur_node.neighbors)
-        shuffle(neighbors)
-        for next_node in neighbors:
-            if self.temp_solution.mappable(cur_node, tasks[1], next_node) and \
-                    self._alloc_wf_tasks(tasks[1:], cur_node, next_node):
-                return True
+    def _order(self, mask):
+        return self._shuffled(self.topology.nodes_of(mask))
 
-        self.temp_solution.unmap(tasks[0])
-        return False
+    @staticmethod
+    def _shuffled(nodes):
+        # a shuffle drawn as the search goes: usually only the first few candidates are tried
+        n = len(nodes)
+        while n:
+            k = randrange(n)
+            yield nodes[k]
+            n -= 1
+            nodes[k] = nodes[n]
 
 
 # class OptimalAllocator(Allocator):
@@ -151,45 +333,191 @@ class RandomAllocator(Allocator):
 #         return False
 
 
+class PartialSolutions:
+    # every feasible placement of one workflow into the empty topology, packed:
+    #   nodes[k]: node.index of each task of the k-th placement
+    #   keys[k]:  evaluation key of a solution holding that placement only
+    #   demand:   demand_matrix rows of the workflow's tasks, shared by all the placements
+    #   energy[k]: energy of the links, charged to the nodes of all but the last task (fairness metric only, else None)
+    def __init__(self, topology, wf, placements, keys, energies=None):
+        self.nodes = np.array(placements, dtype=np.int32).reshape(-1, wf.n_task)
+        self.keys = np.array(keys, dtype=np.float64)
+        self.demand = topology.demand_matrix[[task.index for task in wf.tasks]]
+        self.energy = np.array(energies, dtype=np.float64).reshape(-1, wf.n_task - 1) if energies is not None else None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def sort(self):
+        # cheapest first, ties in lexicographic order of the node indices
+        order = np.lexsort(tuple(self.nodes[:, ::-1].T) + (self.keys,))
+        self.nodes, self.keys = self.nodes[order], self.keys[order]
+        if self.energy is not None:
+            self.energy = self.energy[order]
+
+    def share_keys(self, twins):
+        # placements that differ only by interchangeable nodes (twins[node.index]: its class, see
+        # OptimalAllocator._twins()) get exactly the same key: the key of the placement that uses
+        # the first members of each class
+        index = {tuple(row): k for k, row in enumerate(self.nodes.tolist())}
+        for k, row in enumerate(self.nodes.tolist()):
+            canonical, used = [], {}
+            for node in row:
+                members = twins[node]
+                used[members] = used.get(members, -1) + 1
+                canonical.append(members[used[members]])
+            self.keys[k] = self.keys[index[tuple(canonical)]]
+
+
 class OptimalAllocator(Allocator):
     # completely searches the problem space in the given topology
     # returns the best solution among the all possible assignments
-    def __init__(self, topology, evaluator):
-        super().__init__(topology, evaluator)
+    #
+    # branch and bound (default): workflows with fewer partial solutions are merged first,
+    # and a branch is pruned when a lower bound of its key cannot beat the best complete solution so far.
+    #   energy, distance: per-workflow contributions add up, so
+    #                     bound = contributions merged so far + minimum contribution of every remaining workflow
+    #   cost:             node costs grow at least as fast as the load (superadditive), so
+    #                     bound = cost of the merged part + minimum standalone cost of every remaining workflow
+    #   fairness:         Jain's index does not add up. the remaining workflows add at most their largest
+    #                     energy on at most one node per link; the index they can reach at best bounds the
+    #                     key (see _fairness_bound()). checked once per branch, before its placements
+    # branch_and_bound=False enumerates every combination (reference)
+    #
+    # symmetry breaking (with branch and bound): of the assignments that only differ by
+    #   - swapping the placements of identical workflows (same demands, task by task), or
+    #   - swapping interchangeable nodes (same type, same neighbors), for metrics that ignore positions,
+    # only the one first in search order is explored. identical workflows share their PartialSolutions
+    bounded_metrics = ('energy', 'distance', 'cost')
+    node_symmetric_metrics = ('cost',)
+
+    def __init__(self, topology, evaluator, solution_type=Solution, branch_and_bound=True,
+                 symmetry_breaking=True):
+        super().__init__(topology, evaluator, solution_type)
         # 각각의 워크플로우에 대해,
         #   (아무것도 할당되지 않은) 초기 상태의 솔루션에서
-        #   해당 워크플로우의 태스크를 전부 할당 가능한 경우들을 저장
-        self.partial_solutions = {wf: [] for wf in self.topology.workflows}
+        #   해당 워크플로우의 태스크를 전부 할당 가능한 경우들을 저장 (PartialSolutions)
+        self.partial_solutions = {}
+        self.branch_and_bound = branch_and_bound
+        self.symmetry_breaking = symmetry_breaking
         self.optimal_solution = None
-        self.n_case = 0
+        self.n_case = 0         # complete combinations evaluated
+        self.n_explored = 0     # partial solutions merged
+        self.n_pruned = 0       # branches cut by the bound
+        self.n_symmetric = 0    # partial solutions skipped as symmetric to an explored one
+
+        self._optimal_key = None
+        self._base_key = 0.0    # key of the solution the workflows are merged into (see extend())
+        self._merged_key = 0.0
+        self._remaining_min = []
+        self._energy = None     # fairness: energy charged to every node in temp_solution
+        self._charged = None    # fairness: links charged to every node in temp_solution
+        self._remaining_energy = []
+        self._remaining_links = []
+        self._residual = None   # capacity left in temp_solution, capacity_matrix layout
+        self._twins = None      # see _node_classes()
 
     def allocate_workflows(self):
-        self.temp_solution = Solution(self.topology, self.evaluator)
+        self._search_placements(self.solution_type(self.topology, self.evaluator), self.topology.workflows)
+        return self.optimal_solution
 
-        for wf in self.topology.workflows:
+    def extend(self, solution, workflows):
+        # the best placement of 'workflows' into what is left in 'solution'; the rest of it stays.
+        # if they do not all fit, each one in turn gets its cheapest placement that still fits
+        if not workflows:
+            return solution
+
+        self._search_placements(solution.clone(), workflows)
+        placed = self.optimal_solution
+        if placed is None:
+            self._place_one_by_one(workflows)
+            placed = self.temp_solution
+
+        for wf in workflows:
+            prev_node = None
+            for task in wf.tasks:
+                if not placed.is_mapped(task):
+                    break
+                target_node = placed.task_to_node[task]
+                solution.map(prev_node, task, target_node)
+                prev_node = target_node
+
+        return solution
+
+    def _search_placements(self, base, workflows):
+        # the best assignment of 'workflows' into what is left in 'base' -> self.optimal_solution
+        # (None if they do not all fit). placements are enumerated in the empty topology, then merged into 'base'
+        self.temp_solution = self.solution_type(self.topology, self.evaluator)
+        self.optimal_solution, self._optimal_key = None, None
+        self.n_case = self.n_explored = self.n_pruned = self.n_symmetric = 0
+        self.partial_solutions = {}
+
+        # the fairness bound needs the energy of every link, fixed by the placement alone (no routes)
+        fairness = self.branch_and_bound and self.evaluator.metric == 'fairness' and \
+            hasattr(self.evaluator, '_wf_links') and not self.evaluator.uses_routing
+        by_signature = {}
+        for wf in workflows:
+            signature = self._signature(wf)
+            if signature in by_signature:
+                self.partial_solutions[wf] = by_signature[signature]
+                continue
+
+            placements, keys, energies = [], [], [] if fairness else None
             for start_node in self.topology.all_nodes:
                 # 아래 호출에서 temp_solution 은 비어 있는 상태로 리턴함
-                # 탐색 결과는 partial_sulitions[wf]에 저장됨(result 매개변수)
-                self._alloc_wf_tasks(self.partial_solutions[wf],
-                                     wf.tasks[:], None, start_node)
-
-        self.temp_solution = Solution(self.topology, self.evaluator)
-        self._merge_partial_solutions(self.topology.workflows[:])
+                # 탐색 결과는 placements, keys에 저장됨(result 매개변수)
+                self._alloc_wf_tasks((placements, keys, energies), wf.tasks[:], None, start_node)
+            self.partial_solutions[wf] = by_signature[signature] = \
+                PartialSolutions(self.topology, wf, placements, keys, energies)
+
+        self.temp_solution = base
+        self._residual = np.array([[base.available_resources[node][name] for name in self.topology.resource_names]
+                                   for node in self.topology.all_nodes],
+                                  dtype=np.float64).reshape(self.topology.capacity_matrix.shape)
+        bounded = self.evaluator.metric in self.bounded_metrics
+        self._base_key = base.evaluate().key if bounded and base.workflow_alloc_cnt else 0.0
+        self._energy = self._charged = None
+        if fairness:
+            self._energy = np.zeros(self.topology.n_all_node)
+            self._charged = np.zeros(self.topology.n_all_node, dtype=np.int64)
+            for wf in self.topology.workflows:
+                if base.is_allocated(wf):
+                    for node, energy, _ in self.evaluator._wf_links(base, wf):
+                        self._energy[node.index] += energy
+                        self._charged[node.index] += 1
+        if self.branch_and_bound:
+            self._branch_and_bound(workflows)
+        else:
+            self._merge_partial_solutions(list(workflows))
 
         if DEBUG:
             print("[DBG] OptimalAllocator:")
             print()
             print(f"      found {self.n_case} cases")
+            print(f"      explored {self.n_explored}, pruned {self.n_pruned}, symmetric {self.n_symmetric}")
             print()
 
-        return self.optimal_solution
+    def _place_one_by_one(self, workflows):
+        # into temp_solution: the most constrained workflow first, each at its cheapest placement
+        # that fits next to the ones placed before it
+        for wf in sorted(workflows, key=lambda wf: len(self.partial_solutions[wf])):
+            partial_solutions = self.partial_solutions[wf]
+            fits = np.flatnonzero((self._residual[partial_solutions.nodes] >= partial_solutions.demand).all(axis=(1, 2)))
+            if len(fits):
+                k = fits[partial_solutions.keys[fits].argmin()]
+                self._merge(wf, partial_solutions, partial_solutions.nodes[k])
 
     def _alloc_wf_tasks(self, result, tasks, prev_node, cur_node):
         if not self.temp_solution.map(prev_node, tasks[0], cur_node):
             return False
 
         if len(tasks) == 1:
-            result.append(self.temp_solution.clone())
+            placements, keys, energies = result
+            wf = tasks[0].workflow
+            placements.append([node.index for node in self.temp_solution.wf_to_nodes[wf]])
+            keys.append(self.temp_solution.evaluate().key)
+            if energies is not None:
+                energies.append([energy for _, energy, _ in self.evaluator._wf_links(self.temp_solution, wf)])
             self.temp_solution.unmap(tasks[0])
             return True
 
@@ -210,31 +538,203 @@ class OptimalAllocator(Allocator):
             return
 
         cur_wf = workflows[0]
-        for partial_solution in self.partial_solutions[cur_wf]:
-            if self._mergeable(cur_wf, partial_solution):
-                self._merge(cur_wf, partial_solution)
+        partial_solutions = self.partial_solutions[cur_wf]
+        for nodes in partial_solutions.nodes:
+            if self._mergeable(partial_solutions, nodes):
+                self.n_explored += 1
+                self._merge(cur_wf, partial_solutions, nodes)
                 self._merge_partial_solutions(workflows[1:])
-                self._unmerge(cur_wf, partial_solution)
+                self._unmerge(cur_wf, partial_solutions, nodes)
             else:
                 # TODO: 충돌 날 경우 branch 만들어서 BFS 돌리기
                 pass
 
-    def _mergeable(self, wf, partial_solution):
-        prev_node = None
-        for task, target_node in zip(wf.tasks, partial_solution.wf_to_nodes[wf]):
-            if not self.temp_solution.mappable(prev_node, task, target_node):
-                return False
-            prev_node = target_node
+    def _branch_and_bound(self, workflows):
+        # most constrained workflow first, and the cheapest partial solutions of each first,
+        # so that a good incumbent is found early
+        # identical workflows end up next to each other
+        workflows = sorted(workflows, key=lambda wf: (len(self.partial_solutions[wf]), self._signature(wf)))
+        if not all(self.partial_solutions[wf] for wf in workflows):
+            return
+
+        bounded = self.evaluator.metric in self.bounded_metrics
+        self._twins = None
+        if self.symmetry_breaking and self.evaluator.metric in self.node_symmetric_metrics:
+            self._twins = self._node_classes()
+
+        for partial_solutions in {id(ps): ps for ps in self.partial_solutions.values()}.values():
+            if self._twins:
+                partial_solutions.share_keys(self._twins)
+            if bounded:
+                partial_solutions.sort()
+
+        # same_as_prev[i]: workflows[i] is identical to workflows[i - 1]
+        same_as_prev = [False] + [self.symmetry_breaking and self._signature(wf1) == self._signature(wf2)
+                                  for wf1, wf2 in zip(workflows, workflows[1:])]
+
+        # _remaining_min[i]: sum of the minimum keys of workflows[i:]
+        self._remaining_min = [0.0] * (len(workflows) + 1)
+        for i in reversed(range(len(workflows))):
+            self._remaining_min[i] = self._remaining_min[i + 1] + self.partial_solutions[workflows[i]].keys.min()
+
+        if self._energy is not None:
+            # _remaining_energy[i], _remaining_links[i]: the most energy workflows[i:] add, and on how many links
+            self._remaining_energy = [0.0] * (len(workflows) + 1)
+            self._remaining_links = [0] * (len(workflows) + 1)
+            for i in reversed(range(len(workflows))):
+                self._remaining_energy[i] = self._remaining_energy[i + 1] + \
+                    self.partial_solutions[workflows[i]].energy.sum(axis=1).max()
+                self._remaining_links[i] = self._remaining_links[i + 1] + workflows[i].n_task - 1
+
+        self._merged_key = self._base_key
+        self._search(workflows, same_as_prev, 0, 0, bounded)
+
+    def _search(self, workflows, same_as_prev, depth, first, bounded):
+        # first: where the partial solutions of workflows[depth] start. an identical workflow right after
+        # this one starts at the partial solution chosen here
+        if depth == len(workflows):
+            self.n_case += 1
+            key = self.temp_solution.evaluate().key
+            if self._optimal_key is None or key < self._optimal_key:
+                self.optimal_solution, self._optimal_key = self.temp_solution.clone(), key
+            return
+
+        if self._energy is not None and self._optimal_key is not None and \
+                self._fairness_bound(depth) >= self._optimal_key - 1e-9 * max(1.0, abs(self._optimal_key)):
+            self.n_pruned += 1
+            return
 
+        wf = workflows[depth]
+        partial_solutions = self.partial_solutions[wf]
+        untouched = (self._residual == self.topology.capacity_matrix).all(axis=1).tolist() if self._twins else None
+        keys = partial_solutions.keys.tolist()
+        for k in range(first, len(keys)):
+            nodes, key = partial_solutions.nodes[k], keys[k]
+            # only a strictly better solution replaces the incumbent, so ties (up to rounding) are pruned too.
+            # candidates are sorted by key: the rest are no better
+            if bounded and self._optimal_key is not None and \
+                    self._bound(key, depth) >= self._optimal_key - 1e-9 * max(1.0, abs(self._optimal_key)):
+                self.n_pruned += 1
+                break
+
+            if not self._mergeable(partial_solutions, nodes):
+                continue
+
+            if untouched and not self._canonical(nodes.tolist(), untouched):
+                self.n_symmetric += 1
+                continue
+
+            self.n_explored += 1
+            self._merge(wf, partial_solutions, nodes)
+            self._merged_key += key
+            if self._energy is not None:
+                self._energy[nodes[:-1]] += partial_solutions.energy[k]
+                self._charged[nodes[:-1]] += 1
+            next_first = k if depth + 1 < len(workflows) and same_as_prev[depth + 1] else 0
+            self._search(workflows, same_as_prev, depth + 1, next_first, bounded)
+            if self._energy is not None:
+                self._energy[nodes[:-1]] -= partial_solutions.energy[k]
+                self._charged[nodes[:-1]] -= 1
+            self._merged_key -= key
+            self._unmerge(wf, partial_solutions, nodes)
+
+    def _bound(self, key, depth):
+        # lower bound of every complete solution below 'partial solution with key' at 'depth'
+        if self.evaluator.metric == 'cost':
+            merged = self.temp_solution.evaluate().key if depth else self._base_key
+        else:
+            merged = self._merged_key
+        return merged + key + self._remaining_min[depth + 1]
+
+    def _fairness_bound(self, depth):
+        # lower bound of 1 - Jain's index (sum^2 / (n * sum of squares)) of every completion at 'depth'.
+        # workflows[depth:] add at most 'budget' energy, to at most 'links' nodes: z nodes not charged yet
+        # (consumption 0) and the lowest of the charged ones (raising a lower node instead of a higher one
+        # never lowers the index). for a given total, the raised nodes are best levelled: with the lowest j
+        # of them at level x and the others fixed at sum P and sum of squares Q, the index
+        # (P + j*x)^2 / (n * (Q + j*x^2)) rises up to x = Q / P and falls after it
+        consumptions = np.sort(self._energy[self._charged > 0]).tolist()
+        budget, links = self._remaining_energy[depth], self._remaining_links[depth]
+        best = 0.0
+        for z in range(min(links, self.topology.n_all_node - len(consumptions)) + 1):
+            n = len(consumptions) + z
+            if not n:
+                continue
+            raised = [0.0] * z + consumptions[:links - z]
+            fixed = consumptions[links - z:]
+            P, Q = sum(fixed), sum(x * x for x in fixed)
+            if not raised:
+                best = max(best, P * P / (n * Q) if Q else 1.0)
+                continue
+
+            # P, Q: of the fixed nodes and raised[j:]
+            P += sum(raised)
+            Q += sum(x * x for x in raised)
+            lowest = 0.0    # sum of raised[:j]
+            for j in range(1, len(raised) + 1):
+                x = raised[j - 1]
+                P, Q, lowest = P - x, Q - x * x, lowest + x
+                high = min(raised[j] if j < len(raised) else inf, (budget + lowest) / j)
+                if high < x:
+                    break
+                if P > 0:
+                    level = min(max(Q / P, x), high)
+                    best = max(best, (P + j * level) ** 2 / (n * (Q + j * level * level)))
+                elif high > 0:
+                    best = max(best, j / n)
+        return 1 - best
+
+    def _canonical(self, nodes, untouched):
+        # an untouched node may only be used if so are the untouched ones before it in its class.
+        # otherwise swapping the two nodes (in this and every later placement) gives an equivalent
+        # assignment that comes first in search order
+        for node in nodes:
+            if not untouched[node]:
+                continue
+            for twin in self._twins[node]:
+                if twin == node:
+                    break
+                if untouched[twin] and twin not in nodes:
+                    return False
         return True
 
-    def _merge(self, wf, partial_solution):
+    def _node_classes(self):
+        # twins[node.index]: indices of the nodes interchangeable with it, in index order.
+        # interchangeable: same type (so same resources) and same neighbors apart from each other.
+        # non-adjacent twins share their neighbor set, adjacent twins their neighbor set plus themselves
+        classes = defaultdict(list)
+        for node in self.topology.all_nodes:
+            neighbors = frozenset(neighbor.index for neighbor in node.neighbors)
+            classes[(type(node), False, neighbors)].append(node.index)
+        for key in [key for key, members in classes.items() if len(members) == 1]:
+            node = self.topology.all_nodes[classes.pop(key)[0]]
+            neighbors = frozenset(neighbor.index for neighbor in node.neighbors) | {node.index}
+            classes[(type(node), True, neighbors)].append(node.index)
+
+        twins = [None] * self.topology.n_all_node
+        for members in classes.values():
+            for index in members:
+                twins[index] = tuple(members)
+        return twins
+
+    def _signature(self, wf):
+        # workflows with the same signature are interchangeable
+        return tuple(tuple(task.required_resources[name] for name in self.topology.resource_names) for task in wf.tasks)
+
+    # a placement (PartialSolutions.nodes row) was feasible in the empty topology,
+    # so only the capacity left by the other merged workflows is checked
+    def _mergeable(self, partial_solutions, nodes):
+        return bool((self._residual[nodes] >= partial_solutions.demand).all())
+
+    def _merge(self, wf, partial_solutions, nodes):
+        self._residual[nodes] -= partial_solutions.demand
         prev_node = None
-        for task, target_node in zip(wf.tasks, partial_solution.wf_to_nodes[wf]):
+        for task, index in zip(wf.tasks, nodes.tolist()):
+            target_node = self.topology.all_nodes[index]
             self.temp_solution.map(prev_node, task, target_node)
             prev_node = target_node
 
-    def _unmerge(self, wf, partial_solution):
-        prev_node = None
-        for task in wf.tasks:
+    def _unmerge(self, wf, partial_solutions, nodes):
+        self._residual[nodes] += partial_solutions.demand
+        for task in reversed(wf.tasks):
             self.temp_solution.unmap(task)
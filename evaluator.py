@@ -1,7 +1,11 @@
 from abc import *
 from solution import *
 from parameters import *
-from collections import defaultdict
+from collections import defaultdict, Counter, OrderedDict
+from weakref import WeakKeyDictionary
+from copy import copy
+from heapq import heappush, heapreplace
+from itertools import count
 
 
 class Evaluation:
@@ -36,55 +40,257 @@ class Evaluation:
         return self.key < other.key
 
 
+class EvaluationStatistics:
+    # online mean / variance (Welford) of every Evaluation metric over a stream of solutions,
+    # and a histogram of their alloc_cnt. statistics of separate streams can be merged
+    metrics = ('total_energy_consumption', 'fairness_index', 'total_distance', 'average_link_distance', 'total_cost')
+
+    def __init__(self):
+        self.n = 0
+        self.mean = dict.fromkeys(self.metrics, 0.0)
+        self.m2 = dict.fromkeys(self.metrics, 0.0)
+        self.alloc_cnt = Counter()
+
+    def add(self, alloc_cnt, evaluation):
+        self.n += 1
+        self.alloc_cnt[alloc_cnt] += 1
+        for metric in self.metrics:
+            value = getattr(evaluation, metric)
+            delta = value - self.mean[metric]
+            self.mean[metric] += delta / self.n
+            self.m2[metric] += delta * (value - self.mean[metric])
+
+    def merge(self, other):
+        n = self.n + other.n
+        if other.n:
+            for metric in self.metrics:
+                delta = other.mean[metric] - self.mean[metric]
+                self.mean[metric] += delta * other.n / n
+                self.m2[metric] += other.m2[metric] + delta ** 2 * self.n * other.n / n
+        self.n = n
+        self.alloc_cnt.update(other.alloc_cnt)
+
+    def variance(self, metric):
+        return self.m2[metric] / (self.n - 1) if self.n > 1 else 0.0
+
+    def __repr__(self):
+        return '{} solutions, alloc_cnt histogram {}, mean/variance: {}'.format(
+            self.n, dict(sorted(self.alloc_cnt.items())),
+            ', '.join(f'{metric} {self.mean[metric]:.6f}/{self.variance(metric):.6f}' for metric in self.metrics))
+
+
+class BestOf:
+    # streaming best-of-N: keeps the k items with the smallest keys seen so far, in O(k) memory.
+    # keys are fitness keys like (-alloc_cnt, evaluation key); on ties the earlier item wins,
+    # as in BaseEvaluator.get_best()
+
+    def __init__(self, k=1):
+        self.k = k
+        self._heap = []     # (negated key, -tick, item): the worst item kept is on top
+        self._ticks = count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, key, item):
+        entry = ((-key[0], -key[1]), -next(self._ticks), item)
+        if len(self._heap) < self.k:
+            heappush(self._heap, entry)
+        elif entry[:2] > self._heap[0][:2]:
+            heapreplace(self._heap, entry)
+
+    def _sorted(self):
+        return sorted(self._heap, key=lambda entry: entry[:2], reverse=True)
+
+    def items(self):
+        # best first
+        return [entry[2] for entry in self._sorted()]
+
+    def keys(self):
+        return [(-entry[0][0], -entry[0][1]) for entry in self._sorted()]
+
+
+EVALUATION_CACHE_SIZE = 1 << 14
+
+
+class EvaluationCache:
+    # LRU cache of Evaluations by (evaluator type, metric, solution.fingerprint),
+    # shared by all the evaluators of a topology (see BaseEvaluator.evaluate()).
+    # every entry keeps the bitset of the nodes its evaluation depends on (see BaseEvaluator.depends_on()),
+    # and is dropped when one of them moves: distances and energies change
+    _caches = WeakKeyDictionary()   # topology -> EvaluationCache
+
+    @classmethod
+    def of(cls, topology):
+        cache = cls._caches.get(topology)
+        if cache is None:
+            cache = cls._caches[topology] = cls(topology)
+        return cache
+
+    def __init__(self, topology, max_size=EVALUATION_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # before the solvers, which re-evaluate their solutions
+        topology.listeners.insert(0, self.topology_changed)
+
+    def topology_changed(self, change):
+        moved = 0
+        for node in change.moved:
+            moved |= 1 << node.index
+        if moved:
+            for key in [key for key, (_, nodes) in self.entries.items() if nodes & moved]:
+                del self.entries[key]
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, result, nodes=-1):
+        self.entries[key] = (result, nodes)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    @property
+    def hit_rate(self):
+        n = self.hits + self.misses
+        return self.hits / n if n else 0.0
+
+    def __repr__(self):
+        return '{} evaluations cached, {} hits / {} misses ({:.1%})'.format(
+            len(self.entries), self.hits, self.misses, self.hit_rate)
+
+
 class BaseEvaluator(metaclass=ABCMeta):
     # evaluates a solution using specific metrics and models
+    #
+    # incremental evaluation:
+    #   the evaluator keeps an accumulator state on each solution it owns (solution.eval_state).
+    #   map()/unmap() mark the workflow as dirty, and evaluate() only re-computes the
+    #   contributions of dirty workflows, so the cost of an evaluation is proportional to
+    #   the size of the change since the last one, not to the size of the problem.
+
+    # get_best() / rank() go through BatchEvaluator for at least this many solutions
+    batch_threshold = 16
+
+    # whether evaluations depend on solution.routing_paths, which BatchEvaluator does not see
+    uses_routing = False
+
+    # whether evaluate() goes through the EvaluationCache of the topology
+    cache_evaluations = True
 
-    def __init__(self, topology, metric='fairness'):
+    def __init__(self, topology, metric='fairness', incremental=True):
         self.topology = topology
         self.metric = metric
+        self.incremental = incremental
+        self._batch_evaluator = None
+        self._cache = None
+
+    @property
+    def batch(self):
+        if self._batch_evaluator is None:
+            self._batch_evaluator = BatchEvaluator(self)
+        return self._batch_evaluator
+
+    def use_batch(self, solutions):
+        return len(solutions) >= self.batch_threshold and not self.uses_routing
 
     def get_best(self, solutions):
-        if solutions:
-            return min(solutions, key=lambda solution: (-solution.workflow_alloc_cnt, solution.evaluate()))
-        else:
+        if not solutions:
             return None
 
+        if self.use_batch(solutions):
+            return solutions[self.batch.evaluate_solutions(solutions).order()[0]]
+
+        return min(solutions, key=lambda solution: (-solution.workflow_alloc_cnt, solution.evaluate()))
+
+    def rank(self, solutions):
+        # best first
+        if self.use_batch(solutions):
+            return [solutions[i] for i in self.batch.evaluate_solutions(solutions).order()]
+
+        return sorted(solutions, key=lambda solution: (-solution.workflow_alloc_cnt, solution.evaluate()))
+
     @staticmethod
     def calc_energy(task, dist):
-        def step_func(): # uJ
-            if dist <= 60: # meter
-                return 0.056
-            else:
-                uJ = 0.056 + (dist - 60) * (0.087 - 0.062) / (500 - 60)
-                mJ = uJ * 1000
-                return mJ
-
-        # A Close Examination of Performance and Power Characteristics of 4G LTE Networks -> Table 4
-        # 가정: Bandwidth 단위가 Kbps
-        energy_consumption = task.required_resources['bandwidth'] * 438.39 # uplink, Mbps/mW (W = J/sec) -> Kbps/uJ
-        # An Accurate Measurement-Based Power COnsumption Model for LTE Uplink Transmissions -> Fig. 4
-        energy_consumption *= step_func()
-        return energy_consumption # uJ
+        # evaluators look energies up in topology.energy_matrix instead (see StaticTopology.link_energy())
+        return transmission_energy(task.required_resources['bandwidth'], dist)
+
+    def __getstate__(self):
+        # the cache and the batch evaluator (a topology listener) belong to this process
+        return dict(self.__dict__, _cache=None, _batch_evaluator=None)
+
+    @property
+    def cache(self):
+        if self._cache is None:
+            self._cache = EvaluationCache.of(self.topology)
+        return self._cache
 
-    @abstractmethod
     def evaluate(self, solution):
+        # the same mapping is evaluated once. a solution served from the cache keeps its dirty
+        # workflows, so its incremental state catches up whenever it misses.
+        # routes depend on the history of a solution (and fall back to direct links), not only on
+        # its mapping: evaluations that use them are not cached
+        if not self.cache_evaluations or self.uses_routing:
+            return self._evaluate(solution)
+
+        key = (type(self), self.metric, solution.fingerprint)
+        result = self.cache.get(key)
+        if result is None:
+            result = self._evaluate(solution)
+            self.cache.put(key, result, self.depends_on(solution))
+        return result
+
+    def depends_on(self, solution):
+        # bitset of the nodes whose position the evaluation of 'solution' depends on
+        return solution.used_mask()
+
+    def _evaluate(self, solution):
+        # solutions owned by another evaluator are evaluated from scratch
+        if not self.incremental or solution.evaluator is not self:
+            return self.evaluate_full(solution)
+
+        if solution.eval_state is None:
+            solution.eval_state = self._new_state()
+            solution.eval_state.dirty.update(dict.fromkeys(self.topology.workflows))
+
+        return solution.eval_state.update(solution)
+
+    @abstractmethod
+    def evaluate_full(self, solution):
         return Evaluation()
 
+    @abstractmethod
+    def _new_state(self):
+        return None
 
-class SingleHopEvaluator(BaseEvaluator):
-    def evaluate(self, solution):
+
+class LinkEnergyEvaluator(BaseEvaluator):
+    # energy model of SingleHopEvaluator and MultiHopEvaluator:
+    # every workflow link consumes transmission energy at the node of its source task
+
+    @abstractmethod
+    def _wf_links(self, solution, wf):
+        # [(node charged, energy, distance), ...] of an allocated workflow
+        return []
+
+    def evaluate_full(self, solution):
         result = Evaluation(self.metric)
         consumptions = defaultdict(int)
         link_cnt = 0
         for wf in self.topology.workflows:
             if solution.is_allocated(wf):
-                for prev_task, cur_task in zip(wf.tasks, wf.tasks[1:]):
-                    prev_node = solution.task_to_node[prev_task]
-                    cur_node = solution.task_to_node[cur_task]
-                    dist = self.topology.get_distance(prev_node, cur_node)
+                for node, energy, dist in self._wf_links(solution, wf):
                     result.total_distance += dist
                     link_cnt += 1
-                    consumptions[prev_node] += BaseEvaluator.calc_energy(prev_task, dist)
+                    consumptions[node] += energy
 
         result.average_link_distance = result.total_distance / link_cnt
 
@@ -96,49 +302,57 @@ class SingleHopEvaluator(BaseEvaluator):
         result.fairness_index = e_sum ** 2 / (len(nodes) * e_sqr_sum)
         return result
 
+    def _new_state(self):
+        return LinkEnergyState(self)
 
-class MultiHopEvaluator(BaseEvaluator):
-    def evaluate(self, solution):
-        result = Evaluation(self.metric)
-        consumptions = defaultdict(int)
-        link_cnt = 0
-        for wf in self.topology.workflows:
-            if solution.is_allocated(wf):
-                for prev_task, cur_task in zip(wf.tasks, wf.tasks[1:]):
-                    prev_node = solution.task_to_node[prev_task]
-                    cur_node = solution.task_to_node[cur_task]
-                    try:
-                        p = solution.routing_paths[(prev_node, cur_node)]
-                        for src, dst in zip(p, p[1:]):
-                            dist = self.topology.get_distance(src, dst)
-                            result.total_distance += dist
-                            link_cnt += 1
-                            consumptions[prev_node] += BaseEvaluator.calc_energy(prev_task, dist)
-                    except KeyError:
-                        result.total_distance += self.topology.get_distance(prev_node, cur_node)
-                        dist = self.topology.get_distance(prev_node, cur_node)
-                        consumptions[prev_node] += BaseEvaluator.calc_energy(prev_task, dist)
-                        link_cnt += 1
-                        pass
 
-        result.average_link_distance = result.total_distance / link_cnt
-        nodes, values = consumptions.keys(), consumptions.values()
-        e_sum = sum(values)
-        result.total_energy_consumption = e_sum
+class SingleHopEvaluator(LinkEnergyEvaluator):
+    def _wf_links(self, solution, wf):
+        links = []
+        for prev_task, cur_task in zip(wf.tasks, wf.tasks[1:]):
+            prev_node = solution.task_to_node[prev_task]
+            cur_node = solution.task_to_node[cur_task]
+            dist = self.topology.get_distance(prev_node, cur_node)
+            links.append((prev_node, self.topology.link_energy(prev_task, prev_node, cur_node), dist))
+        return links
 
-        e_sqr_sum = sum(map(lambda x: x * x, values))
-        result.fairness_index = e_sum ** 2 / (len(nodes) * e_sqr_sum)
-        return result
+
+class MultiHopEvaluator(LinkEnergyEvaluator):
+    # routing_paths are shared by node pair, so a workflow also gets dirty
+    # when another workflow changes the path of one of its links
+    uses_routing = True
+
+    def _wf_links(self, solution, wf):
+        links = []
+        for prev_task, cur_task in zip(wf.tasks, wf.tasks[1:]):
+            prev_node = solution.task_to_node[prev_task]
+            cur_node = solution.task_to_node[cur_task]
+            try:
+                p = solution.routing_paths[(prev_node, cur_node)]
+                for src, dst in zip(p, p[1:]):
+                    dist = self.topology.get_distance(src, dst)
+                    links.append((prev_node, self.topology.link_energy(prev_task, src, dst), dist))
+            except KeyError:
+                dist = self.topology.get_distance(prev_node, cur_node)
+                links.append((prev_node, self.topology.link_energy(prev_task, prev_node, cur_node), dist))
+        return links
 
 
 class MultiHopMarkovEvaluator(BaseEvaluator):
-    def __init__(self, topology, metric='cost'):
-        super().__init__(topology, metric='cost')
+    def __init__(self, topology, metric='cost', incremental=True):
+        super().__init__(topology, metric='cost', incremental=incremental)
 
-    def evaluate(self, solution):
+    @staticmethod
+    def node_cost(node, load_proc, load_bw):
+        cost_proc = load_proc / node.resources['processing_power']
+        cost_proc **= 2
+        cost_bw = load_bw / node.resources['bandwidth']
+        cost_bw **= 2
+        return cost_proc + cost_bw // 10 * 438.39
+
+    def evaluate_full(self, solution):
         cost_proc = {node: 0 for node in self.topology.all_nodes}
         cost_bw = {node: 0 for node in self.topology.all_nodes}
-        cost = {node: 0 for node in self.topology.all_nodes}
 
         for wf in filter(lambda x: solution.is_allocated(x), self.topology.workflows):
             for task in wf.tasks:
@@ -146,14 +360,421 @@ class MultiHopMarkovEvaluator(BaseEvaluator):
                 cost_proc[node] += task.required_resources['processing_power']
                 cost_bw[node] += task.required_resources['bandwidth']
 
-            for node in self.topology.all_nodes:
-                cost_proc[node] = cost_proc[node] / node.resources['processing_power']
-                cost_proc[node] **= 2
-                cost_bw[node] = cost_bw[node] / node.resources['bandwidth']
-                cost_bw[node] **= 2
-                cost[node] = cost_proc[node] + cost_bw[node] // 10 * 438.39
+        cost = {node: self.node_cost(node, cost_proc[node], cost_bw[node]) for node in self.topology.all_nodes}
 
         result = Evaluation('cost')
         result.total_cost = sum(cost.values())
         return result
 
+    def depends_on(self, solution):
+        # loads only
+        return 0
+
+    def _new_state(self):
+        return NodeLoadState(self)
+
+
+class EvaluationState(metaclass=ABCMeta):
+    # running accumulators of an evaluator over one solution
+    #   contributions[wf]: what an allocated workflow added to the accumulators when last seen
+    #   dirty: workflows changed since the last update()
+    # the sums are re-added from the per-node values now and then, to bound rounding drift
+
+    def __init__(self, evaluator):
+        self.evaluator = evaluator
+        self.contributions = {}
+        self.dirty = {}
+        self.n_update = 0
+
+    def copy(self):
+        new_state = copy(self)
+        new_state.contributions = dict(self.contributions)
+        new_state.dirty = dict(self.dirty)
+        return new_state
+
+    def route_changed(self, key):
+        # routing_paths[key] was added, replaced or removed
+        pass
+
+    def update(self, solution):
+        for wf in self.dirty:
+            for item in self.contributions.pop(wf, ()):
+                self._remove(*item)
+
+            if solution.is_allocated(wf):
+                self.contributions[wf] = self._contribution(solution, wf)
+                for item in self.contributions[wf]:
+                    self._add(*item)
+
+            self._seen(solution, wf)
+            self.n_update += 1
+
+        self.dirty.clear()
+        if self.n_update > 4 * len(self.evaluator.topology.workflows):
+            self._resum()
+            self.n_update = 0
+
+        return self._result()
+
+    def forget(self, solution, workflows):
+        # 'workflows' leave the workload (see Solution.release_workflows())
+        for wf in workflows:
+            self.dirty.pop(wf, None)
+            for item in self.contributions.pop(wf, ()):
+                self._remove(*item)
+            self._seen(solution, wf)
+
+    @abstractmethod
+    def _contribution(self, solution, wf):
+        return []
+
+    def _seen(self, solution, wf):
+        pass
+
+    @abstractmethod
+    def _add(self, *item):
+        pass
+
+    @abstractmethod
+    def _remove(self, *item):
+        pass
+
+    @abstractmethod
+    def _resum(self):
+        pass
+
+    @abstractmethod
+    def _result(self):
+        return Evaluation()
+
+
+class LinkEnergyState(EvaluationState):
+    # per-node energy + sum and sum of squares for Jain's fairness index, total distance, link count
+
+    def __init__(self, evaluator):
+        super().__init__(evaluator)
+        self.node_energy = {}
+        self.node_links = {}
+        self.e_sum = 0.0
+        self.e_sqr_sum = 0.0
+        self.total_distance = 0.0
+        self.link_cnt = 0
+        self.route_users = {}   # (node, node) -> {wf: True} of the workflows with the link
+        self.wf_routes = {}     # wf -> [(node, node), ...]
+
+    def copy(self):
+        new_state = super().copy()
+        new_state.node_energy = dict(self.node_energy)
+        new_state.node_links = dict(self.node_links)
+        new_state.route_users = {key: dict(users) for key, users in self.route_users.items()}
+        new_state.wf_routes = dict(self.wf_routes)
+        return new_state
+
+    def route_changed(self, key):
+        self.dirty.update(self.route_users.get(key, {}))
+
+    def _seen(self, solution, wf):
+        if not self.evaluator.uses_routing:
+            return
+
+        for key in self.wf_routes.pop(wf, ()):
+            del self.route_users[key][wf]
+            if not self.route_users[key]:
+                del self.route_users[key]
+
+        if wf in self.contributions:
+            nodes = [solution.task_to_node[task] for task in wf.tasks]
+            self.wf_routes[wf] = list(zip(nodes, nodes[1:]))
+            for key in self.wf_routes[wf]:
+                self.route_users.setdefault(key, {})[wf] = True
+
+    def _contribution(self, solution, wf):
+        return self.evaluator._wf_links(solution, wf)
+
+    def _add(self, node, energy, dist):
+        old = self.node_energy.get(node, 0.0)
+        self.node_energy[node] = old + energy
+        self.node_links[node] = self.node_links.get(node, 0) + 1
+        self.e_sum += energy
+        self.e_sqr_sum += (old + energy) ** 2 - old ** 2
+        self.total_distance += dist
+        self.link_cnt += 1
+
+    def _remove(self, node, energy, dist):
+        old = self.node_energy[node]
+        self.node_links[node] -= 1
+        if self.node_links[node] == 0:
+            del self.node_energy[node], self.node_links[node]
+            new = 0.0
+        else:
+            new = self.node_energy[node] = old - energy
+
+        self.e_sum -= energy
+        self.e_sqr_sum += new ** 2 - old ** 2
+        self.total_distance -= dist
+        self.link_cnt -= 1
+
+    def _resum(self):
+        self.e_sum = sum(self.node_energy.values())
+        self.e_sqr_sum = sum(e * e for e in self.node_energy.values())
+        self.total_distance = sum(dist for links in self.contributions.values() for _, _, dist in links)
+
+    def _result(self):
+        result = Evaluation(self.evaluator.metric)
+        result.total_distance = self.total_distance
+        result.average_link_distance = self.total_distance / self.link_cnt
+        result.total_energy_consumption = self.e_sum
+        result.fairness_index = self.e_sum ** 2 / (len(self.node_energy) * self.e_sqr_sum)
+        return result
+
+
+class NodeLoadState(EvaluationState):
+    # per-node processing / bandwidth load and cost, total cost
+
+    def __init__(self, evaluator):
+        super().__init__(evaluator)
+        self.load = {}      # node -> [processing power, bandwidth]
+        self.node_cost = {}
+        self.total_cost = 0.0
+
+    def copy(self):
+        new_state = super().copy()
+        new_state.load = {node: list(load) for node, load in self.load.items()}
+        new_state.node_cost = dict(self.node_cost)
+        return new_state
+
+    def _contribution(self, solution, wf):
+        return [(solution.task_to_node[task],
+                 task.required_resources['processing_power'],
+                 task.required_resources['bandwidth']) for task in wf.tasks]
+
+    def _change(self, node, proc, bw):
+        load = self.load.setdefault(node, [0, 0])
+        load[0] += proc
+        load[1] += bw
+        cost = self.evaluator.node_cost(node, *load)
+        self.total_cost += cost - self.node_cost.get(node, 0.0)
+        self.node_cost[node] = cost
+
+    def _add(self, node, proc, bw):
+        self._change(node, proc, bw)
+
+    def _remove(self, node, proc, bw):
+        self._change(node, -proc, -bw)
+
+    def _resum(self):
+        self.total_cost = sum(self.node_cost.values())
+
+    def _result(self):
+        result = Evaluation('cost')
+        result.total_cost = self.total_cost
+        return result
+
+
+class BatchEvaluation:
+    # metrics of many solutions, one array entry per solution
+
+    def __init__(self, metric, n):
+        self.metric = metric
+        self.alloc_cnt = np.zeros(n, dtype=np.int64)
+        self.total_energy_consumption = np.zeros(n)
+        self.fairness_index = np.zeros(n)
+        self.total_distance = np.zeros(n)
+        self.average_link_distance = np.zeros(n)
+        self.total_cost = np.zeros(n)
+
+    @property
+    def key(self):
+        if self.metric == 'energy':
+            return self.total_energy_consumption
+        elif self.metric == 'fairness':
+            return 1 - self.fairness_index
+        elif self.metric == 'cost':
+            return self.total_cost
+        else:
+            return self.total_distance
+
+    def order(self):
+        # indices from the best, same ordering as BaseEvaluator.get_best(): more workflows, then key
+        return np.lexsort((self.key, -self.alloc_cnt))
+
+    def __getitem__(self, i):
+        result = Evaluation(self.metric)
+        result.total_energy_consumption = float(self.total_energy_consumption[i])
+        result.fairness_index = float(self.fairness_index[i])
+        result.total_distance = float(self.total_distance[i])
+        result.average_link_distance = float(self.average_link_distance[i])
+        result.total_cost = float(self.total_cost[i])
+        return result
+
+
+class BatchEvaluator:
+    # evaluates N solutions at once from a stacked task->node matrix (N x n_all_task, see
+    # Solution.encode()) with vectorized gathers.
+    # distance, hop count and energy (by task.bw_class, from topology.energy_matrix) are looked up
+    # per node pair, for the pairs the batches link only: a pair is worked out on first use and
+    # kept until one of its nodes moves (any pair once links change, multi-hop).
+    # matches 'evaluator' within floating-point tolerance. for MultiHopEvaluator,
+    # every link is assumed to be routed over its min-hop path, as Solution._route() does
+
+    def __init__(self, evaluator):
+        self.evaluator = evaluator
+        self.topology = evaluator.topology
+        self.metric = evaluator.metric
+        self.multihop = isinstance(evaluator, MultiHopEvaluator)
+        self.cost_model = isinstance(evaluator, MultiHopMarkovEvaluator)
+        self._tables = None
+        # the known pairs, as src.index * n_all_node + dst.index, sorted, and what they are looked up for
+        self._pairs = np.zeros(0, dtype=np.int64)
+        self._pair_dist = np.zeros(0)
+        self._pair_hops = np.zeros(0)
+        self._pair_energy = np.zeros((0, 0))    # [pair, bw_class]
+        self._pairs_of = defaultdict(set)       # node.index -> known pairs whose route goes through the node
+        # before the solvers, which rank their solutions again
+        self.topology.listeners.insert(0, WeakListener(self.topology_changed))
+
+    def topology_changed(self, change):
+        if self.multihop and change.links_changed:
+            self._forget_pairs()
+            return
+
+        dropped = set()
+        for node in change.moved:
+            dropped.update(self._pairs_of.pop(node.index, ()))
+        if dropped:
+            kept = ~np.isin(self._pairs, np.fromiter(dropped, dtype=np.int64, count=len(dropped)))
+            self._keep_pairs(kept)
+
+    def _forget_pairs(self):
+        self._keep_pairs(np.zeros(len(self._pairs), dtype=bool))
+        self._pairs_of.clear()
+
+    def _keep_pairs(self, kept):
+        self._pairs, self._pair_dist, self._pair_hops, self._pair_energy = \
+            self._pairs[kept], self._pair_dist[kept], self._pair_hops[kept], self._pair_energy[kept]
+
+    def _prepare(self):
+        # the workload: rebuilt when it changes
+        topology = self.topology
+        n_class = len(topology.energy_matrix)   # also assigns task.bw_class
+        tables = {'demand_matrix': topology.demand_matrix}
+
+        wf_sizes = [wf.n_task for wf in topology.workflows]
+        tables['wf_start'] = np.cumsum([0] + wf_sizes[:-1]).astype(np.int64)
+        links = [(task.index, next_task.index, wf.index)
+                 for wf in topology.workflows for task, next_task in zip(wf.tasks, wf.tasks[1:])]
+        links = np.array(links, dtype=np.int64).reshape(-1, 3)
+        tables['link_prev'], tables['link_cur'], tables['link_wf'] = links.T
+        tables['task_wf'] = np.repeat(np.arange(len(wf_sizes)), wf_sizes)
+        tables['link_class'] = np.array([task.bw_class for task in topology.all_tasks],
+                                        dtype=np.int64)[tables['link_prev']]
+
+        demand = topology.demand_matrix
+        names = topology.resource_names
+        tables['proc'] = demand[:, names.index('processing_power')]
+        tables['bw'] = demand[:, names.index('bandwidth')]
+
+        cap = topology.capacity_matrix
+        tables['cap_proc'] = cap[:, names.index('processing_power')]
+        tables['cap_bw'] = cap[:, names.index('bandwidth')]
+        self._tables = tables
+
+        # the bandwidth classes may have changed
+        self._forget_pairs()
+        self._pair_energy = np.zeros((0, n_class))
+
+    def _route_of(self, pair):
+        # what topology.get_distance() / link_energy() give for a pair, summed over its min-hop path (multi-hop)
+        topology = self.topology
+        src_node, dst_node = (topology.all_nodes[i] for i in divmod(pair, topology.n_all_node))
+        path = topology.get_path(src_node, dst_node) if self.multihop else None
+        hops = list(zip(path, path[1:])) if path and len(path) > 1 else [(src_node, dst_node)]
+        for node in path or (src_node, dst_node):
+            self._pairs_of[node.index].add(pair)
+
+        dist = sum(topology.get_distance(node1, node2) for node1, node2 in hops)
+        return dist, len(hops), [topology.link_id(node1, node2) for node1, node2 in hops]
+
+    def _lookup(self, pairs):
+        # positions of 'pairs' (sorted, unique) in the known pairs, the missing ones worked out first
+        pos = np.searchsorted(self._pairs, pairs)
+        known = np.zeros(len(pairs), dtype=bool)
+        inside = pos < len(self._pairs)
+        known[inside] = self._pairs[pos[inside]] == pairs[inside]
+        if known.all():
+            return pos
+
+        missing = pairs[~known]
+        dist, hops, link_ids = zip(*map(self._route_of, missing.tolist()))
+        energy_matrix = self.topology.energy_matrix
+        energy = np.stack([energy_matrix[:, ids].sum(axis=1) for ids in link_ids])
+
+        order = np.argsort(np.concatenate((self._pairs, missing)), kind='stable')
+        self._pairs = np.concatenate((self._pairs, missing))[order]
+        self._pair_dist = np.concatenate((self._pair_dist, dist))[order]
+        self._pair_hops = np.concatenate((self._pair_hops, hops))[order]
+        self._pair_energy = np.concatenate((self._pair_energy, energy))[order]
+        return np.searchsorted(self._pairs, pairs)
+
+    def encode(self, solutions):
+        return np.stack([solution.encode() for solution in solutions])
+
+    def evaluate_solutions(self, solutions):
+        return self.evaluate(self.encode(solutions))
+
+    def evaluate(self, task_nodes):
+        if self._tables is None or self._tables['demand_matrix'] is not self.topology.demand_matrix:
+            self._prepare()
+        tb = self._tables
+
+        task_nodes = np.asarray(task_nodes).reshape(-1, self.topology.n_all_task)
+        n_solution, n_node = len(task_nodes), self.topology.n_all_node
+        result = BatchEvaluation(self.metric, n_solution)
+
+        # a workflow counts only if all of its tasks are mapped
+        mapped = task_nodes >= 0
+        wf_alloc = np.logical_and.reduceat(mapped, tb['wf_start'], axis=1) \
+            if len(tb['wf_start']) else np.zeros((n_solution, 0), dtype=bool)
+        result.alloc_cnt = wf_alloc.sum(axis=1)
+        rows = np.arange(n_solution)[:, None]
+
+        if self.cost_model:
+            task_alloc = wf_alloc[:, tb['task_wf']]
+            node = np.where(task_alloc, task_nodes, 0)
+            flat = (rows * n_node + node).ravel()
+            load_proc = np.bincount(flat, weights=(task_alloc * tb['proc']).ravel(),
+                                    minlength=n_solution * n_node).reshape(n_solution, n_node)
+            load_bw = np.bincount(flat, weights=(task_alloc * tb['bw']).ravel(),
+                                  minlength=n_solution * n_node).reshape(n_solution, n_node)
+            cost = (load_proc / tb['cap_proc']) ** 2 + ((load_bw / tb['cap_bw']) ** 2) // 10 * 438.39
+            result.total_cost = cost.sum(axis=1)
+            return result
+
+        valid = wf_alloc[:, tb['link_wf']]
+        src = np.where(valid, task_nodes[:, tb['link_prev']], 0)
+        dst = np.where(valid, task_nodes[:, tb['link_cur']], 0)
+        pairs, pair_of_link = np.unique((src * n_node + dst)[valid], return_inverse=True)
+        slot = self._lookup(pairs)[pair_of_link]
+
+        dist, energy, hops = np.zeros(valid.shape), np.zeros(valid.shape), np.zeros(valid.shape)
+        dist[valid] = self._pair_dist[slot]
+        hops[valid] = self._pair_hops[slot]
+        energy[valid] = self._pair_energy[slot, np.broadcast_to(tb['link_class'], valid.shape)[valid]]
+
+        flat = (rows * n_node + src).ravel()
+        node_energy = np.bincount(flat, weights=energy.ravel(),
+                                  minlength=n_solution * n_node).reshape(n_solution, n_node)
+        node_links = np.bincount(flat, weights=hops.ravel(),
+                                 minlength=n_solution * n_node).reshape(n_solution, n_node)
+
+        link_cnt = hops.sum(axis=1)
+        result.total_distance = dist.sum(axis=1)
+        result.average_link_distance = np.divide(result.total_distance, link_cnt,
+                                                 out=np.zeros(n_solution), where=link_cnt > 0)
+        e_sum = node_energy.sum(axis=1)
+        e_sqr_sum = (node_energy ** 2).sum(axis=1)
+        n_used = (node_links > 0).sum(axis=1)
+        result.total_energy_consumption = e_sum
+        result.fairness_index = np.divide(e_sum ** 2, n_used * e_sqr_sum,
+                                          out=np.zeros(n_solution), where=n_used * e_sqr_sum > 0)
+        return result
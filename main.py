@@ -2,8 +2,10 @@ from evaluator import *
 from allocator import *
 from solver_ga import *
 from visualizer import *
+import os
 import pickle
 from solver_ma import *
+from topology_io import load_topology, save_topology
 
 
 test_mode_settings = {
@@ -28,6 +30,22 @@ test_mode_settings = {
                         # selection_ratio=0.2, // not used
                     )
     },
+    'island': {
+        'allocator' : RandomAllocator,
+        'evaluator' : SingleHopEvaluator,
+        'solver'    : IslandSolver,
+        'params'    : IslandSolverParameters(
+                        islands=[GeneticSolverParameters(
+                                    population_size=2500,
+                                    n_generation=250000,
+                                    mutation_ratio=mutation_ratio
+                                 ) for mutation_ratio in (1.0, 0.5, 0.2, 0.1)],
+                        migration_interval=1000,
+                        n_migrants=10,
+                        migration_topology='ring',
+                        seed=0
+                    )
+    },
     'markov': {
         'allocator' : RandomAllocator,
         'evaluator' : MultiHopMarkovEvaluator,
@@ -36,25 +54,36 @@ test_mode_settings = {
                         n_iteration=2000,     # up to 1600 in the ref' paper.
                         beta=2000   # 1, 10, 100, 1000, 2000 in the ref' paper.
                     )
+    },
+    'tempering': {
+        'allocator' : RandomAllocator,
+        'evaluator' : MultiHopMarkovEvaluator,
+        'solver'    : ParallelTemperingSolver,
+        'params'    : ParallelTemperingParameters(
+                        n_iteration=2000,
+                        betas=[1, 10, 100, 1000, 2000],
+                        swap_interval=10,
+                        seed=0
+                    )
     }
 }
 
 
+topology_dumps = {
+    'load_small': 'dump/topology_small1',
+    'load_large': 'dump/topology_large1',
+    'load_Xlarge': 'dump/topology_Xlarge1',
+}
+
+
 class TestSet:
     def __init__(self, toppology_gen, dump_filename, topology_print=False, topology_savefile=""):
         assert toppology_gen in ["new", "load_small", "load_large", "load_Xlarge"]  # 논문에는 small, medium, large
         self.topology_gen = toppology_gen
         self.dump_filename = dump_filename
 
-        if self.topology_gen == "load_small":
-            with open('dump/topology_small1.bin', 'rb') as fin:
-                self.topology = pickle.load(fin)
-        elif self.topology_gen == "load_large":
-            with open('dump/topology_large1.bin', 'rb') as fin:
-                self.topology = pickle.load(fin)
-        elif self.topology_gen == "load_large":
-            with open('dump/topology_Xlarge1.bin', 'rb') as fin:
-                self.topology = pickle.load(fin)
+        if self.topology_gen in topology_dumps:
+            self.topology = self._load_topology(topology_dumps[self.topology_gen])
         else:
             self.topology = StaticTopology()
 
@@ -63,10 +92,21 @@ class TestSet:
             self.topology.print_workflow_n_tasks()
             self.topology.print_distances()
 
-        if topology_savefile != "":
+        if topology_savefile.endswith('.tpg'):
+            save_topology(self.topology, 'dump/' + topology_savefile)
+        elif topology_savefile != "":
             with open('dump/' + topology_savefile, 'wb') as fout:
                 pickle.dump(self.topology, fout)
 
+    @staticmethod
+    def _load_topology(basename):
+        # prefer the memory-mapped format(.tpg), fall back to the pickle(.bin)
+        if os.path.exists(basename + '.tpg'):
+            return load_topology(basename + '.tpg')
+
+        with open(basename + '.bin', 'rb') as fin:
+            return pickle.load(fin)
+
     def run(self, title, mode, n_iter=1):
         with open('dump/' + self.dump_filename, "w") as f_out:
             f_out.write('total_consumption(J), fairness_index, total_routing_path_len, average_link_distance(m)\n')
@@ -93,7 +133,8 @@ class TestSet:
 
         setting = test_mode_settings[test_setting_name]
         evaluator = setting['evaluator'](self.topology)
-        allocator = setting['allocator'](self.topology, evaluator)
+        # a mode may set 'solution' to Solution. both run alike, ArraySolution clones and encodes cheaper
+        allocator = setting['allocator'](self.topology, evaluator, setting.get('solution', ArraySolution))
 
         if 'params' in setting:
             solver = setting['solver'](self.topology, allocator, evaluator, setting['params'])
@@ -106,7 +147,7 @@ class TestSet:
             title = 'No feasible solution found'
             return None
 
-        if test_setting_name == 'markov':
+        if test_setting_name in ('markov', 'tempering'):
             final_evaluator = MultiHopEvaluator(self.topology)
         elif test_setting_name == 'genetic':
             final_evaluator = SingleHopEvaluator(self.topology)
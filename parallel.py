@@ -0,0 +1,171 @@
+import random
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Process, Pipe
+
+import numpy as np
+
+from evaluator import EvaluationStatistics, BestOf
+
+
+# runs solver jobs in worker processes
+#
+# every worker receives the topology, the evaluator (with its settings) and the solver setup once, when it starts.
+# after that, jobs and their results carry only compact chromosomes (see Solution.encode()).
+# each job gets its own seed drawn from the master's random state, and results are consumed
+# in submission order, so a run is reproducible from the master seed.
+
+_context = None     # per worker process, see _init_worker()
+
+
+class WorkerContext:
+    # what a worker process rebuilds from the shipped setup
+    def __init__(self, topology, allocator_type, evaluator, solution_type, solver_type=None, params=None):
+        self.topology = topology
+        self.evaluator = evaluator
+        self.allocator = allocator_type(topology, self.evaluator, solution_type)
+        self.solver = solver_type(topology, self.allocator, self.evaluator, params) if solver_type else None
+
+    def decode(self, encoding, multihop=False):
+        return self.allocator.solution_type.decode(self.topology, self.evaluator, encoding, multihop)
+
+
+def _setup(allocator, solver=None):
+    # the evaluator goes as it is (see BaseEvaluator.__getstate__()), so metric, incremental,
+    # cache_evaluations, batch_threshold, ... are those of the master's
+    return (allocator.topology, type(allocator), allocator.evaluator, allocator.solution_type,
+            type(solver) if solver else None, solver.params if solver else None)
+
+
+def _init_worker(*setup):
+    global _context
+    _context = WorkerContext(*setup)
+
+
+def _run_job(job):
+    function, seed, args = job
+    random.seed(seed)
+    return function(_context, *args)
+
+
+class WorkerPool:
+    # jobs are module-level functions called as function(context, *args) in a worker
+    def __init__(self, n_workers, allocator, solver=None):
+        self.n_workers = n_workers
+        self.executor = ProcessPoolExecutor(n_workers, initializer=_init_worker,
+                                            initargs=_setup(allocator, solver))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+    def map(self, function, args_list, seeds=None):
+        if seeds is None:
+            seeds = [random.getrandbits(64) for _ in args_list]
+        jobs = [(function, seed, args) for seed, args in zip(seeds, args_list)]
+        chunksize = max(1, -(-len(jobs) // self.n_workers))
+        return self.executor.map(_run_job, jobs, chunksize=chunksize)
+
+
+def allocate_in_parallel(allocator, n, n_workers, seed=None, top_k=None, statistics=False):
+    # n allocator.allocate_workflows() calls, split into one shard per worker.
+    # every shard runs on its own RNG stream, seeded from 'seed' (or from the master's random state).
+    # returns the solutions as encodings (n x n_all_task), their (-alloc_cnt, evaluation key) and
+    # EvaluationStatistics of all of them (if 'statistics'). with 'top_k', only the best top_k
+    # solutions are returned (best first), and every shard keeps no more than that
+    rng = random.Random(seed if seed is not None else random.getrandbits(64))
+    sizes = [n // n_workers + (k < n % n_workers) for k in range(n_workers)]
+    seeds = [rng.getrandbits(64) for _ in sizes]
+    with WorkerPool(n_workers, allocator) as pool:
+        shards = list(pool.map(_allocate_shard, [(size, top_k, statistics) for size in sizes], seeds))
+
+    stats = EvaluationStatistics() if statistics else None
+    for _, _, shard_stats in shards:
+        if stats:
+            stats.merge(shard_stats)
+
+    if top_k:
+        best = BestOf(top_k)
+        for encodings, keys, _ in shards:
+            for encoding, key in zip(encodings, keys):
+                best.push(key, encoding)
+        encodings = best.items()
+        encodings = np.stack(encodings) if encodings else np.zeros((0, allocator.topology.n_all_task), dtype=np.int32)
+        return encodings, best.keys(), stats
+
+    encodings = np.concatenate([shard[0] for shard in shards])
+    keys = [key for shard in shards for key in shard[1]]
+    return encodings, keys, stats
+
+
+def _allocate_shard(context, size, top_k=None, statistics=False):
+    best = BestOf(top_k) if top_k else None
+    stats = EvaluationStatistics() if statistics else None
+    encodings, keys = [], []
+    for _ in range(size):
+        solution = context.allocator.allocate_workflows()
+        key = (-solution.workflow_alloc_cnt, solution.evaluate().key)
+        if stats:
+            stats.add(solution.workflow_alloc_cnt, solution.evaluate())
+
+        if best is not None:
+            best.push(key, solution)
+        else:
+            encodings.append(solution.encode())
+            keys.append(key)
+
+    if best is not None:
+        encodings, keys = [solution.encode() for solution in best.items()], best.keys()
+    encodings = np.stack(encodings) if encodings else np.zeros((0, context.topology.n_all_task), dtype=np.int32)
+    return encodings, keys, stats
+
+
+class WorkerError(Exception):
+    pass
+
+
+def _serve(conn, setup):
+    context = WorkerContext(*setup)
+    while True:
+        job = conn.recv()
+        if job is None:
+            break
+
+        function, args = job
+        try:
+            conn.send((True, function(context, *args)))
+        except Exception:
+            conn.send((False, traceback.format_exc()))
+    conn.close()
+
+
+class WorkerProcess:
+    # a single long-lived worker whose context (e.g. a solver and its population) outlives the jobs.
+    # submit() a job, then collect it with result(); several processes can work at the same time
+    def __init__(self, allocator, solver=None):
+        self.conn, worker_conn = Pipe()
+        self.process = Process(target=_serve, args=(worker_conn, _setup(allocator, solver)), daemon=True)
+        self.process.start()
+        worker_conn.close()
+
+    def submit(self, function, *args):
+        self.conn.send((function, args))
+
+    def result(self):
+        ok, value = self.conn.recv()
+        if not ok:
+            raise WorkerError(value)
+        return value
+
+    def close(self):
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join()
+        self.conn.close()
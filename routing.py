@@ -0,0 +1,142 @@
+from collections import OrderedDict
+
+
+# min-hop routing over the links of a topology, shared by every solution on it
+#
+#   connected-component labels answer reachability in O(1)
+#   single-source BFS rows are computed on demand, and only the most recently used ones are kept:
+#   a row evicted is computed again, with the same ties
+#   paths are immutable tuples, one per (src, dst) in an LRU cache, so solutions hold references
+#
+# everything is dropped when a topology step() adds or removes links
+
+ROUTE_CACHE_SIZE = 1 << 16
+PRED_ROW_CACHE_SIZE = 1 << 8
+
+
+def bfs(adjacency, src):
+    # hop count and predecessor of every node on the min-hop paths from src, -1 if unreachable.
+    # neighbors are expanded in the order of the adjacency lists, so ties are always broken the same way
+    n = len(adjacency)
+    hop_row, pred_row = [-1] * n, [-1] * n
+    hop_row[src] = 0
+    frontier = [src]
+    while frontier:
+        next_frontier = []
+        for cur in frontier:
+            for neighbor in adjacency[cur]:
+                if hop_row[neighbor] < 0:
+                    hop_row[neighbor] = hop_row[cur] + 1
+                    pred_row[neighbor] = cur
+                    next_frontier.append(neighbor)
+        frontier = next_frontier
+    return hop_row, pred_row
+
+
+class Router:
+    def __init__(self, topology, max_paths=ROUTE_CACHE_SIZE, max_pred_rows=PRED_ROW_CACHE_SIZE):
+        self.topology = topology
+        self.max_paths = max_paths
+        self.max_pred_rows = max_pred_rows
+        self.hits = 0
+        self.misses = 0
+        self._reset()
+
+        # first, so the other listeners already see the new routes
+        topology.listeners.insert(0, self.topology_changed)
+
+    def _reset(self):
+        self.paths = OrderedDict()      # (src.index, dst.index) -> (src, ..., dst) or None
+        self._adjacency = None
+        self._component = None          # component[node.index]: label of its connected component
+        self._component_bits = None     # component_bits[label]: bitset of the nodes in it
+        self._pred_rows = OrderedDict()     # src.index -> predecessor row (see bfs()), LRU
+
+    def topology_changed(self, change):
+        if change.links_changed:
+            self._reset()
+
+    @property
+    def adjacency(self):
+        if self._adjacency is None:
+            self._adjacency = self.topology._adjacency_lists()
+        return self._adjacency
+
+    @property
+    def component(self):
+        if self._component is None:
+            self._build_components()
+        return self._component
+
+    @property
+    def component_bits(self):
+        if self._component_bits is None:
+            self._build_components()
+        return self._component_bits
+
+    def _build_components(self):
+        adjacency = self.adjacency
+        component, component_bits = [-1] * len(adjacency), []
+        for root in range(len(adjacency)):
+            if component[root] >= 0:
+                continue
+
+            label, bits = len(component_bits), 0
+            component[root] = label
+            stack = [root]
+            while stack:
+                cur = stack.pop()
+                bits |= 1 << cur
+                for neighbor in adjacency[cur]:
+                    if component[neighbor] < 0:
+                        component[neighbor] = label
+                        stack.append(neighbor)
+            component_bits.append(bits)
+
+        self._component, self._component_bits = component, component_bits
+
+    def is_reachable(self, src_node, dst_node):
+        # a node reaches itself only through a round trip, i.e. if it has any neighbor
+        src, dst = src_node.index, dst_node.index
+        if src == dst:
+            return bool(self.adjacency[src])
+        return self.component[src] == self.component[dst]
+
+    def reachable_bits(self, node_index):
+        # bitset of the nodes is_reachable() from a node
+        bits = self.component_bits[self.component[node_index]]
+        return bits if self.adjacency[node_index] else bits & ~(1 << node_index)
+
+    def path(self, src_node, dst_node):
+        # min-hop path (src_node, ..., dst_node), or None if unreachable
+        key = (src_node.index, dst_node.index)
+        try:
+            path = self.paths[key]
+            self.paths.move_to_end(key)
+            self.hits += 1
+            return path
+        except KeyError:
+            self.misses += 1
+
+        src, dst = key
+        path = self._find_path(src, dst) if src == dst or self.component[src] == self.component[dst] else None
+        self.paths[key] = path
+        if len(self.paths) > self.max_paths:
+            self.paths.popitem(last=False)
+        return path
+
+    def _find_path(self, src, dst):
+        pred_row = self._pred_rows.get(src)
+        if pred_row is not None:
+            self._pred_rows.move_to_end(src)
+        else:
+            _, pred_row = bfs(self.adjacency, src)
+            self._pred_rows[src] = pred_row
+            if len(self._pred_rows) > self.max_pred_rows:
+                self._pred_rows.popitem(last=False)
+
+        path = [dst]
+        while path[-1] != src:
+            path.append(pred_row[path[-1]])
+        all_nodes = self.topology.all_nodes
+        return tuple(all_nodes[i] for i in reversed(path))
@@ -1,5 +1,11 @@
 from topology import *
-from collections import deque
+from abc import abstractmethod
+from copy import copy
+from collections import defaultdict
+from collections.abc import Mapping
+from bisect import bisect_left, bisect_right
+from functools import reduce
+from operator import or_
 
 
 class Solution:
@@ -30,16 +36,7 @@ class Solution:
         else:
             self.evaluator = Solution.evaluator
 
-        # CAUTION: these data structures should be synchronized
-        #          they are different views of a single logical state
-        #          if you change them, apply the changes to clone() method.
-        self.wf_alloc = {wf: False for wf in topology.workflows}
-        self.wf_to_nodes = {wf: {} for wf in topology.workflows}  # ordered
-        self.task_to_node = {}  # n to 1
-        self.node_to_tasks = {node: set() for node in topology.all_nodes} # 1 to n
-        self.routing_paths = {}
-        self.available_resources = {node: Resources(node.resources)
-                                    for node in topology.all_nodes}
+        self._init_state()
 
         # value, cost, fitness, or anything comparable scalar value.
         # NOTE: lazy evaluation. not up-to-date
@@ -48,6 +45,42 @@ class Solution:
         # if this variable is False, self.evaluate() will return previously calculated value
         self._require_evaluation = True
 
+        # undo records of map()/unmap(), only while a checkpoint() is active
+        self._undo_log = None
+        self._n_checkpoint = 0
+
+        # accumulators of the evaluator for incremental evaluation (see evaluator.py)
+        self.eval_state = None
+
+        # Zobrist hash of the task -> node mapping: XOR of topology.zobrist_keys(task)[node.index]
+        # over the mapped tasks, kept up to date by _assign() / _release().
+        # equal mappings have equal fingerprints, whatever order they were built in
+        self.fingerprint = 0
+
+        # feasibility masks (see host_mask()), kept up to date from their first use.
+        # the nodes are bucketed by what is left of each resource, between the demands of the workload:
+        #   _host_levels[r]      : the demands for topology.resource_names[r], sorted
+        #   _host_buckets[r][j]  : bitset of the nodes with an amount a left, bisect_right(_host_levels[r], a) == j
+        #   _node_buckets[r][i]  : the bucket of all_nodes[i]
+        # so the nodes with at least _host_levels[r][p] left are the union of _host_buckets[r][p + 1:],
+        # and a map() / unmap() moves one node between two buckets
+        self._host_levels = None
+        self._host_buckets = None
+        self._node_buckets = None
+
+    def _init_state(self):
+        # CAUTION: these data structures should be synchronized
+        #          they are different views of a single logical state
+        #          if you change them, apply the changes to clone(), _assign() and _release()
+        self.wf_alloc = {wf: False for wf in self.topology.workflows}
+        self.wf_to_nodes = {wf: {} for wf in self.topology.workflows}  # ordered
+        self.task_to_node = {}  # n to 1
+        self.node_to_tasks = {node: set() for node in self.topology.all_nodes} # 1 to n
+        self.routing_paths = {}
+        self._route_index = None    # node -> keys of the routing_paths through it (see _routes_through())
+        self.available_resources = {node: Resources(node.resources)
+                                    for node in self.topology.all_nodes}
+
     def mappable(self, prev_node, task, target_node, multihop=False):
         first_task = not prev_node
         resource_ok = task.required_resources <= self.available_resources[target_node]
@@ -61,84 +94,267 @@ class Solution:
                 not first_task and not visited and connected and resource_ok
 
     def _is_connected(self, src_node, dst_node):
-        visited = {src_node}
-        que = deque([src_node])
-        while que:
-            cur = que.popleft()
-            for neighbor in cur.neighbors:
-                if neighbor == dst_node:
-                    return True
-                if neighbor not in visited:
-                    visited.add(neighbor)
-                    que.append(neighbor)
-
-        return False
+        return self.topology.is_reachable(src_node, dst_node)
 
-    def map(self, prev_node, task, target_node, multihop=False):
-        # 'task' should be a not-assigned-task
-        if task in self.task_to_node:
+    def map(self, prev_node, task, target_node, multihop=False, next_node=None):
+        # 'task' should be a not-assigned-task.
+        # next_node: the node of the task after 'task', if that one is mapped already (see Move)
+        if self.is_mapped(task):
             return False
 
         if not self.mappable(prev_node, task, target_node, multihop):
             return False
 
-        if multihop and prev_node is not None:
-            path = self._route(prev_node, target_node)
-            if path:
-                self.routing_paths[(prev_node, target_node)] = path
-            else:
+        links = [(prev_node, target_node)] if prev_node is not None else []
+        if next_node is not None:
+            if next_node is target_node or not multihop and next_node not in target_node.neighbors:
                 return False
+            links.append((target_node, next_node))
 
-        wf = task.workflow
-        self.wf_to_nodes[wf][target_node] = True
-        if len(self.wf_to_nodes[wf]) == wf.n_task:
-            self.wf_alloc[wf] = True
+        paths = []
+        if multihop:
+            paths = [self._route(*key) for key in links]
+            if not all(paths):
+                return False
 
-        self.task_to_node[task] = target_node
-        self.node_to_tasks[target_node].add(task)
-        self.available_resources[target_node] -= task.required_resources
-        self._require_evaluation = True
+        # logged before anything changes, so undo() restores value and _require_evaluation as they were
+        if self._undo_log is not None:
+            routing_changes = [(key, self.routing_paths.get(key)) for key in links[:len(paths)]]
+            self._undo_log.append(('map', task, target_node, routing_changes,
+                                   self.value, self._require_evaluation))
+
+        for key, path in zip(links, paths):
+            self._set_route(key, path)
+            self._touch_route(key)
+
+        self._assign(task, target_node)
+        self._touch(task.workflow)
         return True
 
     def unmap(self, task):
         # 'task' should be an assigned-task
-        if task not in self.task_to_node:
+        if not self.is_mapped(task):
             return False
 
         target_node = self.task_to_node[task]
+
+        # unmap the routing paths to and from the task
+        prev_node, next_node = self.adjacent_nodes(task)
+        keys = [key for key in ((prev_node, target_node), (target_node, next_node)) if key in self.routing_paths]
+
+        if self._undo_log is not None:
+            routing_changes = [(key, self.routing_paths[key]) for key in keys]
+            self._undo_log.append(('unmap', task, target_node, routing_changes,
+                                   self.value, self._require_evaluation))
+
+        for key in keys:
+            self._drop_route(key)
+            self._touch_route(key)
+
+        self._release(task, target_node)
+        self._touch(task.workflow)
+        return True
+
+    def adjacent_nodes(self, task):
+        # nodes of the tasks before and after 'task' in its workflow, None if not mapped
+        tasks = task.workflow.tasks
+        i = tasks.index(task)
+        prev_node = self.task_to_node.get(tasks[i - 1]) if i > 0 else None
+        next_node = self.task_to_node.get(tasks[i + 1]) if i + 1 < len(tasks) else None
+        return prev_node, next_node
+
+    def _touch(self, wf):
+        self._require_evaluation = True
+        if self.eval_state is not None:
+            self.eval_state.dirty[wf] = True
+
+    def _set_route(self, key, path):
+        if key in self.routing_paths:
+            self._drop_route(key)
+        self.routing_paths[key] = path
+        if self._route_index is not None:
+            for node in path:
+                self._route_index[node].add(key)
+
+    def _drop_route(self, key):
+        path = self.routing_paths.pop(key, None)
+        if path and self._route_index is not None:
+            for node in path:
+                self._route_index[node].discard(key)
+
+    def _routes_through(self, node):
+        # keys of the routing_paths through 'node', indexed from the first call on (clones start without)
+        if self._route_index is None:
+            self._route_index = defaultdict(set)
+            for key, path in self.routing_paths.items():
+                for path_node in path:
+                    self._route_index[path_node].add(key)
+        return self._route_index.get(node, ())
+
+    def _tasks_on(self, nodes):
+        # the mapped tasks on any of 'nodes'
+        return [task for node in nodes for task in self.node_to_tasks[node]]
+
+    def _touch_route(self, key):
+        self._require_evaluation = True
+        if self.eval_state is not None:
+            self.eval_state.route_changed(key)
+
+    def is_mapped(self, task):
+        return task in self.task_to_node
+
+    def _assign(self, task, target_node):
         wf = task.workflow
+        self.task_to_node[task] = target_node
+        self.wf_to_nodes[wf][target_node] = True
+        later_tasks = wf.tasks[task.index - wf.tasks[0].index + 1:]
+        if any(t in self.task_to_node for t in later_tasks):
+            # wf_to_nodes lists nodes in task order, also when a middle task is mapped again
+            self.wf_to_nodes[wf] = {self.task_to_node[t]: True for t in wf.tasks if t in self.task_to_node}
 
-        # unmap routing path
-        mapped_nodes = list(self.wf_to_nodes[wf].keys())
-        if mapped_nodes[0] == target_node:
-            prev_node = None
-        else:
-            target_idx = mapped_nodes.index(target_node)
-            prev_node = mapped_nodes[target_idx - 1]
+        if len(self.wf_to_nodes[wf]) == wf.n_task:
+            self.wf_alloc[wf] = True
 
-        if prev_node and (prev_node, target_node) in self.routing_paths:
-            del self.routing_paths[(prev_node, target_node)]
+        self.node_to_tasks[target_node].add(task)
+        self.available_resources[target_node] -= task.required_resources
+        self.fingerprint ^= self.topology.zobrist_keys(task)[target_node.index]
+        if self._host_levels is not None:
+            self._update_host_masks(target_node)
 
+    def _release(self, task, target_node):
+        wf = task.workflow
         del self.wf_to_nodes[wf][target_node]
         self.wf_alloc[wf] = False
         del self.task_to_node[task]
         self.node_to_tasks[target_node].remove(task)
         self.available_resources[target_node] += task.required_resources
-        self._require_evaluation = True
-        return True
+        self.fingerprint ^= self.topology.zobrist_keys(task)[target_node.index]
+        if self._host_levels is not None:
+            self._update_host_masks(target_node)
+
+    # candidate sets as bitsets (see StaticTopology.adjacency_bits)
+
+    def candidate_mask(self, prev_node, task, multihop=False):
+        # the nodes 'task' is mappable() to after prev_node
+        mask = self.host_mask(task)
+        if not prev_node:
+            return mask
+
+        links = self.topology.reachable_bits if multihop else self.topology.adjacency_bits
+        return mask & links[prev_node.index] & ~self.visited_mask(task.workflow)
+
+    def visited_mask(self, wf):
+        mask = 0
+        for node in self.wf_to_nodes[wf]:
+            mask |= 1 << node.index
+        return mask
+
+    def used_mask(self):
+        # the nodes with a task
+        mask = 0
+        for node, tasks in self.node_to_tasks.items():
+            if tasks:
+                mask |= 1 << node.index
+        return mask
+
+    def host_mask(self, task):
+        # the nodes with enough of every resource for 'task'
+        if self._host_levels is None:
+            self._init_host_masks()
+
+        mask = -1
+        for name, levels, buckets in zip(self.topology.resource_names, self._host_levels, self._host_buckets):
+            d = task.required_resources[name]
+            p = bisect_left(levels, d)
+            if p == len(levels) or levels[p] != d:
+                # a demand that arrived with the workload after the masks were built
+                self._init_host_masks(task)
+                return self.host_mask(task)
+            mask &= reduce(or_, buckets[p + 1:], 0)
+        return mask
+
+    def _init_host_masks(self, task=None):
+        # the levels are the demands of the workload, and of 'task'
+        self._host_levels, self._host_buckets, self._node_buckets = [], [], []
+        for r, name in enumerate(self.topology.resource_names):
+            levels = np.unique(self.topology.demand_matrix[:, r])
+            if task is not None:
+                levels = np.union1d(levels, [task.required_resources[name]])
+            node_buckets = np.searchsorted(levels, self._resource_column(r), side='right').tolist()
+            buckets = [0] * (len(levels) + 1)
+            for i, j in enumerate(node_buckets):
+                buckets[j] |= 1 << i
+            self._host_levels.append(levels.tolist())
+            self._host_buckets.append(buckets)
+            self._node_buckets.append(node_buckets)
+
+    def _resource_column(self, r):
+        # available amount of resource_names[r] on every node, by node.index
+        name = self.topology.resource_names[r]
+        return np.array([self.available_resources[node][name] for node in self.topology.all_nodes])
+
+    def _update_host_masks(self, target_node):
+        # after the resources of target_node changed
+        available = self.available_resources[target_node]
+        self._move_to_buckets(target_node.index, [available[name] for name in self.topology.resource_names])
+
+    def _move_to_buckets(self, i, amounts):
+        bit = 1 << i
+        for levels, buckets, node_buckets, amount in zip(self._host_levels, self._host_buckets,
+                                                        self._node_buckets, amounts):
+            j, k = bisect_right(levels, amount), node_buckets[i]
+            if j != k:
+                buckets[k] &= ~bit
+                buckets[j] |= bit
+                node_buckets[i] = j
+
+    def _copy_host_masks(self, new_solution):
+        if self._host_levels is not None:
+            new_solution._host_levels = self._host_levels   # not modified, only replaced
+            new_solution._host_buckets = [list(buckets) for buckets in self._host_buckets]
+            new_solution._node_buckets = [list(node_buckets) for node_buckets in self._node_buckets]
+
+    # undo-log.
+    #   mark = solution.checkpoint()
+    #   ... map() / unmap() ...
+    #   solution.undo(solution.detach(mark))    # back to the state at checkpoint()
+    # checkpoints can be nested (detach in reverse order). recording stops when the outermost one is detached
+
+    def checkpoint(self):
+        if self._undo_log is None:
+            self._undo_log = []
+        self._n_checkpoint += 1
+        return len(self._undo_log)
+
+    def detach(self, mark):
+        # returns the records since checkpoint 'mark'
+        records = self._undo_log[mark:]
+        del self._undo_log[mark:]
+        self._n_checkpoint -= 1
+        if not self._n_checkpoint:
+            self._undo_log = None
+        return records
+
+    def undo(self, records):
+        for op, task, target_node, routing_changes, value, require_evaluation in reversed(records):
+            if op == 'map':
+                self._release(task, target_node)
+            else:
+                self._assign(task, target_node)
+
+            for key, path in routing_changes:
+                if path is None:
+                    self._drop_route(key)
+                else:
+                    self._set_route(key, path)
+                self._touch_route(key)
+
+            self._touch(task.workflow)
+            self.value, self._require_evaluation = value, require_evaluation
 
     def _route(self, src_node, dst_node):
         # min-hop routing
-        paths =deque([[src_node]])
-        while paths:
-            p = paths.popleft()
-            if p[-1] == dst_node:
-                return p
-            for neighbor in p[-1].neighbors:
-                if neighbor not in p:
-                    paths.append(p[:] + [neighbor])
-
-        return None
+        return self.topology.get_path(src_node, dst_node)
 
     @property
     def workflow_alloc_cnt(self):
@@ -150,9 +366,93 @@ class Solution:
     def assigned_nodes(self, workflow):
         return list(self.wf_to_nodes[workflow].keys())
 
+    def release_workflows(self, workflows):
+        # before 'workflows' leave the workload: frees everything they hold
+        for wf in workflows:
+            for task in reversed(wf.tasks):
+                self.unmap(task)
+
+        if self.eval_state is not None:
+            self.eval_state.forget(self, workflows)
+
+    def workload_changed(self, added, removed, old_workflows, old_tasks):
+        # after topology.change_workload(added, removed), which returned old_workflows / old_tasks.
+        # 'removed' must have been released
+        for wf in removed:
+            del self.wf_alloc[wf], self.wf_to_nodes[wf]
+        for wf in added:
+            self.wf_alloc[wf] = False
+            self.wf_to_nodes[wf] = {}
+
+    def topology_changed(self, change):
+        # after topology.step(): the workflows and routes on the moved nodes are re-evaluated,
+        # routes over a removed link are re-routed. returns the workflows that still need a removed link
+        # (they stay mapped: release or repair them).
+        # only the routes through the moved nodes and the workflows with a task on them (or on
+        # both ends of a route that is lost) are looked at
+        moved = set(change.moved)
+        if not moved:
+            return []
+
+        lost = set()
+        for key in set().union(*(self._routes_through(node) for node in moved)):
+            path = self.routing_paths[key]
+            if any(node2 not in node1.neighbors for node1, node2 in zip(path, path[1:])):
+                path = self._route(*key)
+                if not path:
+                    lost.add(key)
+                    continue
+                self._set_route(key, path)
+            self._touch_route(key)
+
+        # links are taken task by task (wf.tasks), skipping the tasks that are not mapped
+        workflows = {task.workflow for task in self._tasks_on(moved | {src_node for src_node, _ in lost})}
+        broken = []
+        task_to_node = self.task_to_node
+        for wf in sorted(workflows, key=lambda wf: wf.index):
+            nodes = [task_to_node.get(task) for task in wf.tasks]
+            touched = not moved.isdisjoint(nodes)
+            if touched:
+                self._touch(wf)
+
+            for key in zip(nodes, nodes[1:]):
+                if key[0] is None or key[1] is None:
+                    continue
+                if key in lost or touched and key not in self.routing_paths and key[1] not in key[0].neighbors:
+                    broken.append(wf)
+                    break
+
+        return broken
+
+    def encode(self):
+        # compact form: node.index of every task in topology.all_tasks order, -1 if not mapped
+        return np.array([self.task_to_node[task].index if task in self.task_to_node else -1
+                         for task in self.topology.all_tasks], dtype=np.int32)
+
+    @classmethod
+    def decode(cls, topology, evaluator, encoding, multihop=False):
+        # inverse of encode(): replays the mapping workflow by workflow
+        solution = cls(topology, evaluator)
+        all_nodes = topology.all_nodes
+        encoding = np.asarray(encoding).tolist()
+        for wf in topology.workflows:
+            prev_node = None
+            for task in wf.tasks:
+                if encoding[task.index] < 0:
+                    prev_node = None
+                    continue
+
+                target_node = all_nodes[encoding[task.index]]
+                if not solution.map(prev_node, task, target_node, multihop):
+                    raise ValueError(f'infeasible encoding: {task} -> {target_node}')
+                prev_node = target_node
+
+        return solution
+
     def evaluate(self):
-        self.value = self.evaluator.evaluate(self)
-        self._require_evaluation = False
+        if self._require_evaluation:
+            self.value = self.evaluator.evaluate(self)
+            self._require_evaluation = False
 
         return self.value
 
@@ -168,7 +468,10 @@ class Solution:
                                             for node in self.available_resources}
         new_solution.value = self.value
         new_solution._require_evaluation = self._require_evaluation
-        new_solution.routing_paths = {key:value[:] for key, value in self.routing_paths.items()}
+        new_solution.fingerprint = self.fingerprint
+        new_solution.routing_paths = dict(self.routing_paths)   # paths are shared tuples
+        new_solution.eval_state = self.eval_state.copy() if self.eval_state else None
+        self._copy_host_masks(new_solution)
 
         return new_solution
 
@@ -198,3 +501,278 @@ class Solution:
 # an alias of 'Solution'
 class Chromosome(Solution):
     pass
+
+
+class ArraySolution(Solution):
+    # the same logical state as Solution, kept in integer-indexed arrays (see topology.py for indices)
+    #   task_nodes[task.index]        : node.index the task is mapped to, -1 if not mapped
+    #   resources[node.index, r]      : available amount of topology.resource_names[r]
+    #   visited[wf.index, word]       : bitmask of the nodes used by a workflow, 64 nodes per word
+    #   wf_mapped_cnt[wf.index]       : number of mapped tasks of a workflow
+    # clone() copies these arrays only.
+    # task_to_node, wf_to_nodes, ... are read-only dict-like views, so allocators, solvers
+    # and evaluators work unchanged.
+
+    def _init_state(self):
+        topology = self.topology
+        n_word = (topology.n_all_node + 63) // 64
+        self.task_nodes = np.full(topology.n_all_task, -1, dtype=np.int32)
+        self.resources = topology.capacity_matrix.copy()
+        self.visited = np.zeros((len(topology.workflows), n_word), dtype=np.uint64)
+        self.wf_mapped_cnt = np.zeros(len(topology.workflows), dtype=np.int32)
+        self.wf_sizes = np.array([wf.n_task for wf in topology.workflows], dtype=np.int32)
+        self.routing_paths = {}
+        self._route_index = None
+
+    def mappable(self, prev_node, task, target_node, multihop=False):
+        i = target_node.index
+        resource_ok = bool((self.topology.demand_matrix[task.index] <= self.resources[i]).all())
+        if not prev_node:
+            return resource_ok
+
+        visited = self._is_visited(task.workflow.index, i)
+        if not multihop:
+            connected = target_node in prev_node.neighbors
+        else:
+            connected = self._is_connected(prev_node, target_node)
+
+        return not visited and connected and resource_ok
+
+    def _is_visited(self, wf_index, node_index):
+        return int(self.visited[wf_index, node_index >> 6]) >> (node_index & 63) & 1
+
+    def is_mapped(self, task):
+        return self.task_nodes[task.index] >= 0
+
+    def _assign(self, task, target_node):
+        t, i, w = task.index, target_node.index, task.workflow.index
+        self.task_nodes[t] = i
+        self.resources[i] -= self.topology.demand_matrix[t]
+        self.visited[w, i >> 6] |= np.uint64(1 << (i & 63))
+        self.wf_mapped_cnt[w] += 1
+        self.fingerprint ^= self.topology.zobrist_keys(task)[i]
+        if self._host_levels is not None:
+            self._update_host_masks(target_node)
+
+    def _release(self, task, target_node):
+        t, i, w = task.index, target_node.index, task.workflow.index
+        self.task_nodes[t] = -1
+        self.resources[i] += self.topology.demand_matrix[t]
+        self.visited[w, i >> 6] &= ~np.uint64(1 << (i & 63))
+        self.wf_mapped_cnt[w] -= 1
+        self.fingerprint ^= self.topology.zobrist_keys(task)[i]
+        if self._host_levels is not None:
+            self._update_host_masks(target_node)
+
+    def visited_mask(self, wf):
+        return int.from_bytes(self.visited[wf.index].tobytes(), 'little')
+
+    def _resource_column(self, r):
+        return self.resources[:, r]
+
+    def _update_host_masks(self, target_node):
+        self._move_to_buckets(target_node.index, self.resources[target_node.index].tolist())
+
+    @property
+    def workflow_alloc_cnt(self):
+        return int((self.wf_mapped_cnt == self.wf_sizes).sum())
+
+    def is_allocated(self, wf):
+        return self.wf_mapped_cnt[wf.index] == wf.n_task
+
+    def assigned_nodes(self, workflow):
+        first = workflow.tasks[0].index
+        all_nodes = self.topology.all_nodes
+        return [all_nodes[i] for i in self.task_nodes[first:first + workflow.n_task].tolist() if i >= 0]
+
+    def encode(self):
+        return self.task_nodes.copy()
+
+    def workload_changed(self, added, removed, old_workflows, old_tasks):
+        # moves the rows of the remaining tasks / workflows to their new indices
+        topology = self.topology
+        new_index = np.array([task.index for task in old_tasks], dtype=np.int64)
+        kept = new_index >= 0
+        task_nodes = np.full(topology.n_all_task, -1, dtype=np.int32)
+        task_nodes[new_index[kept]] = self.task_nodes[kept]
+
+        new_index = np.array([wf.index for wf in old_workflows], dtype=np.int64)
+        kept = new_index >= 0
+        visited = np.zeros((len(topology.workflows), self.visited.shape[1]), dtype=np.uint64)
+        visited[new_index[kept]] = self.visited[kept]
+        wf_mapped_cnt = np.zeros(len(topology.workflows), dtype=np.int32)
+        wf_mapped_cnt[new_index[kept]] = self.wf_mapped_cnt[kept]
+
+        self.task_nodes, self.visited, self.wf_mapped_cnt = task_nodes, visited, wf_mapped_cnt
+        self.wf_sizes = np.array([wf.n_task for wf in topology.workflows], dtype=np.int32)
+
+    def clone(self):
+        new_solution = copy(self)
+        Solution.id_base += 1
+        new_solution.id = Solution.id_base
+        new_solution.task_nodes = self.task_nodes.copy()
+        new_solution.resources = self.resources.copy()
+        new_solution.visited = self.visited.copy()
+        new_solution.wf_mapped_cnt = self.wf_mapped_cnt.copy()
+        new_solution.routing_paths = dict(self.routing_paths)   # paths are shared tuples
+        new_solution._route_index = None
+        new_solution._undo_log = None
+        new_solution._n_checkpoint = 0
+        new_solution.eval_state = self.eval_state.copy() if self.eval_state else None
+        self._copy_host_masks(new_solution)
+
+        return new_solution
+
+    def used_mask(self):
+        used = np.zeros(len(self.topology.all_nodes), dtype=bool)
+        used[self.task_nodes[self.task_nodes >= 0]] = True
+        return bits_of(used)
+
+    def _tasks_on(self, nodes):
+        all_tasks = self.topology.all_tasks
+        on_nodes = np.isin(self.task_nodes, [node.index for node in nodes])
+        return [all_tasks[t] for t in np.flatnonzero(on_nodes)]
+
+    # dict-like views, same as the attributes of Solution
+
+    @property
+    def task_to_node(self):
+        all_nodes, all_tasks = self.topology.all_nodes, self.topology.all_tasks
+
+        def get(task):
+            i = self.task_nodes[task.index]
+            if i < 0:
+                raise KeyError(task)
+            return all_nodes[i]
+
+        return _SolutionView(lambda: (all_tasks[t] for t in np.flatnonzero(self.task_nodes >= 0)), get)
+
+    @property
+    def node_to_tasks(self):
+        all_nodes, all_tasks = self.topology.all_nodes, self.topology.all_tasks
+        return _SolutionView(lambda: all_nodes,
+                             lambda node: {all_tasks[t] for t in np.flatnonzero(self.task_nodes == node.index)})
+
+    @property
+    def wf_to_nodes(self):
+        return _SolutionView(lambda: self.topology.workflows,
+                             lambda wf: dict.fromkeys(self.assigned_nodes(wf), True))
+
+    @property
+    def wf_alloc(self):
+        return _SolutionView(lambda: self.topology.workflows, self.is_allocated)
+
+    @property
+    def available_resources(self):
+        names = self.topology.resource_names
+        return _SolutionView(lambda: self.topology.all_nodes,
+                             lambda node: Resources(zip(names, self.resources[node.index].tolist())))
+
+
+class _SolutionView(Mapping):
+    # read-only mapping over the arrays of an ArraySolution
+
+    def __init__(self, keys, getter):
+        self._keys = keys
+        self._getter = getter
+
+    def __getitem__(self, key):
+        return self._getter(key)
+
+    def __iter__(self):
+        return iter(self._keys())
+
+    def __len__(self):
+        return sum(1 for _ in self._keys())
+
+
+class Move(metaclass=ABCMeta):
+    # an in-place, revertible change of a Solution.
+    # a solver can score a whole neighborhood on one solution with peek_delta()
+    # and apply() only the chosen move, instead of cloning the solution per candidate
+
+    def __init__(self, multihop=False):
+        self.multihop = multihop
+        self._records = None
+
+    def apply(self, solution):
+        # returns False (and leaves 'solution' untouched) if the move is not feasible
+        mark = solution.checkpoint()
+        done = self._apply(solution)
+        self._records = solution.detach(mark)
+        if not done:
+            solution.undo(self._records)
+            self._records = None
+        return done
+
+    def revert(self, solution):
+        # undoes the last apply() on 'solution'
+        solution.undo(self._records)
+        self._records = None
+
+    def peek_delta(self, solution):
+        # change of the evaluation key if this move were applied, None if not feasible
+        before = solution.evaluate().key
+        if not self.apply(solution):
+            return None
+
+        after = solution.evaluate().key
+        self.revert(solution)
+        return after - before
+
+    @abstractmethod
+    def _apply(self, solution):
+        return False
+
+    def _map(self, solution, task, target_node):
+        # unlike Solution.map(), the first task of a workflow may not share a node
+        # with the other tasks of the workflow either.
+        # both links of the task are checked (and routed, multihop): to its predecessor and its successor
+        if target_node in solution.assigned_nodes(task.workflow):
+            return False
+
+        prev_node, next_node = solution.adjacent_nodes(task)
+        return solution.map(prev_node, task, target_node, self.multihop, next_node)
+
+
+class RelocateMove(Move):
+    # moves 'task' to 'target_node'
+
+    def __init__(self, task, target_node, multihop=False):
+        super().__init__(multihop)
+        self.task = task
+        self.target_node = target_node
+
+    def _apply(self, solution):
+        return solution.unmap(self.task) and self._map(solution, self.task, self.target_node)
+
+    def __repr__(self):
+        return f'Relocate({self.task}->{self.target_node})'
+
+
+class SwapMove(Move):
+    # exchanges the nodes of two mapped tasks
+
+    def __init__(self, task1, task2, multihop=False):
+        super().__init__(multihop)
+        self.task1 = task1
+        self.task2 = task2
+
+    def _apply(self, solution):
+        if not solution.is_mapped(self.task1) or not solution.is_mapped(self.task2):
+            return False
+
+        targets = {self.task1: solution.task_to_node[self.task2],
+                   self.task2: solution.task_to_node[self.task1]}
+        solution.unmap(self.task1)
+        solution.unmap(self.task2)
+
+        # within a workflow, the earlier task first, so the later one sees its predecessor mapped
+        tasks = [self.task1, self.task2]
+        if self.task1.workflow is self.task2.workflow:
+            tasks.sort(key=self.task1.workflow.tasks.index)
+
+        return all(self._map(solution, task, targets[task]) for task in tasks)
+
+    def __repr__(self):
+        return f'Swap({self.task1}<->{self.task2})'
@@ -1,7 +1,10 @@
 from abc import *
+from random import seed
 
-from evaluator import BaseEvaluator
+from evaluator import BaseEvaluator, EvaluationStatistics, BestOf
+from topology import WeakListener
 from parameters import *
+from parallel import allocate_in_parallel
 
 
 class Solver(metaclass=ABCMeta):
@@ -11,6 +14,7 @@ class Solver(metaclass=ABCMeta):
         self.topology = topology
         self.allocator = allocator
         self.evaluator = evaluator
+        topology.listeners.append(WeakListener(self.topology_changed))
 
     @abstractmethod
     def solve(self):
@@ -18,10 +22,59 @@ class Solver(metaclass=ABCMeta):
         return solution
 
     @abstractmethod
-    def re_solve(self):
+    def re_solve(self, added_workflows=(), removed_workflows=()):
         # this method is called when Workload(Workflows & Tasks) changed
+        # warm start: continues from the previous solution(s) instead of solving from scratch
         pass
 
+    def _change_workload(self, solutions, added_workflows, removed_workflows):
+        for solution in solutions:
+            solution.release_workflows(removed_workflows)
+        old_workload = self.topology.change_workload(added_workflows, removed_workflows)
+        for solution in solutions:
+            solution.workload_changed(added_workflows, removed_workflows, *old_workload)
+
+    def topology_changed(self, change):
+        # after topology.step(): the solutions this solver keeps follow the change,
+        # and their workflows that lost a link are placed again
+        for solution in self._kept_solutions():
+            broken = solution.topology_changed(change)
+            if broken:
+                for wf in broken:
+                    for task in reversed(wf.tasks):
+                        solution.unmap(task)
+                self.allocator.extend(solution, broken)
+
+    def _kept_solutions(self):
+        # the solutions re_solve() continues from
+        return []
+
+    def _place(self, solution, workflows, n_trial=1):
+        # allocates 'workflows' into 'solution', keeping the best of 'n_trial' allocator placements.
+        # trials are undone in place, so the cost does not depend on the size of 'solution'
+        if n_trial <= 1:
+            return self.allocator.extend(solution, workflows)
+
+        best_key, best_placement = None, None
+        for _ in range(n_trial):
+            mark = solution.checkpoint()
+            self.allocator.extend(solution, workflows)
+            key = (-solution.workflow_alloc_cnt, solution.evaluate().key)
+            placement = [[solution.task_to_node[task] if solution.is_mapped(task) else None for task in wf.tasks]
+                         for wf in workflows]
+            solution.undo(solution.detach(mark))
+            if best_key is None or key < best_key:
+                best_key, best_placement = key, placement
+
+        for wf, nodes in zip(workflows, best_placement):
+            prev_node = None
+            for task, node in zip(wf.tasks, nodes):
+                if node is not None:
+                    solution.map(prev_node, task, node)
+                prev_node = node
+
+        return solution
+
     # @staticmethod
     # def _normalize(evaluations):
     #     if not evaluations:
@@ -40,8 +93,7 @@ class Solver(metaclass=ABCMeta):
     def print_summary(self, solutions):
         sovler_name = self.__class__.__name__
 
-        best_solution = self.evaluator.get_best(solutions)
-        if not best_solution:
+        if not solutions:
             print(f"[DBG] {sovler_name}: No feasible solution found")
             return
 
@@ -49,7 +101,13 @@ class Solver(metaclass=ABCMeta):
             for solution in solutions:
                 solution.print_allocation()
 
-        evaluations = list(map(lambda s: s.evaluate(), solutions))
+        if self.evaluator.use_batch(solutions):
+            batch = self.evaluator.batch.evaluate_solutions(solutions)
+            best_solution = solutions[batch.order()[0]]
+            evaluations = [batch[i] for i in range(len(solutions))]
+        else:
+            best_solution = self.evaluator.get_best(solutions)
+            evaluations = list(map(lambda s: s.evaluate(), solutions))
         #eval_norm = self._normalize(evaluations)
 
         if DEBUG:
@@ -62,11 +120,38 @@ class Solver(metaclass=ABCMeta):
 
 
 class SimpleSolver(Solver):
-    def __init__(self, topology, allocator, evaluator, size=100000):
+    # best of 'size' allocator.allocate_workflows() results.
+    # by default the solutions are reduced as they are generated: only the best 'top_k' are kept
+    # (self.top_solutions, best first). top_k=None keeps every solution.
+    # with 'statistics', self.statistics summarizes all the generated solutions
+
+    def __init__(self, topology, allocator, evaluator, size=100000, n_workers=0, seed=None,
+                 top_k=1, statistics=False, repair_size=16):
         super().__init__(topology, allocator, evaluator)
         self.size=size
+        self.n_workers = n_workers  # > 0: solutions are generated by this many processes
+        self.seed = seed
+        self.top_k = top_k
+        self.collect_statistics = statistics
+        self.repair_size = repair_size  # placements of arriving workflows tried by re_solve()
+        self.top_solutions = []
+        self.statistics = None
+        self.best_solution = None
 
     def solve(self):
+        if self.seed is not None:
+            seed(self.seed)
+
+        self.best_solution = self._solve()
+        return self.best_solution
+
+    def _solve(self):
+        if self.n_workers > 0:
+            return self._solve_in_parallel()
+
+        if self.top_k:
+            return self._solve_streaming()
+
         solutions = []
         for _ in range(self.size):
             solution = self.allocator.allocate_workflows()
@@ -79,10 +164,68 @@ class SimpleSolver(Solver):
         best_solution = self.evaluator.get_best(solutions)
         return best_solution
 
-    def re_solve(self):
-        pass
+    def _solve_streaming(self):
+        best = BestOf(self.top_k)
+        self.statistics = EvaluationStatistics() if self.collect_statistics else None
+        for _ in range(self.size):
+            solution = self.allocator.allocate_workflows()
+            if not solution:
+                continue
+
+            best.push((-solution.workflow_alloc_cnt, solution.evaluate().key), solution)
+            if self.statistics:
+                self.statistics.add(solution.workflow_alloc_cnt, solution.evaluate())
+
+        self.top_solutions = best.items()
+        if DEBUG:
+            self.print_summary(self.top_solutions)
+            if self.statistics:
+                print(f"[DBG] {self.__class__.__name__} statistics: {self.statistics}")
+
+        return self.top_solutions[0] if self.top_solutions else None
+
+    def _solve_in_parallel(self):
+        # workers return encodings with their keys; only the kept ones are decoded
+        encodings, keys, self.statistics = allocate_in_parallel(self.allocator, self.size, self.n_workers,
+                                                                top_k=self.top_k,
+                                                                statistics=self.collect_statistics)
+        if not keys:
+            return None
+
+        decode = lambda encoding: self.allocator.solution_type.decode(self.topology, self.evaluator, encoding)
+        if self.top_k:
+            self.top_solutions = [decode(encoding) for encoding in encodings]
+            best_solution = self.top_solutions[0]
+        else:
+            best = min(range(len(keys)), key=keys.__getitem__)
+            best_solution = decode(encodings[best])
+
+        if DEBUG:
+            self.print_summary(self.top_solutions if self.top_k else [decode(encoding) for encoding in encodings])
+            if self.statistics:
+                print(f"[DBG] {self.__class__.__name__} statistics: {self.statistics}")
+
+        return best_solution
+
+    def re_solve(self, added_workflows=(), removed_workflows=()):
+        # the best solution keeps its allocation; arriving workflows get the best of
+        # 'repair_size' random placements into the remaining capacity
+        if self.best_solution is None:
+            self.topology.change_workload(added_workflows, removed_workflows)
+            return self.solve()
+
+        self._change_workload([self.best_solution], added_workflows, removed_workflows)
+        self._place(self.best_solution, added_workflows, self.repair_size)
+        self.top_solutions = [self.best_solution]    # the others are of the previous workload
+        return self.best_solution
+
+    def _kept_solutions(self):
+        if self.best_solution is None:
+            return []
+        return [self.best_solution] + [solution for solution in self.top_solutions if solution is not self.best_solution]
 
 
 class OptimalSolver(SimpleSolver):
     def __init__(self, topology, allocator, evaluator):
-        super().__init__(topology, allocator, evaluator, size=1)
+        # extend() of the OptimalAllocator is optimal already: one placement per re_solve()
+        super().__init__(topology, allocator, evaluator, size=1, repair_size=1)
@@ -1,8 +1,13 @@
 from solver import *
 from solution import *
-from random import shuffle, sample, random, choice
-from dataclasses import dataclass
+from random import shuffle, sample, random, choice, choices, seed
+from dataclasses import dataclass, replace
 from heapq import *
+from itertools import count
+from collections import Counter, OrderedDict
+from parallel import WorkerPool, WorkerProcess, allocate_in_parallel
+from random import Random
+import numpy as np
 
 @dataclass
 class GeneticSolverParameters:
@@ -10,56 +15,274 @@ class GeneticSolverParameters:
     n_generation: int
     #selection_ratio: float   # not used
     mutation_ratio: float
+    selection: str = 'random'   # parent selection: 'random', 'tournament' or 'rank'
+    tournament_size: int = 2
+    n_workers: int = 0      # > 0: offspring are generated in batches by this many processes
+    batch_size: int = 0     # children per batch (default: 4 per worker)
+    seed: int = None
+    n_repair_generation: int = 100      # generations re_solve() runs per arriving workflow
+
+
+class Population:
+    # GA population that keeps the fitness key (-alloc_cnt, evaluation key) of every member,
+    # so comparing, ranking and selecting members never goes back to the evaluator.
+    # a smaller key is better, as in BaseEvaluator.get_best().
+    #
+    # '_worst' / '_best' are heaps of (key, tick, member). an entry is stale once its member
+    # was replaced or mutated (its tick is no longer the member's current one); stale
+    # entries are skipped when they reach the top.
+    #
+    # members are also counted by Solution.fingerprint, so copies of a member can be kept out (see holds())
+
+    def __init__(self, members=()):
+        self.members = []   # in no particular order, for sampling
+        self._slot = {}     # member -> position in self.members
+        self._key = {}
+        self._tick = {}
+        self._fingerprint = {}      # member -> its fingerprint when it was (re)keyed
+        self._encoding = {}         # member -> its encode(), see encoding()
+        self._fingerprints = Counter()
+        self._worst = []
+        self._best = []
+        self._ticks = count()
+        self._ranked = None
+        for member in members:
+            self.add(member)
+
+    def __len__(self):
+        return len(self.members)
+
+    def __iter__(self):
+        return iter(self.members)
+
+    @staticmethod
+    def fitness(solution):
+        return -solution.workflow_alloc_cnt, solution.evaluate().key
+
+    def key(self, member):
+        return self._key[member]
+
+    def encoding(self, member):
+        # member.encode(), made once until the member is re-keyed
+        encoding = self._encoding.get(member)
+        if encoding is None:
+            encoding = self._encoding[member] = member.encode()
+        return encoding
+
+    def holds(self, solution):
+        # whether a member has the same mapping as 'solution'
+        return solution.fingerprint in self._fingerprints
+
+    def add(self, member, key=None):
+        self._slot[member] = len(self.members)
+        self.members.append(member)
+        self._push(member, key)
+
+    def invalidate(self, member):
+        # 'member' may have been changed in place (e.g. by GeneticSolver._mutate()):
+        # it is re-keyed only if its mapping did change
+        if member.fingerprint != self._fingerprint[member]:
+            self._push(member)
+
+    def rekey(self, member):
+        # what 'member' evaluates to changed, not its mapping (e.g. nodes moved, the workload changed)
+        self._push(member)
+
+    def _push(self, member, key=None):
+        if key is None:
+            key = self.fitness(member)
+        tick = next(self._ticks)
+        self._key[member] = key
+        self._tick[member] = tick
+        if member in self._fingerprint:
+            self._forget_fingerprint(member)
+        self._encoding.pop(member, None)
+        self._fingerprint[member] = member.fingerprint
+        self._fingerprints[member.fingerprint] += 1
+        heappush(self._worst, ((-key[0], -key[1]), tick, member))
+        heappush(self._best, (key, tick, member))
+        self._ranked = None
+        if len(self._best) > 2 * len(self.members) + 16:
+            self._compact()
+
+    def _forget_fingerprint(self, member):
+        fingerprint = self._fingerprint.pop(member)
+        self._fingerprints[fingerprint] -= 1
+        if not self._fingerprints[fingerprint]:
+            del self._fingerprints[fingerprint]
+
+    def _compact(self):
+        self._worst = [entry for entry in self._worst if self._is_current(entry)]
+        self._best = [entry for entry in self._best if self._is_current(entry)]
+        heapify(self._worst)
+        heapify(self._best)
+
+    def _is_current(self, entry):
+        _, tick, member = entry
+        return self._tick.get(member) == tick
+
+    def _top(self, heap):
+        while not self._is_current(heap[0]):
+            heappop(heap)
+        return heap[0][2]
+
+    def best(self):
+        return self._top(self._best) if self.members else None
+
+    def worst(self):
+        return self._top(self._worst) if self.members else None
+
+    def remove(self, member):
+        # swap with the last member to keep self.members dense
+        slot = self._slot.pop(member)
+        last = self.members.pop()
+        if last is not member:
+            self.members[slot] = last
+            self._slot[last] = slot
+        del self._key[member], self._tick[member]
+        self._encoding.pop(member, None)
+        self._forget_fingerprint(member)
+        self._ranked = None
+
+    def replace_worst(self, member, key=None):
+        worst = self.worst()
+        self.remove(worst)
+        self.add(member, key)
+        return worst
+
+    def ranked(self):
+        # best first
+        if self._ranked is None:
+            self._ranked = sorted(self.members, key=self._key.__getitem__)
+        return self._ranked
+
+    def select_tournament(self, size=2):
+        return min(sample(self.members, size), key=self._key.__getitem__)
+
+    def select_by_rank(self):
+        # linear ranking: the i-th best of n members is chosen with weight n - i
+        ranked = self.ranked()
+        return choices(ranked, weights=range(len(ranked), 0, -1))[0]
 
 
 class GeneticSolver(Solver):
     def __init__(self, topology, allocator, evaluator, params):
         super().__init__(topology, allocator, evaluator)
         self.params = params
-        self.population = []
+        self.population = Population()
+        self.n_duplicate = 0    # children dropped as copies of a member
+        self.n_child = 0        # children bred, what n_generation counts
+        self.n_no_child = 0     # crossovers that gave no child
 
     def solve(self):
-        self.population = []
-        for _ in range(self.params.population_size):
-            chromosome = self.allocator.allocate_workflows()
-            self.population.append(chromosome)
+        if self.params.seed is not None:
+            seed(self.params.seed)
 
-        heapify(self.population)
+        self._init_population()
 
+        if self.params.n_workers > 0:
+            self._evolve_in_batches(self.params.n_generation)
+        else:
+            self._evolve(self.params.n_generation)
+
+        if DEBUG:
+            self.print_summary(self.population.members)
+
+        return self.population.best()
+
+    def _init_population(self):
+        if self.params.n_workers > 0:
+            encodings, keys, _ = allocate_in_parallel(self.allocator, self.params.population_size, self.params.n_workers)
+            self.population = Population()
+            for encoding, key in zip(encodings, keys):
+                self.population.add(self.allocator.solution_type.decode(self.topology, self.evaluator, encoding), key)
+            return
+
+        self.population = Population(self.allocator.allocate_workflows()
+                                     for _ in range(self.params.population_size))
+
+    def _evolve(self, n_generation):
         n_iter = 0
-        while n_iter < self.params.n_generation:
+        while n_iter < n_generation:
             # self.population = self._make_next_generation()
-            mother, father = sample(self.population, 2)
+            mother, father = self._select_parents()
             child = self._crossover(mother, father)
             if not child:
+                self.n_no_child += 1
                 continue
 
-            if mother < child or father < child:
-                heappop(self.population)
-                heappush(self.population, child)
+            # a copy of a member would only crowd out the others
+            if self.population.holds(child):
+                self.n_duplicate += 1
+            else:
+                child_key = self.population.fitness(child)
+                if child_key < self.population.key(mother) or child_key < self.population.key(father):
+                    self.population.replace_worst(child)
 
             if random() < self.params.mutation_ratio:
-                self._mutate(choice(self.population))
+                chromosome = choice(self.population.members)
+                self._mutate(chromosome)
+                self.population.invalidate(chromosome)
 
             if DEBUG:
                 if n_iter in [0, 10, 100, 1000] or n_iter % len(self.population) == 0:
-                    answer = self.evaluator.get_best(self.population)
+                    answer = self.population.best()
                     if answer:
-                        print(n_iter, "th iteration:", self.evaluator.get_best(self.population))
+                        print(n_iter, "th iteration:", answer)
                     else:
                         print(n_iter, "th iteration: no solution")
 
+            self.n_child += 1
             n_iter += 1
 
-        if DEBUG:
-            self.print_summary(self.population)
+    def _evolve_in_batches(self, n_generation):
+        # steady-state, like _evolve(), but 'batch_size' children are bred and evaluated at a time
+        # in worker processes. mutation is applied to the children there, instead of to a random member.
+        # parents go as (fingerprint, encoding): each is encoded once here, and decoded once per worker
+        batch_size = self.params.batch_size or 4 * self.params.n_workers
+        with WorkerPool(self.params.n_workers, self.allocator, self) as pool:
+            n_iter = 0
+            while n_iter < n_generation:
+                parents = [self._select_parents() for _ in range(min(batch_size, n_generation - n_iter))]
+                # keys are taken now: a parent may be replaced before its child is looked at
+                parent_keys = [(self.population.key(mother), self.population.key(father))
+                               for mother, father in parents]
+                jobs = [((mother.fingerprint, self.population.encoding(mother)),
+                         (father.fingerprint, self.population.encoding(father))) for mother, father in parents]
 
-        return self.evaluator.get_best(self.population)
+                for (mother_key, father_key), result in zip(parent_keys, pool.map(_breed, jobs)):
+                    if result is None:
+                        self.n_no_child += 1
+                        continue
+
+                    encoding, child_key = result
+                    if child_key < mother_key or child_key < father_key:
+                        child = self.allocator.solution_type.decode(self.topology, self.evaluator, encoding)
+                        if self.population.holds(child):
+                            self.n_duplicate += 1
+                        else:
+                            self.population.replace_worst(child, child_key)
+
+                    if DEBUG:
+                        if n_iter in [0, 10, 100, 1000] or n_iter % len(self.population) == 0:
+                            print(n_iter, "th iteration:", self.population.best())
+
+                    self.n_child += 1
+                    n_iter += 1
+
+    def _select_parents(self):
+        if self.params.selection == 'tournament':
+            return (self.population.select_tournament(self.params.tournament_size),
+                    self.population.select_tournament(self.params.tournament_size))
+        elif self.params.selection == 'rank':
+            return self.population.select_by_rank(), self.population.select_by_rank()
+        else:
+            return sample(self.population.members, 2)
 
     def _crossover(self, mother, father):
         # random cut point
-        cut_point = randint(1, global_params.NumOfWorkflows - 1)
-        child = Solution(self.topology, self.evaluator)
+        cut_point = randint(1, len(self.topology.workflows) - 1)
+        child = self.allocator.solution_type(self.topology, self.evaluator)
         for i, wf in enumerate(self.topology.workflows):
             base = mother if i < cut_point else father
             prev_node = None
@@ -87,31 +310,31 @@ class GeneticSolver(Solver):
     def _select_mappable_neighbor(self, chromosome, prev_node, task):
         assert prev_node is not None
 
-        neighbors = list(prev_node.neighbors)
-        shuffle(neighbors)
-        candidates = []
-        for neighbor in neighbors:
-            if chromosome.mappable(prev_node, task, neighbor):
-                candidates.append(neighbor)
-
+        candidates = self.topology.nodes_of(chromosome.candidate_mask(prev_node, task))
         if not candidates:
             return None
         else:
             return choice(candidates)
 
-    def _mutate(self, chromosome):
-        for wf in self.topology.workflows:
+    def _mutate(self, chromosome, workflows=None):
+        # every task but the first of a workflow is relocated to a random node that links
+        # to the nodes of its neighboring tasks, if there is one
+        for wf in workflows if workflows is not None else self.topology.workflows:
             if wf.tasks[0] not in chromosome.task_to_node:
-                return
+                continue
 
-            prev_node = chromosome.task_to_node[wf.tasks[0]]
             for task in wf.tasks[1:]:
-                new_target = self._select_mappable_neighbor(chromosome, prev_node, task)
-                if not new_target:
-                    prev_node = chromosome.task_to_node[task]
-                else:
-                    chromosome.map(prev_node, task, new_target)
-                    prev_node = new_target
+                new_target = self._select_relocation(chromosome, task)
+                if new_target:
+                    RelocateMove(task, new_target).apply(chromosome)
+
+    def _select_relocation(self, chromosome, task):
+        prev_node, next_node = chromosome.adjacent_nodes(task)
+        mask = chromosome.candidate_mask(prev_node, task)
+        if next_node is not None:
+            mask &= self.topology.adjacency_bits[next_node.index]
+        candidates = self.topology.nodes_of(mask)
+        return choice(candidates) if candidates else None
 
     # main tasks for GA
     # not used currently
@@ -154,5 +377,296 @@ class GeneticSolver(Solver):
     #
     #     return selected
 
-    def re_solve(self):
-        pass
+    def _kept_solutions(self):
+        return list(self.population.members)
+
+    def topology_changed(self, change):
+        super().topology_changed(change)
+        if change.moved:
+            for member in self.population.members:
+                self.population.rekey(member)
+
+    def re_solve(self, added_workflows=(), removed_workflows=()):
+        # every member keeps its allocation and its evaluation of the workflows that stay;
+        # arriving workflows are placed at random into each member's remaining capacity,
+        # then only they evolve, for n_repair_generation generations each
+        if not self.population:
+            self.topology.change_workload(added_workflows, removed_workflows)
+            return self.solve()
+
+        members = list(self.population.members)
+        self._change_workload(members, added_workflows, removed_workflows)
+        for member in members:
+            self.allocator.extend(member, added_workflows)
+            self.population.rekey(member)
+
+        self._repair(list(added_workflows), self.params.n_repair_generation * len(added_workflows))
+        return self.population.best()
+
+    def _repair(self, workflows, n_generation):
+        # steady-state like _evolve(), but a child is its mother with the placements of some of
+        # 'workflows' taken from its father, and only 'workflows' mutate. the other workflows of
+        # a child are never re-evaluated (see Solution.eval_state)
+        for _ in range(n_generation):
+            mother, father = self._select_parents()
+            child = mother.clone()
+            for wf in workflows:
+                if random() < 0.5 and father.is_allocated(wf):
+                    self._take_placement(child, father, wf)
+
+            if random() < self.params.mutation_ratio:
+                self._mutate(child, workflows)
+
+            if self.population.holds(child):
+                self.n_duplicate += 1
+                continue
+
+            child_key = self.population.fitness(child)
+            if child_key < self.population.key(mother) or child_key < self.population.key(father):
+                self.population.replace_worst(child, child_key)
+
+    @staticmethod
+    def _take_placement(child, parent, wf):
+        # maps 'wf' in 'child' as in 'parent', if it fits there; 'child' is unchanged otherwise
+        mark = child.checkpoint()
+        for task in reversed(wf.tasks):
+            child.unmap(task)
+
+        prev_node, placed = None, True
+        for task in wf.tasks:
+            target_node = parent.task_to_node[task]
+            if not child.map(prev_node, task, target_node):
+                placed = False
+                break
+            prev_node = target_node
+
+        records = child.detach(mark)
+        if not placed:
+            child.undo(records)
+
+
+@dataclass
+class IslandSolverParameters:
+    islands: list               # GeneticSolverParameters of every island (own mutation_ratio, seed, ...)
+    migration_interval: int     # generations between migrations
+    n_migrants: int             # top-k chromosomes every island sends
+    migration_topology: str = 'ring'    # 'ring': island i -> i+1, 'random': to a random other island
+    seed: int = None            # for islands without a seed and for the random migration topology
+
+
+@dataclass
+class IslandStats:
+    island: int
+    mutation_ratio: float
+    # one entry per migration epoch:
+    #   (generations so far, best key, mean key, mean alloc_cnt, accepted immigrants)
+    history: list
+
+
+class IslandSolver(Solver):
+    # island-model GA: every island is a GeneticSolver with its own population, running in its own
+    # process. every 'migration_interval' generations each island sends copies of its 'n_migrants'
+    # best chromosomes to another island, where they replace the worst members they beat.
+    # islands always evolve serially; GeneticSolverParameters.n_workers is ignored.
+
+    def __init__(self, topology, allocator, evaluator, params):
+        super().__init__(topology, allocator, evaluator)
+        self.params = params
+        self.island_stats = []
+        self._island_params = None
+        self._populations = None    # encodings of the members of every island, after the last run
+        self._unplaced = set()      # workflows unmapped in some of them by topology_changed()
+
+    def solve(self):
+        rng = Random(self.params.seed)
+        self._island_params = [replace(params, n_workers=0,
+                                       seed=params.seed if params.seed is not None else rng.getrandbits(64))
+                               for params in self.params.islands]
+        return self._run_islands(rng, [(_island_start,)] * len(self._island_params),
+                                 [params.n_generation for params in self._island_params])
+
+    def re_solve(self, added_workflows=(), removed_workflows=()):
+        # every island continues from its population: members keep their allocation, arriving workflows
+        # are placed into their remaining capacity, and only those evolve (see GeneticSolver._repair())
+        # for n_repair_generation generations per arriving workflow
+        if self._populations is None:
+            self.topology.change_workload(added_workflows, removed_workflows)
+            return self.solve()
+
+        _, old_tasks = self.topology.change_workload(added_workflows, removed_workflows)
+        new_index = np.array([task.index for task in old_tasks], dtype=np.int64)
+        kept = new_index >= 0
+        added = [wf.index for wf in self._unplaced if wf.index >= 0] + [wf.index for wf in added_workflows]
+        self._unplaced = set()
+        starts = []
+        for encodings in self._populations:
+            # the remaining tasks move to their new indices, as in ArraySolution.workload_changed()
+            encodings = np.asarray(encodings, dtype=np.int32).reshape(-1, len(old_tasks))
+            moved = np.full((len(encodings), self.topology.n_all_task), -1, dtype=np.int32)
+            moved[:, new_index[kept]] = encodings[:, kept]
+            starts.append((_island_resume, moved, added))
+
+        rng = Random(self.params.seed)
+        return self._run_islands(rng, starts, [params.n_repair_generation * len(added) for params in self._island_params],
+                                 added)
+
+    def topology_changed(self, change):
+        # the kept members are encodings of single-hop solutions: a workflow that lost a link
+        # is unmapped in them, and placed again by the next re_solve()
+        if self._populations is None or not change.removed_links:
+            return
+
+        all_nodes = self.topology.all_nodes
+        for encodings in self._populations:
+            for encoding in encodings:
+                for wf in self.topology.workflows:
+                    indices = [task.index for task in wf.tasks]
+                    nodes = [all_nodes[i] if i >= 0 else None for i in encoding[indices].tolist()]
+                    if any(node1 and node2 and node2 not in node1.neighbors for node1, node2 in zip(nodes, nodes[1:])):
+                        encoding[indices] = -1
+                        self._unplaced.add(wf)
+
+    def _run_islands(self, rng, starts, n_generations, workflows=None):
+        # starts[i]: (function, *args) that sets up the population of island i.
+        # workflows: indices of the workflows to repair instead of evolving all of them
+        islands = [WorkerProcess(self.allocator, GeneticSolver(self.topology, self.allocator, self.evaluator, params))
+                   for params in self._island_params]
+        self.island_stats = [IslandStats(i, params.mutation_ratio, []) for i, params in enumerate(self._island_params)]
+
+        try:
+            for island, start in zip(islands, starts):
+                island.submit(*start)
+            for island in islands:
+                island.result()
+
+            immigrants = [[] for _ in islands]
+            done = [0] * len(islands)
+            while any(n < total for n, total in zip(done, n_generations)):
+                steps = [min(self.params.migration_interval, total - n) for n, total in zip(done, n_generations)]
+                for island, incoming, n_generation in zip(islands, immigrants, steps):
+                    island.submit(_island_epoch, incoming, n_generation, self.params.n_migrants, workflows)
+
+                emigrants = []
+                for i, island in enumerate(islands):
+                    outgoing, stats = island.result()
+                    done[i] += steps[i]
+                    self.island_stats[i].history.append((done[i],) + stats)
+                    emigrants.append(outgoing)
+
+                immigrants = [[] for _ in islands]
+                for i, outgoing in enumerate(emigrants):
+                    immigrants[self._destination(i, len(islands), rng)].extend(outgoing)
+
+                if DEBUG:
+                    print(max(done), "th generation:", [history[-1][1] for history in
+                                                          (stats.history for stats in self.island_stats)])
+
+            for island in islands:
+                island.submit(_island_best)
+            bests = [island.result() for island in islands]
+            for island in islands:
+                island.submit(_island_members)
+            self._populations = [island.result() for island in islands]
+        finally:
+            for island in islands:
+                island.close()
+
+        bests = [best for best in bests if best is not None]
+        if not bests:
+            return None
+
+        encoding, _ = min(bests, key=lambda best: best[1])
+        return self.allocator.solution_type.decode(self.topology, self.evaluator, encoding)
+
+    def _destination(self, i, n_island, rng):
+        if n_island == 1:
+            return i
+        if self.params.migration_topology == 'random':
+            return rng.choice([j for j in range(n_island) if j != i])
+        return (i + 1) % n_island
+
+
+def _island_start(context):
+    solver = context.solver
+    seed(solver.params.seed)
+    solver._init_population()
+
+
+def _island_resume(context, encodings, added):
+    # worker side of IslandSolver.re_solve(): the members of the previous run, with the
+    # workflows at indices 'added' placed into each of them (if not mapped there)
+    solver = context.solver
+    seed(solver.params.seed)
+    workflows = [context.topology.workflows[i] for i in added]
+    solver.population = Population()
+    for encoding in encodings:
+        member = context.decode(encoding)
+        solver.allocator.extend(member, [wf for wf in workflows if not member.is_allocated(wf)])
+        solver.population.add(member)
+
+
+def _island_epoch(context, immigrants, n_generation, n_migrants, workflows=None):
+    # worker side of IslandSolver.solve() and re_solve()
+    solver = context.solver
+    population = solver.population
+    accepted = 0
+    for encoding, key in immigrants:
+        if population and key < population.key(population.worst()):
+            immigrant = context.decode(encoding)
+            if population.holds(immigrant):
+                solver.n_duplicate += 1
+                continue
+            population.replace_worst(immigrant, key)
+            accepted += 1
+
+    if workflows is None:
+        solver._evolve(n_generation)
+    else:
+        solver._repair([context.topology.workflows[i] for i in workflows], n_generation)
+
+    ranked = population.ranked()
+    keys = [population.key(member) for member in ranked]
+    best_key = keys[0] if keys else None
+    mean_key = sum(key[1] for key in keys) / len(keys) if keys else None
+    mean_alloc_cnt = -sum(key[0] for key in keys) / len(keys) if keys else None
+    emigrants = [(member.encode(), population.key(member)) for member in ranked[:n_migrants]]
+    return emigrants, (best_key, mean_key, mean_alloc_cnt, accepted)
+
+
+def _island_best(context):
+    population = context.solver.population
+    best = population.best()
+    return (best.encode(), population.key(best)) if best else None
+
+
+def _island_members(context):
+    return [member.encode() for member in context.solver.population]
+
+
+def _breed(context, mother, father):
+    # worker side of GeneticSolver._evolve_in_batches()
+    solver = context.solver
+    child = solver._crossover(_parent(context, *mother), _parent(context, *father))
+    if not child:
+        return None
+
+    if random() < solver.params.mutation_ratio:
+        solver._mutate(child)
+    return child.encode(), Population.fitness(child)
+
+
+def _parent(context, fingerprint, encoding):
+    # parents are decoded once and kept while they are among the recently bred ones
+    # (_crossover() only reads them)
+    parents = getattr(context, 'parents', None)
+    if parents is None:
+        parents = context.parents = OrderedDict()
+
+    parent = parents.get(fingerprint)
+    if parent is None:
+        parent = parents[fingerprint] = context.decode(encoding)
+        if len(parents) > 2 * context.solver.params.population_size:
+            parents.popitem(last=False)
+    else:
+        parents.move_to_end(fingerprint)
+    return parent
@@ -1,13 +1,28 @@
 from evaluator import MultiHopEvaluator
+from solution import RelocateMove
 from solver import *
-from random import choice, random
+from random import choice, random, seed, Random
+from bisect import bisect_right
+from parallel import WorkerProcess
+import numpy as np
 import math
 
 
 class MarkovSolverParameters:
-    def __init__(self, n_iteration, beta):
+    def __init__(self, n_iteration, beta, n_repair_iteration=100):
         self.n_iteration = n_iteration
         self.beta = beta
+        self.n_repair_iteration = n_repair_iteration    # iterations of re_solve(), over the arriving workflows
+
+
+class ParallelTemperingParameters:
+    def __init__(self, n_iteration, betas, swap_interval=10, seed=None, n_repair_iteration=100):
+        self.n_iteration = n_iteration
+        self.betas = betas      # one chain per beta, neighbors in this order may swap
+        self.swap_interval = swap_interval  # iterations between swap proposals
+        self.seed = seed
+        self.n_repair_iteration = n_repair_iteration
+        self.beta = betas[-1]   # the chain of the main process (see MarkovSolver)
 
 
 # solving JOAR Problem
@@ -16,73 +31,267 @@ class MarkovSolver(Solver):
         super().__init__(topology, allocator, evaluator)
         self.params = params
         self.n_iter = 1
+        self.current_solution = None
+        self.stats = ChainStats(params.beta)
 
     def solve(self):
+        self.stats = ChainStats(self.params.beta)
         solutions = [self._solve() for _ in range(self.n_iter)]
         result = self.evaluator.get_best(solutions)
         self.print_summary([result])
+        self.current_solution = result
         return result
 
     def _solve(self):
         current_solution = self.allocator.allocate_workflows()
-        candidate_solutions = []
-        for iter_cnt in range(self.params.n_iteration):
-            for wf in self.topology.workflows:
-                tmp = wf.tasks[:] + [None]
-                for t1, t2, t3 in zip(tmp, tmp[1:], tmp[2:]):
-                    node1 = current_solution.task_to_node[t1]
-                    node2 = current_solution.task_to_node[t2]
-                    node3 = current_solution.task_to_node[t3] if t3 else None
-
-                    #candidate_node = node1.neighbors
-                    candidate_node = set(self.topology.all_nodes) - set(current_solution.wf_to_nodes[wf].keys())
-                    if node3: candidate_node = candidate_node & node3.neighbors
-                    candidate_node -= {node2}
-                    candidate_node = set(filter(
-                        lambda target_node: current_solution.mappable(node1, t2, target_node, multihop=True),
-                        candidate_node)
-                    )
-
-                    if candidate_node:
-                        target_node = choice(list(candidate_node))
-                        new_solution = current_solution.clone()
-                        new_solution.unmap(t2)
-                        new_solution.map(node1, t2, target_node, multihop=True)
-                        candidate_solutions.append(new_solution)
-
-            if candidate_solutions:
-                current_solution = self._select(current_solution, candidate_solutions)
+        self._run(current_solution, self.params.n_iteration)
+        return current_solution
+
+    # runs the chain on 'current_solution' in place, counting into self.stats.
+    # only the tasks of 'workflows' move (default: all)
+    def _run(self, current_solution, n_iteration, workflows=None):
+        for iter_cnt in range(n_iteration):
+            # a fresh neighborhood per iteration: move descriptors, not cloned solutions
+            moves = list(self._neighborhood(current_solution, workflows))
+
+            selected = self._select(current_solution, moves)
+            self.stats.n_iteration += 1
+            if selected:
+                selected.apply(current_solution)
+                self.stats.n_transition += 1
 
             if DEBUG_ALL_CASES or DEBUG and iter_cnt % 10 == 0:
-                if candidate_solutions:
+                if selected:
                     fairness_evaluator = MultiHopEvaluator(self.topology)
                     print(f'[DBG] MA#{iter_cnt}: {fairness_evaluator.evaluate(current_solution)}')
                 else:
                     print(f'[DBG] MA#{iter_cnt}: transition failed')
 
-        return current_solution
+    # one candidate move per task (but the first one) of every workflow:
+    # relocate the task to a random node that keeps the workflow connected
+    def _neighborhood(self, solution, workflows=None):
+        for wf in workflows if workflows is not None else self.topology.workflows:
+            if not solution.is_allocated(wf):
+                continue
 
-    # randomly select a solution among candidates according to transition_rates of them
+            tmp = wf.tasks[:] + [None]
+            for t1, t2, t3 in zip(tmp, tmp[1:], tmp[2:]):
+                node1 = solution.task_to_node[t1]
+                node2 = solution.task_to_node[t2]
+                node3 = solution.task_to_node[t3] if t3 else None
+
+                # node2 and the other nodes of wf are excluded as visited
+                candidate_node = solution.candidate_mask(node1, t2, multihop=True)
+                if node3: candidate_node &= self.topology.adjacency_bits[node3.index]
+
+                if candidate_node:
+                    yield RelocateMove(t2, choice(self.topology.nodes_of(candidate_node)), multihop=True)
+
+    # randomly select a move among candidates according to transition_rates of them
     def _select(self, base, candidates):
+        # infeasible moves are dropped
+        costs = [self._peek_cost(base, move) for move in candidates]
+        candidates = [move for move, cost in zip(candidates, costs) if cost is not None]
         if not candidates:
             return None
 
-        transition_rate = [self._get_transition_rate(base, solution) for solution in candidates]
-        threshold = random() * sum(transition_rate)
-        rate_sum = 0
-        for i in range(len(candidates)):
-            rate_sum += transition_rate[i]
-            if threshold < rate_sum:
-                return candidates[i]
+        base_cost = base.evaluate().total_cost
+        costs = np.array([cost for cost in costs if cost is not None])
+        log_rate = self._log_transition_rate(base_cost, costs)
 
-        return candidates[-1]
+        # Metropolis acceptance of the candidates, min(1, exp(-beta * dE)) = min(1, rate^2):
+        # how freely the chain moves at its beta (a move is always made, see ChainStats)
+        self.stats.acceptance_sum += float(np.exp(np.minimum(2 * log_rate, 0.0)).mean())
+
+        # rates relative to the largest one (log-sum-exp): exp() cannot overflow at any beta,
+        # and the selection probabilities (rate / sum of rates) are the same
+        rate = np.exp(log_rate - log_rate.max())
+        cumulative = np.cumsum(rate).tolist()
+        threshold = random() * cumulative[-1]
+        k = min(bisect_right(cumulative, threshold), len(candidates) - 1)
+        if costs[k] < base_cost and not math.isclose(costs[k], base_cost):
+            self.stats.n_uphill += 1
+        return candidates[k]
+
+    @staticmethod
+    def _peek_cost(solution, move):
+        # total_cost of 'solution' after 'move', which is reverted right away
+        if not move.apply(solution):
+            return None
 
-    def _get_transition_rate(self, base, target):
+        cost = solution.evaluate().total_cost
+        move.revert(solution)
+        return cost
+
+    def _kept_solutions(self):
+        return [self.current_solution] if self.current_solution is not None else []
+
+    def _log_transition_rate(self, total_cost_base, total_cost_targets):
         # energy fairness: the higher, the better. so change it to 'cost'
-        cost_base = 1 - base.evaluate().total_cost
-        cost_target = 1 - target.evaluate().total_cost
-        param = (-0.5) * self.params.beta * (cost_target - cost_base)
-        return math.exp(param)
+        cost_base = 1 - total_cost_base
+        cost_target = 1 - total_cost_targets
+        return (-0.5) * self.params.beta * (cost_target - cost_base)
+
+    def re_solve(self, added_workflows=(), removed_workflows=()):
+        # the current solution keeps its allocation; arriving workflows are placed into the
+        # remaining capacity, and the chain runs a few iterations moving only their tasks
+        if self.current_solution is None:
+            self.topology.change_workload(added_workflows, removed_workflows)
+            return self.solve()
+
+        self._change_workload([self.current_solution], added_workflows, removed_workflows)
+        self.allocator.extend(self.current_solution, added_workflows)
+        self._run(self.current_solution, self.params.n_repair_iteration, added_workflows)
+        return self.current_solution
+
+
+# counters of a chain. a chain moves at every iteration that has a feasible candidate,
+# so how it explores shows in
+#   acceptance_rate : mean Metropolis acceptance of the candidates at its beta
+#   uphill_rate     : share of the transitions to a higher energy (lower total_cost)
+class ChainStats:
+    def __init__(self, beta):
+        self.beta = beta
+        self.n_iteration = 0
+        self.n_transition = 0
+        self.n_uphill = 0
+        self.acceptance_sum = 0.0
+        self.n_swap_proposed = 0
+        self.n_swap_accepted = 0
+
+    def add(self, other):
+        # the counters of a run of the chain (swaps are counted by the tempering solver)
+        self.n_iteration += other.n_iteration
+        self.n_transition += other.n_transition
+        self.n_uphill += other.n_uphill
+        self.acceptance_sum += other.acceptance_sum
+
+    @property
+    def acceptance_rate(self):
+        return self.acceptance_sum / self.n_iteration if self.n_iteration else 0.0
+
+    @property
+    def uphill_rate(self):
+        return self.n_uphill / self.n_transition if self.n_transition else 0.0
+
+    @property
+    def swap_acceptance_rate(self):
+        return self.n_swap_accepted / self.n_swap_proposed if self.n_swap_proposed else 0.0
+
+    def __repr__(self):
+        return 'beta {}: acceptance {:.3f}, uphill {:.3f}, swaps accepted {:.3f} ({}/{})'.format(
+            self.beta, self.acceptance_rate, self.uphill_rate,
+            self.swap_acceptance_rate, self.n_swap_accepted, self.n_swap_proposed)
+
+
+# parallel tempering: one Markov chain per beta, each in its own process.
+# every 'swap_interval' iterations, chains at neighboring betas (even or odd pairs, alternately)
+# propose to exchange their states. instead of moving solutions between processes,
+# the processes exchange their betas.
+class ParallelTemperingSolver(MarkovSolver):
+    def __init__(self, topology, allocator, evaluator, params):
+        super().__init__(topology, allocator, evaluator, params)
+        self.chain_stats = []
+
+    def solve(self):
+        return self._temper(self.params.n_iteration)
+
+    def re_solve(self, added_workflows=(), removed_workflows=()):
+        # every chain starts from the current solution, which keeps its allocation: arriving workflows
+        # are placed into the remaining capacity, and the chains move only their tasks
+        # for n_repair_iteration iterations
+        if self.current_solution is None:
+            self.topology.change_workload(added_workflows, removed_workflows)
+            return self.solve()
+
+        self._change_workload([self.current_solution], added_workflows, removed_workflows)
+        self.allocator.extend(self.current_solution, added_workflows)
+        if not added_workflows:
+            return self.current_solution
+
+        return self._temper(self.params.n_repair_iteration, self.current_solution.encode(),
+                            [wf.index for wf in added_workflows])
+
+    def _temper(self, n_iteration, start=None, workflows=None):
+        # start: encoding every chain starts from (default: its own allocate_workflows()).
+        # workflows: indices of the only workflows whose tasks move
+        rng = Random(self.params.seed)
+        betas = self.params.betas
+        chains = [WorkerProcess(self.allocator, MarkovSolver(self.topology, self.allocator, self.evaluator,
+                                                             MarkovSolverParameters(n_iteration, beta)))
+                  for beta in betas]
+        at_beta = list(range(len(betas)))  # at_beta[k]: the chain currently running at betas[k]
+        self.chain_stats = [ChainStats(beta) for beta in betas]
+
+        try:
+            for chain in chains:
+                chain.submit(_chain_start, rng.getrandbits(64), start)
+            for chain in chains:
+                chain.result()
+
+            n_done, parity = 0, 0
+            while n_done < n_iteration:
+                n_step = min(self.params.swap_interval, n_iteration - n_done)
+                for k, beta in enumerate(betas):
+                    chains[at_beta[k]].submit(_chain_run, beta, n_step, workflows)
+
+                costs = []
+                for k, stats in enumerate(self.chain_stats):
+                    cost, run_stats = chains[at_beta[k]].result()
+                    costs.append(cost)
+                    stats.add(run_stats)
+                n_done += n_step
+
+                for k in range(parity, len(betas) - 1, 2):
+                    self.chain_stats[k].n_swap_proposed += 1
+                    self.chain_stats[k + 1].n_swap_proposed += 1
+                    if self._accept_swap(betas[k], betas[k + 1], costs[k], costs[k + 1], rng):
+                        at_beta[k], at_beta[k + 1] = at_beta[k + 1], at_beta[k]
+                        self.chain_stats[k].n_swap_accepted += 1
+                        self.chain_stats[k + 1].n_swap_accepted += 1
+                parity ^= 1
+
+            for chain in chains:
+                chain.submit(_chain_state)
+            solutions = [self.allocator.solution_type.decode(self.topology, self.evaluator, chain.result(), multihop=True)
+                         for chain in chains]
+        finally:
+            for chain in chains:
+                chain.close()
+
+        if DEBUG:
+            for stats in self.chain_stats:
+                print(f'[DBG] PT chain {stats}')
+
+        result = self.evaluator.get_best(solutions)
+        self.print_summary([result])
+        self.current_solution = result
+        return result
+
+    @staticmethod
+    def _accept_swap(beta1, beta2, total_cost1, total_cost2, rng):
+        # the chains sample exp(-beta * (1 - total_cost)), see MarkovSolver._log_transition_rate()
+        log_ratio = (beta1 - beta2) * ((1 - total_cost1) - (1 - total_cost2))
+        return log_ratio >= 0 or rng.random() < math.exp(log_ratio)
+
+
+def _chain_start(context, chain_seed, start=None):
+    seed(chain_seed)
+    if start is None:
+        context.state = context.allocator.allocate_workflows()
+    else:
+        context.state = context.decode(start, multihop=True)
+
+
+def _chain_run(context, beta, n_iteration, workflows=None):
+    # worker side of ParallelTemperingSolver._temper()
+    context.solver.params.beta = beta
+    context.solver.stats = ChainStats(beta)
+    if workflows is not None:
+        workflows = [context.topology.workflows[i] for i in workflows]
+    context.solver._run(context.state, n_iteration, workflows)
+    return context.state.evaluate().total_cost, context.solver.stats
+
 
-    def re_solve(self):
-        pass
+def _chain_state(context):
+    return context.state.encode()
@@ -0,0 +1,31 @@
+import os
+import sys
+import random
+import importlib
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import parameters
+
+MODULES = ['parameters', 'routing', 'topology', 'solution', 'evaluator', 'allocator',
+           'solver', 'solver_ga', 'solver_ma', 'parallel', 'topology_io']
+
+
+def use_parameters(params):
+    # the modules star-import parameters, so each holds its own DEBUG / global_params
+    for name in MODULES:
+        module = importlib.import_module(name)
+        module.DEBUG = False
+        if hasattr(module, 'global_params'):
+            module.global_params = params
+
+
+@pytest.fixture(autouse=True)
+def small_world():
+    saved = parameters.global_params
+    random.seed(0)
+    use_parameters(parameters.vanilla_test_parameters)
+    yield
+    use_parameters(saved)
@@ -0,0 +1,277 @@
+import random
+from dataclasses import replace
+from functools import lru_cache
+from itertools import product
+from timeit import repeat
+
+import pytest
+
+import parameters
+from conftest import use_parameters
+from topology import StaticTopology
+from solution import Solution
+from evaluator import SingleHopEvaluator, MultiHopMarkovEvaluator
+from allocator import Allocator, OptimalAllocator, GreedyAllocator, RandomAllocator
+
+
+def small_topology(params=parameters.super_vanilla_test_parameters):
+    random.seed(0)
+    use_parameters(params)
+    return StaticTopology()
+
+
+def evaluator_of(topology, metric):
+    if metric == 'cost':
+        return MultiHopMarkovEvaluator(topology)
+    return SingleHopEvaluator(topology, metric=metric)
+
+
+@lru_cache(maxsize=None)
+def enumerated_optimum(metric):
+    # every combination of placements in small_topology()
+    topology = small_topology()
+    return OptimalAllocator(topology, evaluator_of(topology, metric), branch_and_bound=False) \
+        .allocate_workflows().evaluate().key
+
+
+@pytest.mark.parametrize('metric', ['energy', 'distance', 'cost'])
+def test_branch_and_bound_optimum(metric):
+    topology = small_topology()
+    allocator = OptimalAllocator(topology, evaluator_of(topology, metric))
+    solution = allocator.allocate_workflows()
+    assert solution.workflow_alloc_cnt == len(topology.workflows)
+    assert solution.evaluate().key == pytest.approx(enumerated_optimum(metric), rel=1e-9)
+    assert allocator.n_pruned > 0
+
+
+@pytest.mark.parametrize('metric', ['energy', 'distance', 'cost', 'fairness'])
+@pytest.mark.parametrize('seed', range(1, 4))
+def test_branch_and_bound_matches_enumeration(metric, seed):
+    # random topologies and workflows, small enough to enumerate every combination of placements
+    use_parameters(replace(parameters.super_vanilla_test_parameters, MinTasksPerWorkFlow=2, MaxTasksPerWorkflow=3))
+    random.seed(seed)
+    topology = StaticTopology()
+    keys = []
+    for branch_and_bound in (False, True):
+        allocator = OptimalAllocator(topology, evaluator_of(topology, metric), branch_and_bound=branch_and_bound)
+        keys.append(allocator.allocate_workflows().evaluate().key)
+    assert keys[1] == pytest.approx(keys[0], rel=1e-9, abs=1e-12)
+
+
+def test_fairness_bound_prunes():
+    # once an incumbent is as fair as the remaining workflows can make it, their branches are cut
+    topology = small_topology(replace(parameters.super_vanilla_test_parameters, NumOfWorkflows=3,
+                                      MinTasksPerWorkFlow=2, MaxTasksPerWorkflow=2))
+    evaluator = SingleHopEvaluator(topology, metric='fairness')
+    enumerated = OptimalAllocator(topology, evaluator, branch_and_bound=False)
+    expected = enumerated.allocate_workflows().evaluate().key
+    allocator = OptimalAllocator(topology, evaluator)
+    assert allocator.allocate_workflows().evaluate().key == pytest.approx(expected, rel=1e-9, abs=1e-12)
+    assert allocator.n_pruned > 0
+    assert allocator.n_case < enumerated.n_case
+
+
+def test_partial_solutions():
+    # the packed placements of every workflow are exactly its feasible placements in the empty topology
+    topology = small_topology()
+    evaluator = SingleHopEvaluator(topology, metric='energy')
+    allocator = OptimalAllocator(topology, evaluator)
+    allocator.allocate_workflows()
+
+    for wf in topology.workflows:
+        partial_solutions = allocator.partial_solutions[wf]
+        expected = {}
+        for nodes in product(topology.all_nodes, repeat=wf.n_task):
+            solution = Solution(topology, evaluator)
+            if all(solution.map(prev_node, task, node) for prev_node, task, node in zip((None,) + nodes, wf.tasks, nodes)):
+                expected[tuple(node.index for node in nodes)] = solution.evaluate().key
+
+        rows = [tuple(row) for row in partial_solutions.nodes.tolist()]
+        assert len(rows) == len(partial_solutions) == len(expected)
+        assert {row: key for row, key in zip(rows, partial_solutions.keys.tolist())} == pytest.approx(expected, rel=1e-9)
+        assert (partial_solutions.demand == topology.demand_matrix[[task.index for task in wf.tasks]]).all()
+
+
+@pytest.mark.parametrize('metric, n_workflow', [('cost', 2), ('cost', 3)])
+def test_symmetry_breaking_optimum(metric, n_workflow):
+    # identical workflows (and, for cost, interchangeable nodes): the same optimum from fewer cases.
+    # (with the other metrics, the bound cuts the symmetric branches of these workflows just as well)
+    params = replace(parameters.super_vanilla_test_parameters, NumOfWorkflows=n_workflow,
+                     MinTasksPerWorkFlow=3, MaxTasksPerWorkflow=3,
+                     MinRequiredProcessingPower=25, MaxRequiredProcessingPower=25,
+                     MinRequiredBandwidth=25, MaxRequiredBandwidth=25)
+    keys, cases = [], []
+    for symmetry_breaking in (False, True):
+        topology = small_topology(params)
+        allocator = OptimalAllocator(topology, evaluator_of(topology, metric), symmetry_breaking=symmetry_breaking)
+        keys.append(allocator.allocate_workflows().evaluate().key)
+        cases.append(allocator.n_explored)
+
+    assert keys[1] == pytest.approx(keys[0], rel=1e-9)
+    assert cases[1] < cases[0]
+
+
+# random workflows of 2 or 3 tasks; with equal demands, the ones of equal length are identical
+symmetry_presets = {
+    'random': replace(parameters.super_vanilla_test_parameters, MinTasksPerWorkFlow=2, MaxTasksPerWorkflow=3),
+    'identical': replace(parameters.super_vanilla_test_parameters, NumOfWorkflows=3,
+                         MinTasksPerWorkFlow=2, MaxTasksPerWorkflow=3,
+                         MinRequiredProcessingPower=25, MaxRequiredProcessingPower=25,
+                         MinRequiredBandwidth=25, MaxRequiredBandwidth=25),
+}
+
+
+@pytest.mark.parametrize('metric', ['energy', 'distance', 'cost', 'fairness'])
+@pytest.mark.parametrize('preset', symmetry_presets)
+@pytest.mark.parametrize('seed', range(1, 4))
+def test_symmetry_breaking_keeps_optimum(metric, preset, seed):
+    use_parameters(symmetry_presets[preset])
+    random.seed(seed)
+    topology = StaticTopology()
+    keys, cases = [], []
+    for symmetry_breaking in (False, True):
+        allocator = OptimalAllocator(topology, evaluator_of(topology, metric), symmetry_breaking=symmetry_breaking)
+        keys.append(allocator.allocate_workflows().evaluate().key)
+        cases.append(allocator.n_explored)
+
+    assert keys[1] == pytest.approx(keys[0], rel=1e-9, abs=1e-12)
+    assert cases[1] <= cases[0]
+
+
+# more workflows than the small topology has room for, of mixed sizes: the depth-first allocators fail some
+crowded_parameters = replace(parameters.super_vanilla_test_parameters, NumOfWorkflows=12,
+                             MinTasksPerWorkFlow=2, MaxTasksPerWorkflow=4)
+
+
+def fits(solution, wf):
+    # whether wf (not placed) can be placed in what is left in 'solution', by trying every chain of nodes
+    def place(prev_node, i):
+        if i == wf.n_task:
+            return True
+        for node in solution.topology.all_nodes:
+            if solution.map(prev_node, wf.tasks[i], node):
+                found = place(node, i + 1)
+                solution.unmap(wf.tasks[i])
+                if found:
+                    return True
+        return False
+    return place(None, 0)
+
+
+@pytest.mark.parametrize('allocator_type', [GreedyAllocator, RandomAllocator])
+@pytest.mark.parametrize('seed', range(3))
+def test_depth_first_placements(allocator_type, seed):
+    # every workflow is placed whole or not at all, on chains of linked nodes that had room for each task
+    topology = small_topology(crowded_parameters)
+    random.seed(seed)
+    solution = allocator_type(topology, SingleHopEvaluator(topology, metric='energy')).allocate_workflows()
+
+    replay = Solution(topology, solution.evaluator)
+    placed = [wf for wf in topology.workflows if all(solution.is_mapped(task) for task in wf.tasks)]
+    assert 0 < len(placed) == solution.workflow_alloc_cnt < len(topology.workflows)
+    assert len(solution.task_to_node) == sum(wf.n_task for wf in placed)
+    for wf in placed:
+        prev_node = None
+        for task in wf.tasks:
+            node = solution.task_to_node[task]
+            assert replay.mappable(prev_node, task, node)
+            assert replay.map(prev_node, task, node)
+            prev_node = node
+
+    for node in topology.all_nodes:
+        used = [task.required_resources for task in solution.node_to_tasks[node]]
+        for name, capacity in node.resources.items():
+            available = solution.available_resources[node][name]
+            assert available >= 0
+            assert available == pytest.approx(capacity - sum(demand[name] for demand in used))
+
+
+# nearly equal demands: a workflow often needs at least as much as one of the same size that failed
+lookalike_parameters = replace(crowded_parameters, NumOfWorkflows=16, MaxTasksPerWorkflow=3,
+                               MinRequiredProcessingPower=60, MaxRequiredProcessingPower=64,
+                               MinRequiredBandwidth=25, MaxRequiredBandwidth=26)
+
+
+@pytest.mark.parametrize('allocator_type', [GreedyAllocator, RandomAllocator])
+@pytest.mark.parametrize('seed', range(3))
+def test_depth_first_skips_only_what_cannot_fit(allocator_type, seed, monkeypatch):
+    # extend() skips a workflow that needs at least as much as one that failed: none of the workflows
+    # left out, skipped or not, fits into what is left
+    topology = small_topology(lookalike_parameters)
+    random.seed(seed)
+    allocator = allocator_type(topology, SingleHopEvaluator(topology, metric='energy'))
+    tried = []
+    alloc_wf_tasks = allocator._alloc_wf_tasks
+    monkeypatch.setattr(allocator, '_alloc_wf_tasks', lambda wf: tried.append(wf) or alloc_wf_tasks(wf))
+    solution = allocator.allocate_workflows()
+
+    assert len(tried) < len(topology.workflows)
+    left_out = [wf for wf in topology.workflows if not solution.is_mapped(wf.tasks[0])]
+    assert set(topology.workflows) - set(tried) < set(left_out)
+    for wf in left_out:
+        assert not fits(solution, wf)
+
+
+class RecursiveAllocator(Allocator):
+    # the allocators before the depth-first search: every start node in turn, and the neighbors
+    # that take the next task, recursively (in index order, or shuffled)
+    def __init__(self, topology, evaluator, shuffled):
+        super().__init__(topology, evaluator)
+        self.shuffled = shuffled
+        self.neighbors = {node: sorted(node.neighbors, key=lambda neighbor: neighbor.index)
+                          for node in topology.all_nodes}
+
+    def allocate_workflows(self):
+        return self.extend(Solution(self.topology, self.evaluator), self.topology.workflows)
+
+    def extend(self, solution, workflows):
+        self.temp_solution = solution
+        for wf in workflows:
+            for start_node in self._ordered(self.topology.all_nodes):
+                if self._alloc_wf_tasks(wf.tasks[:], None, start_node):
+                    break
+        return solution
+
+    def _ordered(self, nodes):
+        if self.shuffled:
+            nodes = nodes[:]
+            random.shuffle(nodes)
+        return nodes
+
+    def _alloc_wf_tasks(self, tasks, prev_node, cur_node):
+        if not self.temp_solution.map(prev_node, tasks[0], cur_node):
+            return False
+        if len(tasks) == 1:
+            return True
+        for next_node in self._ordered(self.neighbors[cur_node]):
+            if self.temp_solution.mappable(cur_node, tasks[1], next_node) and \
+                    self._alloc_wf_tasks(tasks[1:], cur_node, next_node):
+                return True
+        self.temp_solution.unmap(tasks[0])
+        return False
+
+
+@pytest.mark.parametrize('allocator_type, shuffled', [(GreedyAllocator, False), (RandomAllocator, True)])
+def test_depth_first_costs_no_more_than_recursion(allocator_type, shuffled):
+    # default preset: the workflows fit, the walk places them all and nothing is set up for the search.
+    # best of several runs each, on a few topologies: no slower than the recursive allocators
+    use_parameters(parameters.GlobalParameters())
+    times, reference_times = [], []
+    for seed in range(3):
+        random.seed(seed)
+        topology = StaticTopology()
+        evaluator = SingleHopEvaluator(topology)
+        allocator = allocator_type(topology, evaluator)
+        reference = RecursiveAllocator(topology, evaluator, shuffled)
+
+        solution = allocator.allocate_workflows()
+        assert solution.workflow_alloc_cnt == reference.allocate_workflows().workflow_alloc_cnt \
+            == len(topology.workflows)
+        assert solution._host_levels is None
+        assert getattr(allocator, '_tier', None) is None
+
+        times.append(min(repeat(allocator.allocate_workflows, number=5, repeat=15)))
+        reference_times.append(min(repeat(reference.allocate_workflows, number=5, repeat=15)))
+
+    # a margin for the noise of the timer
+    assert sum(times) <= 1.2 * sum(reference_times)
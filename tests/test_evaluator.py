@@ -0,0 +1,114 @@
+import random
+
+import pytest
+
+from topology import StaticTopology, WorkFlow
+from solution import Solution, ArraySolution, RelocateMove, SwapMove
+from evaluator import SingleHopEvaluator, MultiHopEvaluator, MultiHopMarkovEvaluator
+from allocator import RandomAllocator
+
+EVALUATORS = [SingleHopEvaluator, MultiHopEvaluator, MultiHopMarkovEvaluator]
+
+
+def random_moves(topology, solution, multihop, n_move=1000):
+    # applies (and sometimes reverts) random moves, yielding after each of them
+    tasks = [task for task in topology.all_tasks if solution.is_mapped(task)]
+    for _ in range(n_move):
+        if random.random() < 0.6:
+            task = random.choice([task for task in tasks if task is not task.workflow.tasks[0]])
+            move = RelocateMove(task, random.choice(topology.all_nodes), multihop)
+        else:
+            move = SwapMove(random.choice(tasks), random.choice(tasks), multihop)
+        if move.apply(solution) and random.random() < 0.3:
+            move.revert(solution)
+        yield
+
+
+@pytest.mark.parametrize('solution_type', [Solution, ArraySolution])
+@pytest.mark.parametrize('evaluator_type', EVALUATORS)
+def test_incremental_matches_full(solution_type, evaluator_type):
+    topology = StaticTopology()
+    evaluator = evaluator_type(topology)
+    evaluator.cache_evaluations = False
+    solution = RandomAllocator(topology, evaluator, solution_type).allocate_workflows()
+    for _ in random_moves(topology, solution, evaluator_type is not SingleHopEvaluator):
+        assert solution.evaluate().key == pytest.approx(evaluator.evaluate_full(solution).key, rel=1e-9)
+
+
+@pytest.mark.parametrize('solution_type', [Solution, ArraySolution])
+def test_cached_matches_full(solution_type):
+    # after nodes move, a route is kept unless it lost a link: the same mapping decoded
+    # again may take other routes, so it must not get the cached evaluation of the first one
+    topology = StaticTopology()
+    evaluator = MultiHopEvaluator(topology)
+    solution = RandomAllocator(topology, evaluator, solution_type).allocate_workflows()
+    for _ in random_moves(topology, solution, multihop=True, n_move=200):
+        pass
+
+    for _ in range(20):
+        change = topology.step({node: (node.pos_x + random.uniform(-8, 8), node.pos_y + random.uniform(-8, 8))
+                                for node in random.sample(topology.drones, 3)})
+        for wf in solution.topology_changed(change):
+            for task in reversed(wf.tasks):
+                solution.unmap(task)
+        solution.evaluate()
+
+        decoded = solution_type.decode(topology, evaluator, solution.encode(), multihop=True)
+        assert decoded.fingerprint == solution.fingerprint
+        assert decoded.evaluate().key == pytest.approx(evaluator.evaluate_full(decoded).key, rel=1e-9)
+        assert solution.evaluate().key == pytest.approx(evaluator.evaluate_full(solution).key, rel=1e-9)
+
+
+@pytest.mark.parametrize('evaluator_type, metric', [(SingleHopEvaluator, 'fairness'), (SingleHopEvaluator, 'energy'),
+                                                    (SingleHopEvaluator, 'distance'), (MultiHopMarkovEvaluator, 'cost')])
+@pytest.mark.parametrize('seed', range(5))
+def test_batch_matches_scalar(evaluator_type, metric, seed):
+    random.seed(seed)
+    topology = StaticTopology()
+    evaluator = evaluator_type(topology, metric=metric)
+    allocator = RandomAllocator(topology, evaluator, ArraySolution)
+    solutions = [allocator.allocate_workflows() for _ in range(8)]
+    for solution in solutions[::2]:
+        # some workflows not placed, or placed in part
+        wf = random.choice(topology.workflows)
+        solution.unmap(wf.tasks[-1])
+
+    def assert_matches():
+        batch = evaluator.batch.evaluate_solutions(solutions)
+        for i, solution in enumerate(solutions):
+            assert batch.alloc_cnt[i] == solution.workflow_alloc_cnt
+            if not solution.workflow_alloc_cnt:
+                continue
+            expected = evaluator.evaluate_full(solution)
+            for name in ('fairness_index', 'total_energy_consumption', 'total_distance', 'total_cost'):
+                assert getattr(batch[i], name) == pytest.approx(getattr(expected, name), rel=1e-9, abs=1e-9)
+
+    assert_matches()
+    # the pairs the batch knows of follow the nodes that move
+    for _ in range(5):
+        change = topology.step({node: (node.pos_x + random.uniform(-8, 8), node.pos_y + random.uniform(-8, 8))
+                                for node in random.sample(topology.drones, 3)})
+        for solution in solutions:
+            for wf in solution.topology_changed(change):
+                for task in reversed(wf.tasks):
+                    solution.unmap(task)
+        assert_matches()
+
+
+def test_energy_table_matches_calc_energy():
+    topology = StaticTopology()
+    tasks = topology.all_tasks
+    for _ in range(2):
+        for (node1, node2), dist in topology.distance.items():
+            for task in tasks:
+                expected = SingleHopEvaluator.calc_energy(task, dist)
+                assert topology.link_energy(task, node1, node2) == expected
+                assert topology.energy_matrix[task.bw_class, topology.link_id(node1, node2)] == expected
+        # node pairs without a link cost what get_distance() gives for them
+        task, node = tasks[0], topology.drones[0]
+        assert topology.link_energy(task, node, node) == \
+            SingleHopEvaluator.calc_energy(task, topology.get_distance(node, node))
+
+        # arriving workflows may bring new bandwidths: the table is built again
+        topology.change_workload([WorkFlow() for _ in range(3)], topology.workflows[:2])
+        tasks = topology.all_tasks
@@ -0,0 +1,64 @@
+import pickle
+
+import pytest
+
+from topology import StaticTopology
+from solution import ArraySolution
+from evaluator import SingleHopEvaluator
+from allocator import RandomAllocator
+from parallel import WorkerContext, WorkerProcess, allocate_in_parallel, _setup
+
+
+def test_worker_context_keeps_evaluator_settings():
+    topology = StaticTopology()
+    evaluator = SingleHopEvaluator(topology, metric='energy', incremental=False)
+    evaluator.cache_evaluations = False
+    evaluator.batch_threshold = 4
+    allocator = RandomAllocator(topology, evaluator, ArraySolution)
+    allocator.allocate_workflows().evaluate()
+
+    # as a worker started by spawn would get it
+    context = WorkerContext(*pickle.loads(pickle.dumps(_setup(allocator))))
+    assert type(context.evaluator) is SingleHopEvaluator
+    assert context.evaluator.topology is context.topology is context.allocator.topology
+    assert (context.evaluator.metric, context.evaluator.incremental) == ('energy', False)
+    assert (context.evaluator.cache_evaluations, context.evaluator.batch_threshold) == (False, 4)
+    assert context.allocator.solution_type is ArraySolution
+
+
+def _evaluator_settings(context):
+    evaluator = context.evaluator
+    return evaluator.metric, evaluator.incremental, evaluator.cache_evaluations
+
+
+def test_worker_process_keeps_evaluator_settings():
+    topology = StaticTopology()
+    evaluator = SingleHopEvaluator(topology, metric='distance', incremental=False)
+    evaluator.cache_evaluations = False
+    worker = WorkerProcess(RandomAllocator(topology, evaluator))
+    try:
+        worker.submit(_evaluator_settings)
+        assert worker.result() == ('distance', False, False)
+    finally:
+        worker.close()
+
+
+def test_parallel_allocation_is_reproducible():
+    topology = StaticTopology()
+    evaluator = SingleHopEvaluator(topology, metric='energy')
+    allocator = RandomAllocator(topology, evaluator, ArraySolution)
+    encodings, keys, stats = allocate_in_parallel(allocator, 12, 3, seed=7, statistics=True)
+    again, again_keys, _ = allocate_in_parallel(allocator, 12, 3, seed=7)
+    assert (encodings == again).all() and keys == again_keys
+    assert stats.n == len(encodings) == 12
+
+    # every encoding is a feasible mapping (decode() raises otherwise), evaluated as in the master
+    for encoding, key in zip(encodings, keys):
+        solution = ArraySolution.decode(topology, evaluator, encoding)
+        assert (solution.encode() == encoding).all()
+        assert key[0] == -solution.workflow_alloc_cnt
+        assert key[1] == pytest.approx(evaluator.evaluate_full(solution).key, rel=1e-9)
+
+    best, best_keys, _ = allocate_in_parallel(allocator, 12, 3, seed=7, top_k=4)
+    assert best_keys == sorted(keys)[:4]
+    assert all(any((row == encoding).all() for encoding in encodings) for row in best)
@@ -0,0 +1,34 @@
+import random
+
+import parameters
+from conftest import use_parameters
+from topology import StaticTopology
+from routing import Router, bfs
+
+
+def test_routes_match_bfs_with_few_rows():
+    use_parameters(parameters.GlobalParameters())
+    random.seed(0)
+    topology = StaticTopology()
+    router = Router(topology, max_paths=16, max_pred_rows=4)
+    adjacency = topology._adjacency_lists()
+    rows = {}
+
+    # sources in random order, each asked more than once: rows are evicted and computed again
+    for _ in range(3):
+        for src_node in random.sample(topology.all_nodes, len(topology.all_nodes)):
+            dst_node = random.choice(topology.all_nodes)
+            if src_node.index not in rows:
+                rows[src_node.index] = bfs(adjacency, src_node.index)
+            hop_row, pred_row = rows[src_node.index]
+
+            path = router.path(src_node, dst_node)
+            assert len(router._pred_rows) <= 4 and len(router.paths) <= 16
+            if src_node is not dst_node and hop_row[dst_node.index] < 0:
+                assert path is None
+                continue
+
+            assert path[0] is src_node and path[-1] is dst_node
+            assert len(path) - 1 == hop_row[dst_node.index]
+            for node, next_node in zip(path, path[1:]):
+                assert pred_row[next_node.index] == node.index
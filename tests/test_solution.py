@@ -0,0 +1,114 @@
+import random
+
+import pytest
+
+from topology import StaticTopology
+from solution import Solution, ArraySolution, RelocateMove
+from evaluator import SingleHopEvaluator, MultiHopEvaluator
+from allocator import RandomAllocator
+
+
+def allocated(solution_type, evaluator_type=SingleHopEvaluator):
+    topology = StaticTopology()
+    solution = RandomAllocator(topology, evaluator_type(topology), solution_type).allocate_workflows()
+    return topology, solution
+
+
+def in_task_order(solution, wf):
+    return list(solution.wf_to_nodes[wf]) == [solution.task_to_node[t] for t in wf.tasks
+                                              if solution.is_mapped(t)]
+
+
+@pytest.mark.parametrize('solution_type', [Solution, ArraySolution])
+def test_nested_checkpoints(solution_type):
+    topology, solution = allocated(solution_type)
+    task = next(t for t in topology.all_tasks if solution.is_mapped(t))
+    before = solution.encode()
+
+    mark = solution.checkpoint()
+    RelocateMove(task, solution.task_to_node[task]).apply(solution)
+    solution.unmap(task)
+    solution.undo(solution.detach(mark))
+
+    assert (solution.encode() == before).all()
+    assert solution._undo_log is None
+
+
+@pytest.mark.parametrize('solution_type', [Solution, ArraySolution])
+def test_relocate_checks_both_links(solution_type):
+    topology, solution = allocated(solution_type)
+    for wf in topology.workflows:
+        if not solution.is_allocated(wf):
+            continue
+        for task in wf.tasks[:-1]:
+            prev_node, next_node = solution.adjacent_nodes(task)
+            for node in topology.all_nodes:
+                before = solution.encode()
+                move = RelocateMove(task, node)
+                if move.apply(solution):
+                    assert next_node in node.neighbors
+                    assert prev_node is None or node in prev_node.neighbors
+                    assert in_task_order(solution, wf)
+                    move.revert(solution)
+                assert (solution.encode() == before).all()
+                assert in_task_order(solution, wf)
+
+
+@pytest.mark.parametrize('solution_type', [Solution, ArraySolution])
+def test_multihop_relocate_routes_successor(solution_type):
+    topology, solution = allocated(solution_type, MultiHopEvaluator)
+    wf = next(wf for wf in topology.workflows if solution.is_allocated(wf))
+    task = wf.tasks[1]
+    next_node = solution.task_to_node[wf.tasks[2]]
+    for node in topology.all_nodes:
+        move = RelocateMove(task, node, multihop=True)
+        if move.apply(solution):
+            assert solution.routing_paths[(node, next_node)][-1] is next_node
+            assert in_task_order(solution, wf)
+            move.revert(solution)
+
+
+@pytest.mark.parametrize('solution_type', [Solution, ArraySolution])
+def test_revert_restores_evaluation_state(solution_type):
+    topology, solution = allocated(solution_type, MultiHopEvaluator)
+    wf = next(wf for wf in topology.workflows if solution.is_allocated(wf))
+    # routes the links of the task first, so the reverted moves change routes before anything else
+    assert any(RelocateMove(wf.tasks[1], node, multihop=True).apply(solution) for node in topology.all_nodes)
+    for node in topology.all_nodes:
+        solution.evaluate()
+        value = solution.value
+        move = RelocateMove(wf.tasks[1], node, multihop=True)
+        if move.apply(solution):
+            move.revert(solution)
+            assert not solution._require_evaluation
+            assert solution.value is value
+
+
+def assert_masks_match(solution, topology):
+    for task in random.sample(topology.all_tasks, 10):
+        for prev_node in [None] + random.sample(topology.all_nodes, 4):
+            for multihop in (False, True):
+                mappable = {node for node in topology.all_nodes
+                            if solution.mappable(prev_node, task, node, multihop)}
+                assert set(topology.nodes_of(solution.candidate_mask(prev_node, task, multihop))) == mappable
+
+
+@pytest.mark.parametrize('solution_type', [Solution, ArraySolution])
+def test_candidate_mask_matches_mappable(solution_type):
+    # the masks follow map() / unmap() and clone()
+    topology, solution = allocated(solution_type, MultiHopEvaluator)
+    assert_masks_match(solution, topology)
+    for i in range(100):
+        task = random.choice(topology.all_tasks)
+        if solution.is_mapped(task):
+            solution.unmap(task)
+        else:
+            # tasks are mapped out of order here: keep the nodes of a workflow distinct, as Move does
+            prev_node, _ = solution.adjacent_nodes(task)
+            candidates = [node for node in topology.nodes_of(solution.candidate_mask(prev_node, task, multihop=True))
+                          if node not in solution.assigned_nodes(task.workflow)]
+            if candidates:
+                solution.map(prev_node, task, random.choice(candidates), multihop=True)
+        if i % 20 == 0:
+            assert_masks_match(solution, topology)
+            assert_masks_match(solution.clone(), topology)
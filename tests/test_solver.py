@@ -0,0 +1,281 @@
+import random
+from collections import Counter
+
+import numpy as np
+import pytest
+
+import parameters
+from conftest import use_parameters
+from topology import StaticTopology, WorkFlow
+from solution import Solution, ArraySolution
+from evaluator import SingleHopEvaluator, MultiHopMarkovEvaluator, EvaluationStatistics
+from allocator import RandomAllocator, OptimalAllocator
+from solver import SimpleSolver, OptimalSolver
+from solver_ga import GeneticSolver, GeneticSolverParameters, Population, IslandSolver, IslandSolverParameters, _breed
+from solver_ma import MarkovSolver, MarkovSolverParameters
+from parallel import WorkerContext, _setup
+
+
+def placements(solution, workflows):
+    return {task: solution.task_to_node[task] for wf in workflows for task in wf.tasks if solution.is_mapped(task)}
+
+
+def test_optimal_re_solve():
+    use_parameters(parameters.super_vanilla_test_parameters)
+    topology = StaticTopology()
+    evaluator = SingleHopEvaluator(topology, metric='energy')
+    solver = OptimalSolver(topology, OptimalAllocator(topology, evaluator), evaluator)
+    solution = solver.solve()
+
+    kept = topology.workflows[1:]
+    before = placements(solution, kept)
+    added = [WorkFlow()]
+    solution = solver.re_solve(added, topology.workflows[:1])
+    assert placements(solution, kept) == before
+
+    # the arriving workflow gets its best placement next to the others
+    reference = solution.clone()
+    for task in reversed(added[0].tasks):
+        reference.unmap(task)
+    OptimalAllocator(topology, evaluator, branch_and_bound=False).extend(reference, added)
+    assert solution.workflow_alloc_cnt == reference.workflow_alloc_cnt
+    assert abs(solution.evaluate().key - reference.evaluate().key) < 1e-9
+
+
+def test_genetic_re_solve():
+    topology = StaticTopology()
+    evaluator = SingleHopEvaluator(topology)
+    solver = GeneticSolver(topology, RandomAllocator(topology, evaluator, ArraySolution), evaluator,
+                           GeneticSolverParameters(8, 50, 0.5, n_repair_generation=10))
+    solver.solve()
+
+    solution = solver.re_solve([WorkFlow()], topology.workflows[:1])
+    assert len(topology.workflows) == parameters.vanilla_test_parameters.NumOfWorkflows
+    assert solution is solver.population.best()
+    for member in solver.population:
+        assert solver.population.key(member) == Population.fitness(member)
+        assert abs(member.evaluate().key - evaluator.evaluate_full(member).key) < 1e-9
+
+
+def test_genetic_repair_mutates():
+    topology = StaticTopology()
+    evaluator = SingleHopEvaluator(topology)
+    solver = GeneticSolver(topology, RandomAllocator(topology, evaluator, ArraySolution), evaluator,
+                           GeneticSolverParameters(8, 0, 1.0, seed=0))
+    solver.solve()
+    workflows = topology.workflows[:2]
+    before = {tuple(placements(member, workflows).items()) for member in solver.population}
+
+    # a mutated child stays a valid placement of its workflows, and moves some of their tasks
+    member = solver.population.best()
+    child = member.clone()
+    solver._mutate(child, workflows)
+    assert placements(child, workflows) != placements(member, workflows)
+    assert placements(child, topology.workflows[2:]) == placements(member, topology.workflows[2:])
+    assert abs(child.evaluate().key - evaluator.evaluate_full(child).key) < 1e-9
+    for wf in workflows:
+        for prev_task, task in zip(wf.tasks, wf.tasks[1:]):
+            assert child.task_to_node[task] in child.task_to_node[prev_task].neighbors
+
+    solver._repair(workflows, 50)
+    after = {tuple(placements(member, workflows).items()) for member in solver.population}
+    assert after - before
+
+
+def test_population_invalidate():
+    topology = StaticTopology()
+    evaluator = SingleHopEvaluator(topology)
+    allocator = RandomAllocator(topology, evaluator, ArraySolution)
+    population = Population(allocator.allocate_workflows() for _ in range(4))
+    member = population.members[0]
+    key, n_entry = population.key(member), len(population._best)
+
+    # nothing changed: no new heap entry
+    population.invalidate(member)
+    assert len(population._best) == n_entry
+
+    wf = next(wf for wf in topology.workflows if member.is_allocated(wf))
+    for task in reversed(wf.tasks):
+        member.unmap(task)
+    population.invalidate(member)
+    assert len(population._best) == n_entry + 1
+    assert population.key(member) == Population.fitness(member) != key
+    assert population.holds(member)
+
+
+def island_solver(topology, evaluator, seed=3):
+    islands = [GeneticSolverParameters(6, 12, mutation_ratio, seed=None) for mutation_ratio in (0.2, 0.8)]
+    return IslandSolver(topology, RandomAllocator(topology, evaluator, ArraySolution), evaluator,
+                        IslandSolverParameters(islands, migration_interval=5, n_migrants=2, seed=seed))
+
+
+def test_island_solver():
+    topology = StaticTopology()
+    evaluator = SingleHopEvaluator(topology)
+    solver = island_solver(topology, evaluator)
+    solution = solver.solve()
+
+    # 12 generations in epochs of 5, 5 and 2, on every island
+    assert [stats.mutation_ratio for stats in solver.island_stats] == [0.2, 0.8]
+    for stats in solver.island_stats:
+        assert [entry[0] for entry in stats.history] == [5, 10, 12]
+        assert all(0 <= entry[4] <= 2 for entry in stats.history)
+        assert stats.history[0][4] == 0     # nothing arrives before the first migration
+
+    # the answer is the best of all islands, a feasible mapping (decoded from the island's encoding)
+    best_key = min(stats.history[-1][1] for stats in solver.island_stats)
+    assert Population.fitness(solution) == (best_key[0], pytest.approx(best_key[1], rel=1e-9))
+    assert len(solver._populations) == 2 and all(len(members) == 6 for members in solver._populations)
+
+    # the same seed, the same run
+    again = island_solver(topology, evaluator).solve()
+    assert (again.encode() == solution.encode()).all()
+
+
+def test_population_selection():
+    topology = StaticTopology()
+    evaluator = SingleHopEvaluator(topology)
+    allocator = RandomAllocator(topology, evaluator, ArraySolution)
+    population = Population(allocator.allocate_workflows() for _ in range(8))
+    keys = [Population.fitness(member) for member in population]
+
+    ranked = population.ranked()
+    assert [population.key(member) for member in ranked] == sorted(keys)
+    assert population.key(population.best()) == population.key(ranked[0])
+    assert population.key(population.worst()) == population.key(ranked[-1])
+    assert population.key(population.select_tournament(len(population))) == population.key(ranked[0])
+
+    # linear ranking: the i-th best of n is chosen with weight n - i
+    random.seed(0)
+    counts = Counter(ranked.index(population.select_by_rank()) for _ in range(3600))
+    for i in range(len(ranked)):
+        assert counts[i] / 3600 == pytest.approx((8 - i) / 36, abs=0.03)
+
+    # replacing the worst keeps the heaps and the ranking right
+    worst = population.worst()
+    child = allocator.allocate_workflows()
+    assert population.replace_worst(child) is worst
+    assert worst not in population.members and child in population.members
+    assert [population.key(member) for member in population.ranked()] == \
+        sorted(Population.fitness(member) for member in population)
+    assert population.key(population.best()) == population.key(population.ranked()[0])
+
+
+def test_population_keeps_copies_out():
+    use_parameters(parameters.super_vanilla_test_parameters)
+    topology = StaticTopology()
+    evaluator = SingleHopEvaluator(topology)
+    allocator = RandomAllocator(topology, evaluator, ArraySolution)
+    population = Population(allocator.allocate_workflows() for _ in range(4))
+    member = population.members[0]
+
+    # the same mapping, however it was built
+    assert population.holds(member.clone())
+    assert population.holds(ArraySolution.decode(topology, evaluator, member.encode()))
+    assert population._fingerprints == Counter(m.fingerprint for m in population)
+
+    # a small topology: most children are copies, and none of them gets in
+    solver = GeneticSolver(topology, allocator, evaluator, GeneticSolverParameters(6, 200, 0.0, seed=1))
+    solver._init_population()
+    n_distinct = len({m.fingerprint for m in solver.population})
+    solver._evolve(200)
+    assert solver.n_duplicate > 0
+    assert len({m.fingerprint for m in solver.population}) >= n_distinct
+    assert solver.population._fingerprints == Counter(m.fingerprint for m in solver.population)
+
+
+def test_simple_solver_streams():
+    topology = StaticTopology()
+    evaluator = SingleHopEvaluator(topology)
+    allocator = RandomAllocator(topology, evaluator, ArraySolution)
+    solver = SimpleSolver(topology, allocator, evaluator, size=40, seed=5, top_k=3, statistics=True)
+    best = solver.solve()
+
+    # the same samples, all of them kept
+    random.seed(5)
+    solutions = [allocator.allocate_workflows() for _ in range(40)]
+    keys = sorted(Population.fitness(solution) for solution in solutions)
+    assert [Population.fitness(solution) for solution in solver.top_solutions] == keys[:3]
+    assert best is solver.top_solutions[0]
+
+    stats = solver.statistics
+    assert stats.n == 40
+    assert stats.alloc_cnt == Counter(solution.workflow_alloc_cnt for solution in solutions)
+    for metric in stats.metrics:
+        values = np.array([getattr(solution.evaluate(), metric) for solution in solutions])
+        assert stats.mean[metric] == pytest.approx(values.mean(), rel=1e-9, abs=1e-12)
+        assert stats.variance(metric) == pytest.approx(values.var(ddof=1), rel=1e-9, abs=1e-12)
+
+    # statistics of two halves merge into those of the whole
+    halves = [EvaluationStatistics(), EvaluationStatistics()]
+    for i, solution in enumerate(solutions):
+        halves[i % 2].add(solution.workflow_alloc_cnt, solution.evaluate())
+    halves[0].merge(halves[1])
+    assert halves[0].n == 40 and halves[0].alloc_cnt == stats.alloc_cnt
+    for metric in stats.metrics:
+        assert halves[0].mean[metric] == pytest.approx(stats.mean[metric], rel=1e-9, abs=1e-12)
+        assert halves[0].variance(metric) == pytest.approx(stats.variance(metric), rel=1e-9, abs=1e-12)
+
+
+@pytest.mark.parametrize('n_workers', [0, 1])
+def test_generations_count_children(n_workers):
+    # serial or in batches, a crossover without a child is not a generation
+    topology = StaticTopology()
+    evaluator = SingleHopEvaluator(topology)
+    allocator = RandomAllocator(topology, evaluator, ArraySolution)
+    solver = GeneticSolver(topology, allocator, evaluator, GeneticSolverParameters(6, 40, 0.5, n_workers=n_workers, seed=2))
+    solver.solve()
+    assert solver.n_child == 40
+    assert solver.n_no_child > 0
+
+
+def test_parents_are_encoded_and_decoded_once():
+    topology = StaticTopology()
+    evaluator = SingleHopEvaluator(topology)
+    allocator = RandomAllocator(topology, evaluator, ArraySolution)
+    solver = GeneticSolver(topology, allocator, evaluator, GeneticSolverParameters(6, 1, 1.0))
+    solver._init_population()
+    population = solver.population
+    mother, father = population.members[:2]
+
+    assert population.encoding(mother) is population.encoding(mother)
+    assert (population.encoding(mother) == mother.encode()).all()
+
+    context = WorkerContext(*_setup(allocator, solver))
+    job = ((mother.fingerprint, population.encoding(mother)), (father.fingerprint, population.encoding(father)))
+    for _ in range(3):
+        _breed(context, *job)
+    assert list(context.parents) == [mother.fingerprint, father.fingerprint]
+
+    # a member changed in place is encoded again
+    solver._mutate(mother)
+    population.invalidate(mother)
+    assert (population.encoding(mother) == mother.encode()).all()
+
+
+SOLVERS = {
+    'random': (RandomAllocator, SingleHopEvaluator, lambda *setup: SimpleSolver(*setup, size=50)),
+    'optimal': (OptimalAllocator, SingleHopEvaluator, OptimalSolver),
+    'genetic': (RandomAllocator, SingleHopEvaluator,
+                lambda *setup: GeneticSolver(*setup, GeneticSolverParameters(10, 60, 1.0))),
+    'markov': (RandomAllocator, MultiHopMarkovEvaluator,
+               lambda *setup: MarkovSolver(*setup, MarkovSolverParameters(20, 2000))),
+}
+
+
+@pytest.mark.parametrize('mode, seed', [(mode, seed) for mode in SOLVERS for seed in range(1 if mode == 'optimal' else 2)])
+def test_array_solution_solves_alike(mode, seed):
+    # the same run with either solution type: main.py runs every mode on ArraySolution
+    if mode == 'optimal':
+        use_parameters(parameters.super_vanilla_test_parameters)
+    allocator_type, evaluator_type, solver_type = SOLVERS[mode]
+    random.seed(seed)
+    topology = StaticTopology()
+    results = []
+    for solution_type in (Solution, ArraySolution):
+        random.seed(100 + seed)
+        evaluator = evaluator_type(topology)
+        best = solver_type(topology, allocator_type(topology, evaluator, solution_type), evaluator).solve()
+        assert type(best) is solution_type
+        results.append((best.encode().tolist(), best.workflow_alloc_cnt, evaluator.evaluate(best).key))
+    assert results[0] == results[1]
@@ -0,0 +1,118 @@
+import random
+from collections import Counter
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from topology import StaticTopology
+from solution import ArraySolution, RelocateMove
+from evaluator import MultiHopMarkovEvaluator
+from allocator import RandomAllocator
+from solver_ma import MarkovSolver, MarkovSolverParameters, ParallelTemperingSolver, ParallelTemperingParameters
+
+
+def run_chain(beta):
+    topology = StaticTopology()
+    evaluator = MultiHopMarkovEvaluator(topology)
+    solver = MarkovSolver(topology, RandomAllocator(topology, evaluator, ArraySolution), evaluator,
+                          MarkovSolverParameters(30, beta))
+    solver.solve()
+    return solver.stats
+
+
+def test_chain_stats():
+    stats = run_chain(0)
+    assert stats.n_iteration == 30
+    assert stats.acceptance_rate == stats.n_transition / stats.n_iteration
+
+    stats = run_chain(1e6)
+    assert stats.n_transition > 0
+    assert stats.acceptance_rate < 1.0
+    assert 0.0 <= stats.uphill_rate < 1.0
+
+
+def select_counts(beta, base_cost, costs, n_sample):
+    # how often _select() picks each candidate; the candidates are their own costs
+    topology = StaticTopology()
+    evaluator = MultiHopMarkovEvaluator(topology)
+    solver = MarkovSolver(topology, RandomAllocator(topology, evaluator, ArraySolution), evaluator,
+                          MarkovSolverParameters(1, beta))
+    solver._peek_cost = lambda base, move: move
+    base = SimpleNamespace(evaluate=lambda: SimpleNamespace(total_cost=base_cost))
+    return Counter(solver._select(base, costs) for _ in range(n_sample))
+
+
+def test_select_samples_rates():
+    random.seed(0)
+    counts = select_counts(2, 0.5, [0.0, None, 0.5, 1.0], 20000)
+    assert None not in counts
+
+    # rate = exp(-beta/2 * (cost_base - cost)) with cost = 1 - total_cost
+    rates = np.exp([-0.5, 0.0, 0.5])
+    for total_cost, p in zip([0.0, 0.5, 1.0], rates / rates.sum()):
+        assert counts[total_cost] / 20000 == pytest.approx(p, abs=0.02)
+
+
+def test_select_does_not_overflow():
+    # log-rates of +-1000 overflow a plain exp()
+    random.seed(0)
+    counts = select_counts(2000, 1e6, [1e6 - 1, 1e6, 1e6 + 1], 100)
+    assert counts == {1e6 + 1: 100}
+
+
+def test_accept_swap():
+    rng = random.Random(0)
+    accept_swap = ParallelTemperingSolver._accept_swap
+    # the hotter chain (lower beta) found the better state: always swapped down
+    assert all(accept_swap(1, 100, 0.9, 0.1, rng) for _ in range(100))
+    assert all(accept_swap(5, 5, 0.1, 0.9, rng) for _ in range(100))
+    # the colder chain keeps the better state
+    assert not any(accept_swap(1, 100, 0.1, 0.9, rng) for _ in range(100))
+
+
+def test_tempering_keeps_betas():
+    # the chains at equal betas always swap
+    betas = [0, 0, 1e6]
+    topology = StaticTopology()
+    evaluator = MultiHopMarkovEvaluator(topology)
+    solver = ParallelTemperingSolver(topology, RandomAllocator(topology, evaluator, ArraySolution), evaluator,
+                                     ParallelTemperingParameters(20, betas, swap_interval=5, seed=1))
+    result = solver.solve()
+
+    # one chain at every beta in every round, whatever was swapped; pairs alternate (0, 1) and (1, 2)
+    assert [stats.beta for stats in solver.chain_stats] == betas
+    assert [stats.n_iteration for stats in solver.chain_stats] == [20] * len(betas)
+    assert [stats.n_swap_proposed for stats in solver.chain_stats] == [2, 4, 2]
+    assert solver.chain_stats[0].n_swap_accepted == 2
+    assert solver.chain_stats[1].n_swap_accepted == \
+        solver.chain_stats[0].n_swap_accepted + solver.chain_stats[2].n_swap_accepted
+    assert result is solver.current_solution
+    assert all(result.is_allocated(wf) for wf in topology.workflows)
+
+    # the seed fixes every chain
+    again = ParallelTemperingSolver(topology, RandomAllocator(topology, evaluator, ArraySolution), evaluator,
+                                    ParallelTemperingParameters(20, betas, swap_interval=5, seed=1)).solve()
+    assert np.array_equal(again.encode(), result.encode())
+
+
+def test_neighborhood_is_bounded():
+    topology = StaticTopology()
+    evaluator = MultiHopMarkovEvaluator(topology)
+    solver = MarkovSolver(topology, RandomAllocator(topology, evaluator, ArraySolution), evaluator,
+                          MarkovSolverParameters(1, 100))
+    solution = solver.allocator.allocate_workflows()
+    bound = sum(len(wf.tasks) - 1 for wf in topology.workflows if solution.is_allocated(wf))
+
+    for _ in range(20):
+        before = solution.encode()
+        moves = list(solver._neighborhood(solution))
+        # at most one move per task that can move, whatever the iteration
+        assert 0 < len(moves) <= bound
+        assert all(isinstance(move, RelocateMove) for move in moves)
+        assert len({move.task for move in moves}) == len(moves)
+
+        # peeking at the candidates leaves the solution as it was
+        selected = solver._select(solution, moves)
+        assert np.array_equal(solution.encode(), before)
+        selected.apply(solution)
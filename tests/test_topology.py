@@ -0,0 +1,64 @@
+import random
+from itertools import combinations
+
+import pytest
+
+import parameters
+from conftest import use_parameters
+from topology import StaticTopology
+from routing import bfs
+
+
+def brute_force_links(topology):
+    # drones within each other's range, every drone with every edge server, edge servers with cloud servers
+    links = set()
+    for node1, node2 in combinations(topology.drones, 2):
+        d = StaticTopology._distance_between(node1, node2)
+        if d <= node1.trans_range and d <= node2.trans_range:
+            links.add(frozenset((node1, node2)))
+    for drone in topology.drones:
+        links.update(frozenset((drone, server)) for server in topology.edge_servers)
+    for edge in topology.edge_servers:
+        links.update(frozenset((edge, cloud)) for cloud in topology.cloud_servers)
+    return links
+
+
+@pytest.mark.parametrize('params', [
+    parameters.vanilla_test_parameters,
+    parameters.GlobalParameters(),
+    parameters.GlobalParameters(NumOfDrones=400, DroneXRange=parameters.Range(0, 300),
+                                AreaYRange=parameters.Range(0, 300)),
+])
+def test_neighbors_match_brute_force(params):
+    use_parameters(params)
+    topology = StaticTopology()
+    links = {frozenset((node, neighbor)) for node in topology.all_nodes for neighbor in node.neighbors}
+    assert links == brute_force_links(topology)
+    assert {frozenset(key) for key in topology.distance} == links
+    for (node1, node2), d in topology.distance.items():
+        assert d == pytest.approx(StaticTopology._distance_between(node1, node2))
+
+
+def test_tables_follow_move_node():
+    use_parameters(parameters.vanilla_test_parameters)
+    random.seed(0)
+    topology = StaticTopology()
+    topology.adjacency_bits
+    topology.neighbor_lists
+    for _ in range(30):
+        node = random.choice(topology.drones)
+        topology.move_node(node, node.pos_x + random.uniform(-8, 8), node.pos_y + random.uniform(-8, 8))
+
+        assert {frozenset(key) for key in topology.distance} == brute_force_links(topology)
+        for (node1, node2), d in topology.distance.items():
+            assert d == pytest.approx(StaticTopology._distance_between(node1, node2))
+
+        adjacency = topology._adjacency_lists()
+        for src in range(topology.n_all_node):
+            hop_row, _ = bfs(adjacency, src)
+            for dst_node in topology.all_nodes:
+                path = topology.router.path(topology.all_nodes[src], dst_node)
+                assert (len(path) - 1 if path else -1) == hop_row[dst_node.index]
+            bits = topology.adjacency_bits[src]
+            assert topology.nodes_of(bits) == [topology.all_nodes[i] for i in sorted(adjacency[src])]
+            assert topology.neighbor_lists[src] == topology.nodes_of(bits)
@@ -0,0 +1,136 @@
+import random
+
+import pytest
+
+from topology import StaticTopology, transmission_energy
+from solution import Solution, ArraySolution
+from evaluator import SingleHopEvaluator, MultiHopEvaluator, MultiHopMarkovEvaluator
+from allocator import RandomAllocator
+from solver import SimpleSolver
+from solver_ga import GeneticSolver, GeneticSolverParameters, Population
+from solver_ma import MarkovSolver, MarkovSolverParameters
+
+
+def move_drones(topology, n_step=20):
+    for _ in range(n_step):
+        yield topology.step({node: (node.pos_x + random.uniform(-8, 8), node.pos_y + random.uniform(-8, 8))
+                             for node in random.sample(topology.drones, 3)})
+
+
+def assert_follows(solution, evaluator):
+    for wf in solution.topology.workflows:
+        nodes = [solution.task_to_node[task] for task in wf.tasks if solution.is_mapped(task)]
+        for key in zip(nodes, nodes[1:]):
+            path = solution.routing_paths.get(key, key)
+            assert all(node2 in node1.neighbors for node1, node2 in zip(path, path[1:]))
+
+    if solution.workflow_alloc_cnt:
+        assert solution.evaluate().key == pytest.approx(evaluator.evaluate_full(solution).key, rel=1e-9)
+
+
+@pytest.mark.parametrize('solution_type', [Solution, ArraySolution])
+def test_markov_solution_follows_steps(solution_type):
+    topology = StaticTopology()
+    evaluator = MultiHopMarkovEvaluator(topology)
+    solver = MarkovSolver(topology, RandomAllocator(topology, evaluator, solution_type), evaluator,
+                          MarkovSolverParameters(20, 100))
+    solver.solve()
+    for _ in move_drones(topology):
+        assert_follows(solver.current_solution, evaluator)
+
+
+@pytest.mark.parametrize('solution_type', [Solution, ArraySolution])
+def test_kept_solutions_follow_steps(solution_type):
+    topology = StaticTopology()
+    evaluator = SingleHopEvaluator(topology)
+    allocator = RandomAllocator(topology, evaluator, solution_type)
+    simple = SimpleSolver(topology, allocator, evaluator, size=10, top_k=3)
+    simple.solve()
+    genetic = GeneticSolver(topology, allocator, evaluator, GeneticSolverParameters(6, 20, 0.5))
+    genetic.solve()
+
+    for _ in move_drones(topology):
+        for solution in simple.top_solutions:
+            assert_follows(solution, evaluator)
+        for member in genetic.population:
+            assert_follows(member, evaluator)
+            assert genetic.population.key(member) == Population.fitness(member)
+
+
+def links_hold(solution, key):
+    # a link of a workflow holds over its route, or over the direct link without one
+    path = solution.routing_paths.get(key)
+    if path is None:
+        return key[1] in key[0].neighbors
+    return all(node2 in node1.neighbors for node1, node2 in zip(path, path[1:]))
+
+
+@pytest.mark.parametrize('solution_type', [Solution, ArraySolution])
+@pytest.mark.parametrize('multihop', [False, True])
+def test_topology_changed_finds_broken_workflows(solution_type, multihop):
+    # only the routes and workflows on the moved nodes are looked at: the result is that of a full scan
+    topology = StaticTopology()
+    evaluator = MultiHopEvaluator(topology)
+    allocated = RandomAllocator(topology, evaluator, solution_type).allocate_workflows()
+    solution = solution_type.decode(topology, evaluator, allocated.encode(), multihop=multihop)
+
+    n_broken = 0
+    for change in move_drones(topology, 40):
+        broken = solution.topology_changed(change)
+        expected = []
+        for wf in topology.workflows:
+            nodes = [solution.task_to_node.get(task) for task in wf.tasks]
+            if any(None not in key and not links_hold(solution, key) for key in zip(nodes, nodes[1:])):
+                expected.append(wf)
+        assert broken == expected
+
+        index = {}
+        for key, path in solution.routing_paths.items():
+            for node in path:
+                index.setdefault(node, set()).add(key)
+        assert {node: keys for node, keys in solution._route_index.items() if keys} == index
+
+        n_broken += len(broken)
+        solution.release_workflows(broken)
+        if solution.workflow_alloc_cnt:
+            assert solution.evaluate().key == pytest.approx(evaluator.evaluate_full(solution).key, rel=1e-9)
+    # without routes, a workflow breaks when a direct link it needs is removed
+    assert n_broken or multihop
+
+
+def test_energy_table_follows_steps():
+    topology = StaticTopology()
+    task = topology.all_tasks[0]
+    bandwidths = sorted({task.required_resources['bandwidth'] for task in topology.all_tasks})
+    for _ in move_drones(topology, 40):
+        matrix = topology.energy_matrix
+        for (node1, node2), dist in topology.distance.items():
+            for c, bandwidth in enumerate(bandwidths):
+                assert matrix[c, topology.link_id(node1, node2)] == pytest.approx(transmission_energy(bandwidth, dist))
+            assert topology.link_energy(task, node1, node2) == \
+                pytest.approx(transmission_energy(task.required_resources['bandwidth'], dist))
+        no_link = topology.link_id(None, None)
+        assert matrix[0, no_link] == pytest.approx(transmission_energy(bandwidths[0], topology.get_distance(None, None)))
+
+
+def test_cache_keeps_evaluations_off_the_moved_nodes():
+    topology = StaticTopology()
+    evaluator = SingleHopEvaluator(topology)
+    solutions = [RandomAllocator(topology, evaluator).allocate_workflows() for _ in range(10)]
+    for solution in solutions:
+        # one workflow each, on a few nodes
+        solution.release_workflows(topology.workflows[1:])
+        solution.evaluate()
+    n_kept = 0
+
+    for change in move_drones(topology):
+        moved = {node.index for node in change.moved}
+        for solution in solutions:
+            cached = evaluator.cache.get((type(evaluator), evaluator.metric, solution.fingerprint))
+            used = {node.index for node, tasks in solution.node_to_tasks.items() if tasks}
+            if used & moved:
+                assert cached is None
+            elif cached is not None:
+                n_kept += 1
+                assert cached.key == pytest.approx(evaluator.evaluate_full(solution).key, rel=1e-12)
+    assert n_kept
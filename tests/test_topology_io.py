@@ -0,0 +1,38 @@
+import pickle
+
+from topology import StaticTopology
+from topology_io import MappedTopology, save_topology, load_topology
+
+
+def nodes_of(topology):
+    return [(node.id, type(node), node.pos_x, node.pos_y, dict(node.resources),
+             sorted(neighbor.id for neighbor in node.neighbors)) for node in topology.all_nodes]
+
+
+def workflows_of(topology):
+    return [(wf.id, [(task.id, dict(task.required_resources)) for task in wf.tasks]) for wf in topology.workflows]
+
+
+def test_round_trip(tmp_path):
+    topology = StaticTopology()
+    path = tmp_path / 'topology.tpg'
+    save_topology(topology, path)
+
+    loaded = load_topology(path)
+    assert isinstance(loaded, MappedTopology)
+    assert loaded._adjacency_lists() == topology._adjacency_lists()
+    assert not loaded.materialized
+
+    assert nodes_of(loaded) == nodes_of(topology)
+    assert workflows_of(loaded) == workflows_of(topology)
+    assert {(node1.id, node2.id): d for (node1, node2), d in loaded.distance.items()} == \
+           {(node1.id, node2.id): d for (node1, node2), d in topology.distance.items()}
+
+    # a loaded topology saves again
+    save_topology(loaded, tmp_path / 'again.tpg')
+    assert nodes_of(load_topology(tmp_path / 'again.tpg')) == nodes_of(topology)
+
+    # once materialized, a pickled copy is a plain StaticTopology
+    copied = pickle.loads(pickle.dumps(loaded))
+    assert type(copied) is StaticTopology
+    assert nodes_of(copied) == nodes_of(topology)
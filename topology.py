@@ -1,8 +1,14 @@
 from abc import ABCMeta
-from random import randint, randrange
+from random import Random, randint, randrange
 from itertools import product, chain
+from collections import defaultdict
+from weakref import WeakMethod
+from math import floor, ceil, isinf, inf
+
+import numpy as np
 
 from parameters import *
+from routing import Router
 
 
 # in this file, all the classes contain STATIC information
@@ -18,6 +24,7 @@ class StaticTopology:
         self.cloud_servers = self._deploy(CloudServer, global_params.NumOfCloudServer, global_params.CloudServerXRange)
         self.all_nodes = self.drones + self.edge_servers + self.cloud_servers
         self.n_all_node = len(self.all_nodes)
+        self._index_nodes()
 
         # build connection info.
         # self.links = self._connect(self.drones, self.drones, dist_constrained=True)
@@ -37,10 +44,15 @@ class StaticTopology:
                 d = self._distance_between(node1, node2)
                 self.distance[(node1, node2)] = self.distance[(node2, node1)] = d
 
+        # dense, integer-indexed views of the above. built lazily, dropped by _reset_tables()
+        self._reset_tables()
+        self._init_mobility()
+
         # generate workflows & tasks
         self.workflows = [WorkFlow() for _ in range(global_params.NumOfWorkflows)]
         self.all_tasks = list(chain(*[wf.tasks for wf in self.workflows]))
         self.n_all_task = len(self.all_tasks)
+        self._index_workload()
 
         if DEBUG:
             self.print_nodes()
@@ -67,9 +79,323 @@ class StaticTopology:
         try:
             return self.distance[(node1, node2)]
         except KeyError:
-            return self.distance[list(self.distance.keys())[0]]
+            # not connected. any link distance will do (the first one, as before)
+            return next(iter(self.distance.values()))
+
+    def __getstate__(self):
+        # listeners belong to this process (solutions, caches)
+        return {key: value for key, value in self.__dict__.items() if key not in ('listeners', '_grid', '_router')}
+
+    def __setstate__(self, state):
+        # topologies pickled before the dense tables existed
+        self._reset_tables()
+        self._init_mobility()
+        self.__dict__.update(state)
+        self._index_nodes()
+        self._index_workload()
+
+    def _reset_tables(self):
+        self._adjacency_bits = None
+        self._neighbor_lists = None
+        self._neighbor_bytes = None
+        self._reachable_bits = None
+        self._capacity_matrix = None
+        self._demand_matrix = None
+        self._energy_table = None
+        self._free_link_ids = []    # columns of energy_matrix left by removed links
+        self._zobrist_keys = {}
+
+    def _init_mobility(self):
+        self.listeners = []     # called with a TopologyChange after every step()
+        self._grid = None       # SpatialGrid of the nodes with distance-constrained links, built on the first step()
+        self._router = None     # see router
+
+    def _index_nodes(self):
+        # node.index is the row/column of the node in every matrix below
+        for i, node in enumerate(self.all_nodes):
+            node.index = i
+
+    def _index_workload(self):
+        # wf.index / task.index: positions in self.workflows / self.all_tasks
+        for i, wf in enumerate(self.workflows):
+            wf.index = i
+        for i, task in enumerate(self.all_tasks):
+            task.index = i
+        self._demand_matrix = None
+        self._energy_table = None
+
+    def change_workload(self, added=(), removed=()):
+        # workflows arrive / depart. removed workflows and their tasks get index -1.
+        # returns the previous (workflows, all_tasks), so solutions can follow (see Solution.workload_changed())
+        old_workload = self.workflows, self.all_tasks
+        removed = set(removed)
+        self.workflows = [wf for wf in self.workflows if wf not in removed] + list(added)
+        self.all_tasks = list(chain(*[wf.tasks for wf in self.workflows]))
+        self.n_all_task = len(self.all_tasks)
+        for wf in removed:
+            wf.index = -1
+            for task in wf.tasks:
+                task.index = -1
+
+        self._index_workload()
+        return old_workload
+
+    def zobrist_keys(self, task):
+        # a random 64-bit key for every (task, node) pair, see Solution.fingerprint.
+        # seeded by task.id, so the keys survive change_workload() and are the same in every process
+        keys = self._zobrist_keys.get(task.id)
+        if keys is None:
+            rng = Random(task.id)
+            keys = self._zobrist_keys[task.id] = [rng.getrandbits(64) for _ in range(self.n_all_node)]
+        return keys
+
+    @property
+    def resource_names(self):
+        return list(Drone.resources.keys())
+
+    @property
+    def capacity_matrix(self):
+        # capacity_matrix[node.index, r]: amount of resource_names[r] a node has
+        if self._capacity_matrix is None:
+            self._capacity_matrix = np.array(
+                [[node.resources[name] for name in self.resource_names] for node in self.all_nodes],
+                dtype=np.float64).reshape(-1, len(self.resource_names))
+        return self._capacity_matrix
+
+    @property
+    def demand_matrix(self):
+        # demand_matrix[task.index, r]: amount of resource_names[r] a task requires
+        if self._demand_matrix is None:
+            self._demand_matrix = np.array(
+                [[task.required_resources[name] for name in self.resource_names] for task in self.all_tasks],
+                dtype=np.float64).reshape(-1, len(self.resource_names))
+        return self._demand_matrix
+
+    @property
+    def energy_matrix(self):
+        # energy_matrix[task.bw_class, link]: energy of sending a task's output over a link
+        # (see link_id()). one column is for node pairs without a link (see get_distance()), and
+        # after links are removed, some columns belong to no link
+        if self._energy_table is None:
+            self._build_energy_table()
+        return self._energy_table[0]
+
+    def link_id(self, node1, node2):
+        if self._energy_table is None:
+            self._build_energy_table()
+        return self._energy_table[1].get((node1, node2), self._energy_table[2])
+
+    def link_energy(self, task, node1, node2):
+        if self._energy_table is None:
+            self._build_energy_table()
+        _, link_ids, no_link, rows, _ = self._energy_table
+        return rows[task.bw_class][link_ids.get((node1, node2), no_link)]
+
+    def _build_energy_table(self):
+        # tasks are grouped by their bandwidth requirement, the only task property the energy depends on
+        bandwidths = sorted({task.required_resources['bandwidth'] for task in self.all_tasks})
+        bw_class = {bandwidth: c for c, bandwidth in enumerate(bandwidths)}
+        for task in self.all_tasks:
+            task.bw_class = bw_class[task.required_resources['bandwidth']]
+
+        link_ids = {pair: i for i, pair in enumerate(self.distance)}
+        distances = list(self.distance.values())
+        distances.append(self.get_distance(None, None) if distances else 0.0)
+
+        rows = [[transmission_energy(bandwidth, dist) for dist in distances] for bandwidth in bandwidths]
+        matrix = np.array(rows, dtype=np.float64).reshape(len(bandwidths), len(distances))
+        self._energy_table = (matrix, link_ids, len(distances) - 1, rows, bandwidths)
+        self._free_link_ids = []
+
+    def _update_energy_table(self, added, removed, changed):
+        # after step(): only the columns of the links of the moved nodes are worked out again.
+        # the columns of removed links are given to added ones before the table grows
+        matrix, link_ids, no_link, rows, bandwidths = self._energy_table
+        free = self._free_link_ids
+        for link in removed:
+            free.extend(link_ids.pop(pair) for pair in (link, link[::-1]))
+
+        n_new = 2 * len(added) - len(free)
+        if n_new > 0:
+            free.extend(range(matrix.shape[1], matrix.shape[1] + n_new))
+            matrix = np.hstack((matrix, np.zeros((len(bandwidths), n_new))))
+            for row in rows:
+                row.extend([0.0] * n_new)
+        for link in added:
+            for pair in (link, link[::-1]):
+                link_ids[pair] = free.pop()
+
+        # the no-link column follows get_distance(None, None), which is the first link's distance
+        links = [(pair, link_ids[pair]) for link in chain(added, changed) for pair in (link, link[::-1])]
+        links.append((None, no_link))
+        no_link_distance = self.get_distance(None, None) if self.distance else 0.0
+        distances = [self.distance[pair] if pair else no_link_distance for pair, _ in links]
+        ids = [i for _, i in links]
+        for c, bandwidth in enumerate(bandwidths):
+            energies = [transmission_energy(bandwidth, dist) for dist in distances]
+            matrix[c, ids] = energies
+            row = rows[c]
+            for i, energy in zip(ids, energies):
+                row[i] = energy
+        self._energy_table = (matrix, link_ids, no_link, rows, bandwidths)
+
+    # node sets as bitsets: python ints with bit node.index set for every member.
+    # a candidate set is then a few ANDs (see Solution.candidate_mask())
+
+    @property
+    def adjacency_bits(self):
+        # adjacency_bits[node.index]: the neighbors of a node
+        if self._adjacency_bits is None:
+            self._adjacency_bits = [sum(1 << j for j in set(neighbors)) for neighbors in self._adjacency_lists()]
+        return self._adjacency_bits
+
+    @property
+    def neighbor_lists(self):
+        # neighbor_lists[node.index]: the neighbors of a node, in index order
+        if self._neighbor_lists is None:
+            self._neighbor_lists = [self.nodes_of(bits) for bits in self.adjacency_bits]
+        return self._neighbor_lists
+
+    def neighbors_of(self, bits):
+        # the nodes linked to any node of a bitset: one lookup per byte of it.
+        # _neighbor_bytes[k][v]: the neighbors of the nodes 8k .. 8k+7 in byte value v
+        if self._neighbor_bytes is None:
+            self._neighbor_bytes = []
+            adjacency_bits = self.adjacency_bits
+            for k in range(0, self.n_all_node, 8):
+                row = [0] * 256
+                for v in range(1, 256):
+                    low = v & -v
+                    i = k + low.bit_length() - 1
+                    row[v] = row[v ^ low] | (adjacency_bits[i] if i < self.n_all_node else 0)
+                self._neighbor_bytes.append(row)
+
+        neighbors = 0
+        for row in self._neighbor_bytes:
+            if bits & 255:
+                neighbors |= row[bits & 255]
+            bits >>= 8
+        return neighbors
+
+    @property
+    def reachable_bits(self):
+        # reachable_bits[node.index]: the nodes reachable from a node (see is_reachable())
+        if self._reachable_bits is None:
+            self._reachable_bits = [self.router.reachable_bits(i) for i in range(self.n_all_node)]
+        return self._reachable_bits
+
+    def nodes_of(self, bits):
+        # the nodes of a bitset, in index order
+        all_nodes, nodes = self.all_nodes, []
+        while bits:
+            low = bits & -bits
+            nodes.append(all_nodes[low.bit_length() - 1])
+            bits ^= low
+        return nodes
+
+    def _adjacency_lists(self):
+        return [[neighbor.index for neighbor in node.neighbors] for node in self.all_nodes]
+
+    @property
+    def router(self):
+        # routes and reachability on the current links, shared by all solutions (see routing.py)
+        if self._router is None:
+            self._router = Router(self)
+        return self._router
+
+    def is_reachable(self, src_node, dst_node):
+        return self.router.is_reachable(src_node, dst_node)
+
+    def get_path(self, src_node, dst_node):
+        # min-hop path (src_node, ..., dst_node), or None if unreachable.
+        # the tuple is shared: do not modify it
+        return self.router.path(src_node, dst_node)
+
+    # mobility: nodes move, their links and distances follow
+
+    def move_node(self, node, x, y):
+        return self.step({node: (x, y)})
+
+    def step(self, positions):
+        # moves nodes to new positions ({node: (x, y)}, or an n_all_node x 2 array by node.index)
+        # and updates only the links and distances of the moved nodes.
+        # returns a TopologyChange, which is also sent to every listener
+        if isinstance(positions, np.ndarray):
+            positions = {node: tuple(pos) for node, pos in zip(self.all_nodes, positions.tolist())}
+
+        if self._grid is None:
+            cell_size = max((node.trans_range for node in self.drones), default=0)
+            self._grid = SpatialGrid(cell_size if not isinf(cell_size) and cell_size > 0 else inf)
+            for node in self.drones:
+                self._grid.insert(node)
+
+        moved = []
+        for node, (x, y) in positions.items():
+            if (node.pos_x, node.pos_y) != (x, y):
+                if node in self._grid.order:
+                    self._grid.move(node, x, y)
+                node.pos_x, node.pos_y = x, y
+                moved.append(node)
+
+        # only drone-drone links depend on distance (see __init__)
+        added, removed = set(), set()
+        for node in moved:
+            if node not in self._grid.order:
+                continue
+
+            if isinf(node.trans_range):
+                candidates = list(self._grid.order)
+            else:
+                candidates = self._grid.query(node.pos_x, node.pos_y, node.trans_range)
+
+            in_range = set()
+            for other in candidates:
+                d = self._distance_between(node, other)
+                if other is not node and d <= node.trans_range and d <= other.trans_range:
+                    in_range.add(other)
+
+            linked = {other for other in node.neighbors if other in self._grid.order}
+            removed.update(_link(node, other) for other in linked - in_range)
+            added.update(_link(node, other) for other in in_range - linked)
+
+        for node1, node2 in removed:
+            node1.neighbors.discard(node2)
+            node2.neighbors.discard(node1)
+            del self.distance[(node1, node2)], self.distance[(node2, node1)]
+
+        for node1, node2 in added:
+            node1.neighbors.add(node2)
+            node2.neighbors.add(node1)
+
+        changed = set()
+        for node in moved:
+            for other in node.neighbors:
+                d = self._distance_between(node, other)
+                self.distance[(node, other)] = self.distance[(other, node)] = d
+                changed.add(_link(node, other))
+        changed -= added
+
+        self._update_tables(bool(added or removed))
+        if self._energy_table is not None:
+            self._update_energy_table(added, removed, changed)
+        change = TopologyChange(moved, added, removed, changed)
+        for listener in self.listeners:
+            listener(change)
+        return change
+
+    def _update_tables(self, links_changed):
+        if links_changed:
+            self._adjacency_bits = None
+            self._neighbor_lists = None
+            self._neighbor_bytes = None
+            self._reachable_bits = None
 
     def _connect(self, nodes1, nodes2, dist_constrained=False):
+        if dist_constrained:
+            cell_size = max(node.trans_range for node in chain(nodes1, nodes2))
+            if not isinf(cell_size) and cell_size > 0:
+                self._connect_by_grid(nodes1, nodes2, cell_size)
+                return
 
         #links = {}
         for node1, node2 in product(nodes1, nodes2):
@@ -86,6 +412,24 @@ class StaticTopology:
 
         #return links
 
+    def _connect_by_grid(self, nodes1, nodes2, cell_size):
+        # same result as _connect(), but only the pairs in nearby grid cells are examined.
+        # candidates are visited in 'nodes2' order, so the neighbor sets are filled
+        # in exactly the same order as the product() loop above
+        grid = SpatialGrid(cell_size)
+        for node in nodes2:
+            grid.insert(node)
+
+        for node1 in nodes1:
+            for node2 in grid.query(node1.pos_x, node1.pos_y, node1.trans_range):
+                if node1 == node2:
+                    continue
+
+                d = self._distance_between(node1, node2)
+                if d <= node1.trans_range and d <= node2.trans_range:
+                    node1.neighbors.add(node2)
+                    node2.neighbors.add(node1)
+
     def print_nodes(self):
         print(f"[DBG] {self.n_all_node} nodes generated")
         print("      Node#id [processing power, bandwidth, delay factor]")
@@ -111,6 +455,99 @@ class StaticTopology:
         print()
 
 
+def bits_of(mask):
+    # bitset of the True entries of a boolean array
+    return int.from_bytes(np.packbits(np.asarray(mask, dtype=bool), bitorder='little').tobytes(), 'little')
+
+
+def _link(node1, node2):
+    # one orientation per link, for TopologyChange
+    return (node1, node2) if node1.index < node2.index else (node2, node1)
+
+
+class TopologyChange:
+    # what one StaticTopology.step() did. links are (node1, node2) pairs with node1.index < node2.index
+    def __init__(self, moved, added_links, removed_links, changed_links):
+        self.moved = moved
+        self.added_links = added_links
+        self.removed_links = removed_links
+        self.changed_links = changed_links  # existing links whose distance changed
+
+    @property
+    def links_changed(self):
+        return bool(self.added_links or self.removed_links)
+
+    def __repr__(self):
+        return f'TopologyChange({len(self.moved)} moved, +{len(self.added_links)} / -{len(self.removed_links)} links)'
+
+
+class WeakListener:
+    # a bound method as a listener, without keeping its object alive (e.g. a solver)
+    def __init__(self, method):
+        self._method = WeakMethod(method)
+
+    def __call__(self, change):
+        method = self._method()
+        if method is not None:
+            method(change)
+
+
+def transmission_energy(bandwidth, dist):
+    def step_func(): # uJ
+        if dist <= 60: # meter
+            return 0.056
+        else:
+            uJ = 0.056 + (dist - 60) * (0.087 - 0.062) / (500 - 60)
+            mJ = uJ * 1000
+            return mJ
+
+    # A Close Examination of Performance and Power Characteristics of 4G LTE Networks -> Table 4
+    # 가정: Bandwidth 단위가 Kbps
+    energy_consumption = bandwidth * 438.39 # uplink, Mbps/mW (W = J/sec) -> Kbps/uJ
+    # An Accurate Measurement-Based Power COnsumption Model for LTE Uplink Transmissions -> Fig. 4
+    energy_consumption *= step_func()
+    return energy_consumption # uJ
+
+
+class SpatialGrid:
+    # uniform grid index of nodes by position
+    # a range query only visits the cells overlapping the query circle's bounding box,
+    # so its cost depends on the local node density, not on the total number of nodes
+
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = defaultdict(list)
+        self.order = {}     # node -> insertion order, to make query results deterministic
+
+    def _cell_of(self, x, y):
+        return floor(x / self.cell_size), floor(y / self.cell_size)
+
+    def insert(self, node):
+        self.order[node] = len(self.order)
+        self.cells[self._cell_of(node.pos_x, node.pos_y)].append(node)
+
+    def move(self, node, x, y):
+        # call before node.pos_x / pos_y change
+        old_cell, new_cell = self._cell_of(node.pos_x, node.pos_y), self._cell_of(x, y)
+        if old_cell != new_cell:
+            self.cells[old_cell].remove(node)
+            if not self.cells[old_cell]:
+                del self.cells[old_cell]
+            self.cells[new_cell].append(node)
+
+    def query(self, x, y, radius):
+        # returns the nodes that MAY be within 'radius' from (x, y), in insertion order
+        cx, cy = self._cell_of(x, y)
+        reach = ceil(radius / self.cell_size)
+        found = []
+        for i in range(cx - reach, cx + reach + 1):
+            for j in range(cy - reach, cy + reach + 1):
+                found.extend(self.cells.get((i, j), ()))
+
+        found.sort(key=self.order.__getitem__)
+        return found
+
+
 class Resources(dict):
     # a Resource instance is an addable, substractable, comparable dictionary
     # for example,
@@ -141,6 +578,7 @@ class Node(metaclass=ABCMeta):
     def __init__(self, pos_x=0, pos_y=0):
         Node.id_base += 1
         self.id = Node.id_base
+        self.index = -1     # position in topology.all_nodes
         self.pos_x = pos_x
         self.pos_y = pos_y
         self.neighbors = set()
@@ -197,6 +635,7 @@ class WorkFlow:
     def __init__(self):
         WorkFlow.id_base += 1
         self.id = WorkFlow.id_base
+        self.index = -1     # position in topology.workflows
 
         self.n_task = randint(global_params.MinTasksPerWorkFlow, global_params.MaxTasksPerWorkflow)
         self.tasks = []
@@ -224,6 +663,8 @@ class Task:
     def __init__(self, workflow, required_resources):
         Task.id_base += 1
         self.id = Task.id_base
+        self.index = -1     # position in topology.all_tasks
+        self.bw_class = -1  # row in topology.energy_matrix
         self.workflow = workflow    # 'self' belongs to 'workflow'
         self.required_resources = required_resources
 
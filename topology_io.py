@@ -0,0 +1,240 @@
+import sys
+import json
+import pickle
+import struct
+from functools import cached_property
+
+from topology import *
+
+
+# on-disk topology format
+#
+#   MAGIC | header length (uint64, little endian) | header (json) | arrays
+#
+# the header describes every array by dtype, shape and offset.
+# arrays are stored column-wise (one array per attribute) and aligned to ALIGN bytes,
+# so they can be used directly from a read-only memory map, shared between processes.
+# Drone / Task / WorkFlow objects are created only when they are accessed.
+
+MAGIC = b'DTATOPO\0'
+FORMAT_VERSION = 1
+ALIGN = 64
+
+NODE_TYPES = [Drone, EdgeServer, CloudServer]
+
+
+def _aligned(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+def _to_arrays(topology):
+    nodes = topology.all_nodes
+    index = {node: i for i, node in enumerate(nodes)}
+
+    indptr, indices, link_distance = [0], [], []
+    for node in nodes:
+        for neighbor in node.neighbors:
+            indices.append(index[neighbor])
+            link_distance.append(topology.distance[(node, neighbor)])
+        indptr.append(len(indices))
+
+    tasks = list(chain(*[wf.tasks for wf in topology.workflows]))
+    resource_names = list(Drone.resources.keys())
+    task_ptr = [0]
+    for wf in topology.workflows:
+        task_ptr.append(task_ptr[-1] + wf.n_task)
+
+    arrays = {
+        'node_id': np.array([node.id for node in nodes], dtype=np.int64),
+        'node_pos': np.array([(node.pos_x, node.pos_y) for node in nodes]).reshape(-1, 2),
+        'adj_indptr': np.array(indptr, dtype=np.int64),
+        'adj_indices': np.array(indices, dtype=np.int32),
+        'link_distance': np.array(link_distance, dtype=np.float64),
+        'wf_id': np.array([wf.id for wf in topology.workflows], dtype=np.int64),
+        'wf_task_ptr': np.array(task_ptr, dtype=np.int64),
+        'task_id': np.array([task.id for task in tasks], dtype=np.int64),
+        'task_demand': np.array([[task.required_resources[name] for name in resource_names]
+                                 for task in tasks]).reshape(-1, len(resource_names)),
+    }
+    counts = [len(topology.drones), len(topology.edge_servers), len(topology.cloud_servers)]
+    return arrays, counts, resource_names
+
+
+def save_topology(topology, path):
+    arrays, counts, resource_names = _to_arrays(topology)
+    header = {
+        'version': FORMAT_VERSION,
+        'node_counts': counts,
+        'resources': resource_names,
+        'arrays': {},
+    }
+
+    offset = 0
+    for name, array in arrays.items():
+        offset = _aligned(offset)
+        header['arrays'][name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset += array.nbytes
+
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_start = _aligned(len(MAGIC) + 8 + len(header_bytes))
+    with open(path, 'wb') as fout:
+        fout.write(MAGIC)
+        fout.write(struct.pack('<Q', len(header_bytes)))
+        fout.write(header_bytes)
+        for name, array in arrays.items():
+            fout.write(b'\0' * (data_start + header['arrays'][name]['offset'] - fout.tell()))
+            fout.write(np.ascontiguousarray(array).tobytes())
+
+
+def load_topology(path):
+    return MappedTopology(path)
+
+
+def convert_pickle(src_path, dst_path):
+    # today's dump/topology_*.bin files -> this format
+    with open(src_path, 'rb') as fin:
+        topology = pickle.load(fin)
+    save_topology(topology, dst_path)
+
+
+class MappedTopology(StaticTopology):
+    # a StaticTopology whose contents live in a memory-mapped file written by save_topology()
+    # node / workflow objects, neighbor sets and the distance dict are built on first access
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as fin:
+            if fin.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f'{path}: not a topology file')
+            header_len, = struct.unpack('<Q', fin.read(8))
+            self.header = json.loads(fin.read(header_len).decode('utf-8'))
+
+        if self.header['version'] != FORMAT_VERSION:
+            raise ValueError(f"{path}: unsupported topology format version {self.header['version']}")
+
+        data_start = _aligned(len(MAGIC) + 8 + header_len)
+        buffer = np.memmap(path, dtype=np.uint8, mode='r')
+        self.arrays = {}
+        for name, spec in self.header['arrays'].items():
+            dtype, shape = np.dtype(spec['dtype']), tuple(spec['shape'])
+            if 0 in shape:
+                self.arrays[name] = np.empty(shape, dtype=dtype)
+            else:
+                self.arrays[name] = np.ndarray(shape, dtype=dtype, buffer=buffer,
+                                               offset=data_start + spec['offset'])
+
+        self.n_all_node = len(self.arrays['node_id'])
+        self.n_all_task = len(self.arrays['task_id'])
+        self._reset_tables()
+        self._init_mobility()
+
+    def __reduce__(self):
+        # untouched: the receiver maps the same file instead of unpickling objects
+        if not self.materialized:
+            return load_topology, (self.path,)
+
+        state = {key: value for key, value in self.__dict__.items()
+                 if key not in ('path', 'header', 'arrays', 'listeners', '_grid', '_router')}
+        for name in ('drones', 'edge_servers', 'cloud_servers', 'all_nodes', 'distance',
+                     'workflows', 'all_tasks'):
+            state[name] = getattr(self, name)
+        return StaticTopology.__new__, (StaticTopology,), state
+
+    @property
+    def materialized(self):
+        return 'all_nodes' in self.__dict__ or 'workflows' in self.__dict__
+
+    @cached_property
+    def all_nodes(self):
+        ids = self.arrays['node_id'].tolist()
+        positions = self.arrays['node_pos'].tolist()
+        types = chain(*[[node_type] * n for node_type, n in zip(NODE_TYPES, self.header['node_counts'])])
+
+        nodes = []
+        for i, (node_type, node_id, (x, y)) in enumerate(zip(types, ids, positions)):
+            node = node_type(x, y)
+            node.id = node_id
+            node.index = i
+            nodes.append(node)
+        Node.id_base = max([Node.id_base] + ids)
+
+        indptr = self.arrays['adj_indptr'].tolist()
+        indices = self.arrays['adj_indices'].tolist()
+        for i, node in enumerate(nodes):
+            node.neighbors.update(nodes[j] for j in indices[indptr[i]:indptr[i + 1]])
+
+        return nodes
+
+    @cached_property
+    def drones(self):
+        n_drone = self.header['node_counts'][0]
+        return self.all_nodes[:n_drone]
+
+    @cached_property
+    def edge_servers(self):
+        n_drone, n_edge, _ = self.header['node_counts']
+        return self.all_nodes[n_drone:n_drone + n_edge]
+
+    @cached_property
+    def cloud_servers(self):
+        n_drone, n_edge, _ = self.header['node_counts']
+        return self.all_nodes[n_drone + n_edge:]
+
+    @cached_property
+    def distance(self):
+        # filled in the same order as StaticTopology.__init__ does
+        nodes = self.all_nodes
+        indptr = self.arrays['adj_indptr'].tolist()
+        indices = self.arrays['adj_indices'].tolist()
+        link_distance = self.arrays['link_distance'].tolist()
+
+        distance = {}
+        for i, node1 in enumerate(nodes):
+            for k in range(indptr[i], indptr[i + 1]):
+                node2 = nodes[indices[k]]
+                distance[(node1, node2)] = distance[(node2, node1)] = link_distance[k]
+        return distance
+
+    @cached_property
+    def workflows(self):
+        names = self.header['resources']
+        wf_ids = self.arrays['wf_id'].tolist()
+        task_ptr = self.arrays['wf_task_ptr'].tolist()
+        task_ids = self.arrays['task_id'].tolist()
+        demands = self.arrays['task_demand'].tolist()
+
+        workflows = []
+        for k, wf_id in enumerate(wf_ids):
+            wf = WorkFlow.__new__(WorkFlow)
+            wf.id = wf_id
+            wf.index = k
+            wf.tasks = []
+            for t in range(task_ptr[k], task_ptr[k + 1]):
+                task = Task(wf, Resources(zip(names, demands[t])))
+                task.id = task_ids[t]
+                task.index = t
+                wf.tasks.append(task)
+            wf.n_task = len(wf.tasks)
+            workflows.append(wf)
+
+        WorkFlow.id_base = max([WorkFlow.id_base] + wf_ids)
+        Task.id_base = max([Task.id_base] + task_ids)
+        return workflows
+
+    @cached_property
+    def all_tasks(self):
+        return list(chain(*[wf.tasks for wf in self.workflows]))
+
+    def _adjacency_lists(self):
+        # straight from the file, without creating node objects.
+        # once they exist, the nodes are authoritative (they may have moved, see step())
+        if self.materialized:
+            return super()._adjacency_lists()
+        indptr = self.arrays['adj_indptr'].tolist()
+        indices = self.arrays['adj_indices'].tolist()
+        return [indices[indptr[i]:indptr[i + 1]] for i in range(self.n_all_node)]
+
+
+if __name__ == '__main__':
+    # python topology_io.py dump/topology_large1.bin dump/topology_large1.tpg
+    convert_pickle(sys.argv[1], sys.argv[2])